@@ -0,0 +1,53 @@
+from django.db import IntegrityError, transaction
+
+from .models import ADDRESS_CHOICES, Address
+
+
+def get_or_create_address(user, address_type, street_address,
+                          apartment_address, country, zip):
+    """Return the user's Address of `address_type` matching the given
+    one, creating it if it's new.
+
+    Addresses are matched on their fingerprint, so the same address typed
+    again (whatever its case and spacing) reuses the existing row: one
+    query when it exists.
+    """
+    address = Address(user=user, address_type=address_type,
+                      street_address=street_address,
+                      apartment_address=apartment_address,
+                      country=country, zip=zip)
+    fingerprint = address.compute_fingerprint()
+    existing = Address.objects.filter(
+        user=user, address_type=address_type, fingerprint=fingerprint
+    ).first()
+    if existing is not None:
+        return existing
+    try:
+        with transaction.atomic():
+            address.save()
+    except IntegrityError:
+        # Saved by a concurrent checkout since our SELECT
+        return Address.objects.get(user=user, address_type=address_type,
+                                   fingerprint=fingerprint)
+    return address
+
+
+def get_default_addresses(request):
+    """Return the user's default addresses as {address_type: Address}
+    (None where there is none), fetched in one query once per request.
+
+    Call forget_default_addresses() after changing a default.
+    """
+    if not hasattr(request, '_cached_default_addresses'):
+        defaults = {address_type: None for address_type, _ in ADDRESS_CHOICES}
+        if request.user.is_authenticated:
+            for address in Address.objects.filter(user=request.user,
+                                                  default=True):
+                defaults[address.address_type] = address
+        request._cached_default_addresses = defaults
+    return request._cached_default_addresses
+
+
+def forget_default_addresses(request):
+    if hasattr(request, '_cached_default_addresses'):
+        del request._cached_default_addresses
@@ -1,4 +1,12 @@
+import json
+
 from django.contrib import admin
+from django.core.paginator import Paginator
+from django.db import connections
+from django.utils import timezone
+from django.utils.functional import cached_property
+
+from . import exports, images
 from .models import (
     Payment,
     Item,
@@ -7,18 +15,77 @@ from .models import (
     Address,
     Coupon,
     Refund,
+    StripeEvent,
 )
 # Register your models here.
 
+# Below this many rows (as the planner estimates them), changelists
+# count exactly
+ESTIMATED_COUNT_THRESHOLD = 10000
+
+
+def plan_rows(plan):
+    # The row estimate of an EXPLAIN (FORMAT JSON) result, which psycopg2
+    # has already decoded (json columns) or not (text)
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return int(plan[0]['Plan']['Plan Rows'])
+
+
+def estimated_count(queryset):
+    """The planner's estimate of the rows of `queryset` (PostgreSQL)."""
+    # Not queryset.explain(): on Django 2.2 it returns str() of the
+    # decoded plan, which isn't JSON
+    sql, params = queryset.query.sql_with_params()
+    with connections[queryset.db].cursor() as cursor:
+        cursor.execute('EXPLAIN (FORMAT JSON) ' + sql, params)
+        return plan_rows(cursor.fetchone()[0])
+
+
+class EstimatedCountPaginator(Paginator):
+    """Paginator taking the number of rows of a large changelist from the
+    query planner's estimate on PostgreSQL, rather than from a COUNT(*)
+    that reads the whole table. The last pages may then be off."""
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        if connections[queryset.db].vendor == 'postgresql':
+            estimate = estimated_count(queryset)
+            if estimate >= ESTIMATED_COUNT_THRESHOLD:
+                return estimate
+        return super().count
+
+
+class LargeTableAdmin(admin.ModelAdmin):
+    paginator = EstimatedCountPaginator
+    # Don't count the unfiltered table as well
+    show_full_result_count = False
+
 
 def make_refund_accepted(modeladmin, request, queryset):
-    queryset.update(refund_requested=False, refund_granted=True)
+    queryset.update(refund_requested=False, refund_granted=True,
+                    refund_updated_at=timezone.now())
 
 
 make_refund_accepted.short_description = 'Update orders to refund granted'
 
 
-class OrderAdmin(admin.ModelAdmin):
+def export_orders_csv(modeladmin, request, queryset):
+    return exports.export_response(queryset, 'csv')
+
+
+export_orders_csv.short_description = 'Export selected orders as CSV'
+
+
+def export_orders_jsonl(modeladmin, request, queryset):
+    return exports.export_response(queryset, 'jsonl')
+
+
+export_orders_jsonl.short_description = 'Export selected orders as JSON Lines'
+
+
+class OrderAdmin(LargeTableAdmin):
     list_display = ['user',
                     'ordered',
                     "being_delivered",
@@ -37,8 +104,13 @@ class OrderAdmin(admin.ModelAdmin):
         "payment",
         "coupon",
     ]
-    list_filter = ['user',
-                   'ordered',
+    # Addresses and payments show their user's name
+    list_select_related = ['user', 'shipping_address__user',
+                           'billing_address__user', 'payment__user',
+                           'coupon']
+    # Users are found through the search instead: a filter would list
+    # all of them
+    list_filter = ['ordered',
                    "being_delivered",
                    "received",
                    "refund_requested",
@@ -47,10 +119,55 @@ class OrderAdmin(admin.ModelAdmin):
         "user__username",
         "ref_code"
     ]
-    actions = [make_refund_accepted]
+    autocomplete_fields = ['user', 'coupon']
+    raw_id_fields = ['items', 'shipping_address', 'billing_address',
+                     'payment']
+    actions = [make_refund_accepted, export_orders_csv, export_orders_jsonl]
+
+    def save_model(self, request, obj, form, change):
+        if {'refund_requested', 'refund_granted'} & set(form.changed_data):
+            obj.refund_updated_at = timezone.now()
+        super().save_model(request, obj, form, change)
+
+    def save_related(self, request, form, formsets, change):
+        super().save_related(request, form, formsets, change)
+        # items and coupon may have changed, so rebuild the stored totals;
+        # a paid order keeps the totals it was charged
+        Order.objects.filter(ordered=False,
+                             pk=form.instance.pk).update_totals()
+
+
+class OrderItemAdmin(LargeTableAdmin):
+    list_display = ['__str__', 'user', 'ordered']
+    list_select_related = ['user', 'item']
+    list_filter = ['ordered']
+    search_fields = ['user__username', 'item__title']
+    autocomplete_fields = ['user', 'item']
+
+    def save_model(self, request, obj, form, change):
+        super().save_model(request, obj, form, change)
+        Order.objects.filter(ordered=False, items=obj).update_totals()
+
+
+class ItemAdmin(LargeTableAdmin):
+    list_display = ['title', 'slug', 'price', 'discount_price', 'category',
+                    'label']
+    list_filter = ['category', 'label']
+    search_fields = ['title', 'slug']
+
+    def save_model(self, request, obj, form, change):
+        image_changed = 'image' in form.changed_data
+        if image_changed:
+            # Shown as uploaded until its resized copies exist
+            obj.image_width = obj.image_height = None
+        super().save_model(request, obj, form, change)
+        if image_changed and obj.image:
+            images.schedule_item_derivatives(obj)
+        # Open carts holding this item are charged at its current price
+        Order.objects.filter(ordered=False, items__item=obj).update_totals()
 
 
-class AddressAdmin(admin.ModelAdmin):
+class AddressAdmin(LargeTableAdmin):
     list_display = [
         'user',
         'street_address',
@@ -60,14 +177,52 @@ class AddressAdmin(admin.ModelAdmin):
         'address_type',
         'default'
     ]
+    list_select_related = ['user']
     list_filter = ['default', 'address_type', 'country']
-    search_fields = ['user', 'street_address', 'apartment_address', 'zip']
+    search_fields = ['user__username', 'street_address',
+                     'apartment_address', 'zip']
+    autocomplete_fields = ['user']
+
+    def save_model(self, request, obj, form, change):
+        make_default = obj.default
+        obj.default = False
+        super().save_model(request, obj, form, change)
+        if make_default:
+            obj.make_default()
+
+
+class PaymentAdmin(LargeTableAdmin):
+    list_display = ['stripe_payment_id', 'user', 'amount', 'timestamp']
+    list_select_related = ['user']
+    search_fields = ['stripe_payment_id', 'user__username']
+    autocomplete_fields = ['user']
+
+
+class CouponAdmin(admin.ModelAdmin):
+    list_display = ['code', 'amount']
+    search_fields = ['code']
+
+
+class RefundAdmin(LargeTableAdmin):
+    list_display = ['__str__', 'order', 'accepted', 'email']
+    list_select_related = ['order__user']
+    list_filter = ['accepted']
+    search_fields = ['order__ref_code', 'email']
+    raw_id_fields = ['order']
+
+
+class StripeEventAdmin(LargeTableAdmin):
+    list_display = ['event_id', 'type', 'status', 'attempts',
+                    'received_at', 'processed_at']
+    list_filter = ['status', 'type']
+    search_fields = ['event_id']
 
 
-admin.site.register(Item)
-admin.site.register(OrderItem)
+admin.site.register(Item, ItemAdmin)
+admin.site.register(OrderItem, OrderItemAdmin)
 admin.site.register(Order, OrderAdmin)
 admin.site.register(Address, AddressAdmin)
-admin.site.register(Payment)
-admin.site.register(Coupon)
-admin.site.register(Refund)
+admin.site.register(Payment, PaymentAdmin)
+admin.site.register(Coupon, CouponAdmin)
+admin.site.register(Refund, RefundAdmin)
+admin.site.register(StripeEvent, StripeEventAdmin)
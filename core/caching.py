@@ -0,0 +1,43 @@
+"""Versions keying the cached product fragments and the catalog ETags.
+
+They are derived from the database (Item.updated_at and the number of
+items) rather than stored in the cache: the cache is local to each
+process (see CACHES in the settings), so a version bumped by one worker
+or by a management command would never reach the others. Anything
+changing items in bulk must set updated_at, as import_catalog and
+generate_image_derivatives do.
+"""
+from django.db.models import Count, Max
+
+from .models import Item
+
+
+def item_version(item):
+    # Changes whenever the item is saved
+    return '%x' % int(item.updated_at.timestamp() * 1000000)
+
+
+def attach_item_versions(items):
+    """Set `cache_version` on each item, used to key its cached fragments.
+
+    The version changes whenever the item is saved, so cached fragments
+    never outlive an edit, whichever process made it.
+    """
+    items = list(items)
+    for item in items:
+        item.cache_version = item_version(item)
+    return items
+
+
+def get_catalog_version():
+    """Return (version, last modified) of the catalog as a whole.
+
+    Saving an item moves the latest updated_at and deleting one changes
+    the count, so one aggregate query validates pages listing items.
+    """
+    stamp = Item.objects.aggregate(count=Count('pk'),
+                                   modified=Max('updated_at'))
+    modified = stamp['modified']
+    version = '%d:%x' % (stamp['count'], int(
+        modified.timestamp() * 1000000) if modified else 0)
+    return version, modified
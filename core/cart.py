@@ -0,0 +1,397 @@
+import json
+
+from django.conf import settings
+from django.core import signing
+from django.db import IntegrityError, transaction
+from django.db.models import (Case, Count, F, Prefetch, Q, Subquery, When,
+                              prefetch_related_objects)
+from django.http import Http404
+from django.shortcuts import get_object_or_404
+from django.utils import timezone
+
+from .models import Item, Order, OrderItem
+
+
+def get_active_order(request):
+    """Return the user's unpaid Order (or None), resolved once per request.
+
+    The order comes with its coupon and an `item_count` annotation, which
+    is all the navbar cart badge needs. Views that render the order lines
+    should call prefetch_order_lines() on it as well.
+    For anonymous visitors, see get_guest_cart().
+    """
+    if not hasattr(request, '_cached_active_order'):
+        order = None
+        if request.user.is_authenticated:
+            order = Order.objects.filter(
+                user=request.user, ordered=False
+            ).select_related('coupon').annotate(
+                item_count=Count('items')
+            ).order_by('pk').first()
+        request._cached_active_order = order
+    return request._cached_active_order
+
+
+def forget_active_order(request):
+    # Call after changing the cart if the same request renders it again
+    if hasattr(request, '_cached_active_order'):
+        del request._cached_active_order
+
+
+def prefetch_order_lines(order):
+    prefetch_related_objects(
+        [order],
+        Prefetch('items', queryset=OrderItem.objects.select_related('item')))
+    return order
+
+
+# Cart mutations. Every cart has at most one active (unpaid) Order per
+# user and one active OrderItem per (user, item), both enforced by unique
+# constraints, so a line can be found and changed with a single UPDATE.
+# Transactions lock the OrderItem rows they change before the Order row.
+
+
+def _adjust_totals_by_slug(user, slug, quantity):
+    # Same arithmetic as Order.adjust_totals(), with the item's prices read
+    # by subqueries so that no separate Item lookup is needed
+    items = Item.objects.filter(slug=slug)
+    price = Subquery(items.values('price')[:1])
+    final_price = Subquery(items.annotate(final_price=Case(
+        When(Q(discount_price__isnull=True) | Q(discount_price=0),
+             then=F('price')),
+        default=F('discount_price'),
+    )).values('final_price')[:1])
+    Order.objects.filter(user=user, ordered=False).update(
+        subtotal=F('subtotal') + price * quantity,
+        savings=F('savings') + (price - final_price) * quantity,
+        grand_total=F('grand_total') + final_price * quantity,
+    )
+
+
+def _change_line_quantity(user, slug, quantity, **conditions):
+    updated = OrderItem.objects.filter(
+        user=user, ordered=False, item__slug=slug, **conditions
+    ).update(quantity=F('quantity') + quantity)
+    if updated:
+        _adjust_totals_by_slug(user, slug, quantity)
+    return updated
+
+
+def _lock_active_order(user):
+    order = Order.objects.select_for_update().filter(
+        user=user, ordered=False).first()
+    if order is None:
+        try:
+            with transaction.atomic():
+                order = Order.objects.create(
+                    user=user, ordered_date=timezone.now())
+        except IntegrityError:
+            # Another request created it since our SELECT
+            order = Order.objects.select_for_update().get(
+                user=user, ordered=False)
+    return order
+
+
+def add_item(user, slug):
+    """Add one unit of an item to the user's cart.
+
+    Returns True when the item became a new cart line, False when an
+    existing line's quantity went up. Raises Http404 for unknown slugs.
+    """
+    with transaction.atomic():
+        # Happy path: two UPDATEs, no reads
+        if _change_line_quantity(user, slug, 1):
+            return False
+
+        item = get_object_or_404(Item, slug=slug)
+        order = _lock_active_order(user)
+        try:
+            with transaction.atomic():
+                order_item = OrderItem.objects.create(user=user, item=item)
+        except IntegrityError:
+            # The line was added concurrently, so this is an increment
+            _change_line_quantity(user, slug, 1)
+            return False
+        order.items.add(order_item)
+        order.adjust_totals(item, 1)
+        return True
+
+
+def remove_item(user, slug):
+    """Remove an item's line from the cart. Returns False if it wasn't
+    in the cart."""
+    with transaction.atomic():
+        order_item = OrderItem.objects.select_for_update(
+            of=('self',)
+        ).filter(user=user, ordered=False, item__slug=slug).first()
+        if order_item is None:
+            return False
+        # Deleting the line also removes it from the order
+        order_item.delete()
+        _adjust_totals_by_slug(user, slug, -order_item.quantity)
+        return True
+
+
+def remove_single_item(user, slug):
+    """Take one unit of an item out of the cart, dropping the line when
+    it reaches zero. Returns False if it wasn't in the cart."""
+    with transaction.atomic():
+        if _change_line_quantity(user, slug, -1, quantity__gt=1):
+            return True
+        deleted, per_model = OrderItem.objects.filter(
+            user=user, ordered=False, item__slug=slug, quantity__lte=1
+        ).delete()
+        if not per_model.get(OrderItem._meta.label):
+            return False
+        _adjust_totals_by_slug(user, slug, -1)
+        return True
+
+
+MAX_BATCH_OPERATIONS = 100
+
+
+class InvalidCartOperation(Exception):
+    pass
+
+
+def _parse_operations(operations):
+    if not isinstance(operations, list) or not operations:
+        raise InvalidCartOperation("operations must be a non-empty list")
+    if len(operations) > MAX_BATCH_OPERATIONS:
+        raise InvalidCartOperation(
+            "at most %d operations per request" % MAX_BATCH_OPERATIONS)
+    parsed = []
+    for operation in operations:
+        if not isinstance(operation, dict) or \
+                not isinstance(operation.get('slug'), str):
+            raise InvalidCartOperation("every operation needs a slug")
+        if ('delta' in operation) == ('quantity' in operation):
+            raise InvalidCartOperation(
+                "every operation needs either a delta or a quantity")
+        kind = 'delta' if 'delta' in operation else 'quantity'
+        value = operation[kind]
+        if not isinstance(value, int) or isinstance(value, bool) or \
+                (kind == 'quantity' and value < 0):
+            raise InvalidCartOperation("invalid %s for %s" % (
+                kind, operation['slug']))
+        parsed.append((operation['slug'], kind, value))
+    return parsed
+
+
+def apply_operations(user, operations):
+    """Apply a batch of cart changes in one transaction.
+
+    `operations` is a list of {"slug": ..., "delta": n} (relative) or
+    {"slug": ..., "quantity": n} (absolute) dicts, applied in order.
+    The number of queries does not depend on the number of operations.
+    Raises InvalidCartOperation, changing nothing, if any is invalid.
+    """
+    parsed = _parse_operations(operations)
+    slugs = {slug for slug, kind, value in parsed}
+
+    with transaction.atomic():
+        items = {item.slug: item
+                 for item in Item.objects.filter(slug__in=slugs)}
+        unknown = slugs - set(items)
+        if unknown:
+            raise InvalidCartOperation(
+                "unknown items: %s" % ', '.join(sorted(unknown)))
+
+        # Lines before the order, the order in which add_item() and
+        # friends lock them; the other way round, a batch and a single
+        # change to the same line could deadlock
+        lines = {line.item_id: line
+                 for line in OrderItem.objects.select_for_update().filter(
+                     user=user, ordered=False, item__in=items.values()
+                 ).order_by('pk')}
+        order = _lock_active_order(user)
+
+        quantities = {item.pk: lines[item.pk].quantity if item.pk in lines
+                      else 0 for item in items.values()}
+        for slug, kind, value in parsed:
+            pk = items[slug].pk
+            if kind == 'delta':
+                quantities[pk] = max(quantities[pk] + value, 0)
+            else:
+                quantities[pk] = value
+
+        created, updated, deleted, changes = [], [], [], []
+        for item in items.values():
+            line = lines.get(item.pk)
+            old_quantity = line.quantity if line else 0
+            new_quantity = quantities[item.pk]
+            if new_quantity == old_quantity:
+                continue
+            changes.append((item, new_quantity - old_quantity))
+            if line is None:
+                created.append(OrderItem(
+                    user=user, item=item, quantity=new_quantity))
+            elif new_quantity == 0:
+                deleted.append(line.pk)
+            else:
+                line.quantity = new_quantity
+                updated.append(line)
+
+        if created:
+            OrderItem.objects.bulk_create(created)
+            if any(line.pk is None for line in created):
+                # Backends that can't return the new primary keys
+                created = OrderItem.objects.filter(
+                    user=user, ordered=False,
+                    item__in=[line.item for line in created])
+            Order.items.through.objects.bulk_create([
+                Order.items.through(order_id=order.pk, orderitem_id=line.pk)
+                for line in created])
+        if updated:
+            OrderItem.objects.bulk_update(updated, ['quantity'])
+        if deleted:
+            OrderItem.objects.filter(pk__in=deleted).delete()
+        if changes:
+            order.adjust_totals_many(changes)
+
+    order.refresh_from_db()
+    return prefetch_order_lines(order)
+
+
+# Guest carts. Anonymous visitors' carts live in a signed cookie instead
+# of the database, so browsing and filling a cart writes nothing; they
+# are merged into the user's Order when they log in.
+
+GUEST_CART_COOKIE = 'guest_cart'
+GUEST_CART_SALT = 'core.cart.guest'
+GUEST_CART_MAX_AGE = 30 * 24 * 60 * 60
+# Keeps the cookie well under the 4KB browsers accept
+MAX_GUEST_CART_LINES = 40
+
+
+class GuestCart:
+    """An anonymous visitor's cart, as {slug: quantity}.
+
+    Mirrors add_item(), remove_item() and remove_single_item(). Changes
+    are written back to the cookie by GuestCartMiddleware.
+    """
+
+    def __init__(self, lines=None):
+        self.lines = dict(lines or {})
+        self.modified = False
+
+    @classmethod
+    def from_request(cls, request):
+        try:
+            lines = json.loads(request.get_signed_cookie(
+                GUEST_CART_COOKIE, salt=GUEST_CART_SALT,
+                max_age=GUEST_CART_MAX_AGE))
+        except (KeyError, signing.BadSignature, ValueError):
+            return cls()
+        if not isinstance(lines, dict):
+            return cls()
+        return cls({slug: quantity for slug, quantity in lines.items()
+                    if isinstance(quantity, int) and quantity > 0})
+
+    def add_item(self, slug):
+        if slug in self.lines:
+            self.lines[slug] += 1
+            self.modified = True
+            return False
+        if len(self.lines) >= MAX_GUEST_CART_LINES:
+            raise InvalidCartOperation(
+                "at most %d items in a guest cart" % MAX_GUEST_CART_LINES)
+        if not Item.objects.filter(slug=slug).exists():
+            raise Http404("No item %s" % slug)
+        self.lines[slug] = 1
+        self.modified = True
+        return True
+
+    def remove_item(self, slug):
+        if slug not in self.lines:
+            return False
+        del self.lines[slug]
+        self.modified = True
+        return True
+
+    def remove_single_item(self, slug):
+        if slug not in self.lines:
+            return False
+        if self.lines[slug] > 1:
+            self.lines[slug] -= 1
+            self.modified = True
+            return True
+        return self.remove_item(slug)
+
+    def clear(self):
+        if self.lines:
+            self.lines = {}
+            self.modified = True
+
+    def get_order(self):
+        # One query for the items of all lines
+        items = Item.objects.in_bulk(list(self.lines), field_name='slug')
+        return GuestOrder([
+            OrderItem(item=items[slug], quantity=quantity)
+            for slug, quantity in self.lines.items() if slug in items])
+
+    def save(self, response):
+        if not self.modified:
+            return
+        if self.lines:
+            response.set_signed_cookie(
+                GUEST_CART_COOKIE, json.dumps(self.lines),
+                salt=GUEST_CART_SALT, max_age=GUEST_CART_MAX_AGE,
+                secure=settings.SESSION_COOKIE_SECURE,
+                httponly=True, samesite='Lax')
+        else:
+            response.delete_cookie(GUEST_CART_COOKIE)
+        self.modified = False
+
+
+class GuestOrderItems(list):
+    # Lets templates use order.items.all on a GuestOrder
+    def all(self):
+        return self
+
+
+class GuestOrder:
+    """Stands in for an Order when rendering a guest cart."""
+    coupon = None
+    coupon_discount = 0
+
+    def __init__(self, order_items):
+        self.items = GuestOrderItems(order_items)
+        self.item_count = len(order_items)
+        self.subtotal = sum(order_item.get_total_item_price()
+                            for order_item in order_items)
+        self.savings = sum(order_item.get_total_savings()
+                           for order_item in order_items
+                           if order_item.item.discount_price)
+        self.grand_total = self.subtotal - self.savings
+
+    def get_total(self):
+        return self.grand_total
+
+
+def get_guest_cart(request):
+    """Return the request's GuestCart, read from its cookie once."""
+    if not hasattr(request, '_guest_cart'):
+        request._guest_cart = GuestCart.from_request(request)
+    return request._guest_cart
+
+
+def merge_guest_cart(request, user):
+    """Add the guest cart's lines to the user's cart and empty it.
+
+    Runs as one apply_operations() batch, so the number of queries is
+    bounded whatever the size of the guest cart. Items deleted since
+    they were added are dropped.
+    """
+    guest_cart = get_guest_cart(request)
+    if not guest_cart.lines:
+        return
+    existing = set(Item.objects.filter(
+        slug__in=list(guest_cart.lines)).values_list('slug', flat=True))
+    operations = [{'slug': slug, 'delta': quantity}
+                  for slug, quantity in guest_cart.lines.items()
+                  if slug in existing]
+    if operations:
+        apply_operations(user, operations)
+    guest_cart.clear()
+    forget_active_order(request)
@@ -0,0 +1,124 @@
+"""Conditional GET for the catalog pages.
+
+Their ETags are built from the catalog or item version (core.caching),
+read from the database so that every process agrees on them, and what
+the page shows of the visitor: login state and cart size. A
+revalidation is answered with a 304 before the view runs, without
+rendering anything and, for anonymous visitors, with a single query.
+"""
+import hashlib
+from functools import wraps
+
+from django.contrib import messages
+from django.utils.cache import patch_cache_control, patch_vary_headers
+from django.views.decorators.http import condition
+
+from .caching import get_catalog_version, item_version
+from .cart import get_active_order, get_guest_cart
+from .models import Item
+
+# Seconds anonymous visitors (and shared caches) may reuse a page for
+# without revalidating it
+ANONYMOUS_MAX_AGE = 60
+
+
+def _has_messages(request):
+    return bool(len(messages.get_messages(request)))
+
+
+def _is_personal(request):
+    # Whether the page shows anything of the visitor
+    return request.user.is_authenticated or bool(
+        get_guest_cart(request).lines)
+
+
+def _visitor(request):
+    # Pending messages are shown once, such pages can't be validated
+    if _has_messages(request):
+        return None
+    if request.user.is_authenticated:
+        order = get_active_order(request)
+        return 'user:%d:%d' % (request.user.pk,
+                               order.item_count if order else 0)
+    return 'guest:%d' % len(get_guest_cart(request).lines)
+
+
+def _etag(*parts):
+    return hashlib.md5(':'.join(parts).encode()).hexdigest()
+
+
+def _catalog_version(request):
+    # (version, last modified) of the catalog; one query per request
+    if not hasattr(request, '_catalog_version'):
+        request._catalog_version = get_catalog_version()
+    return request._catalog_version
+
+
+def catalog_etag(request, *args, **kwargs):
+    visitor = _visitor(request)
+    if visitor is None:
+        return None
+    version, modified = _catalog_version(request)
+    return _etag(version, request.get_full_path(), visitor)
+
+
+def catalog_last_modified(request, *args, **kwargs):
+    # Only for pages that are the same for everyone, a date can't tell
+    # that the visitor's cart changed
+    # Deleting an item doesn't move it: only the ETag notices that
+    if _is_personal(request) or _has_messages(request):
+        return None
+    version, modified = _catalog_version(request)
+    return modified
+
+
+def _item_stamp(request, slug):
+    # The item with only its updated_at, or None; one query per request
+    if not hasattr(request, '_item_stamp'):
+        request._item_stamp = Item.objects.filter(slug=slug).only(
+            'updated_at').first()
+    return request._item_stamp
+
+
+def item_etag(request, slug):
+    visitor = _visitor(request)
+    stamp = _item_stamp(request, slug)
+    if visitor is None or stamp is None:
+        return None
+    return _etag(item_version(stamp), visitor)
+
+
+def item_last_modified(request, slug):
+    stamp = _item_stamp(request, slug)
+    if stamp is None or _is_personal(request) or _has_messages(request):
+        return None
+    return stamp.updated_at
+
+
+def catalog_cache_control(view):
+    """Mark catalog pages cacheable for ANONYMOUS_MAX_AGE when they are
+    the same for every visitor, and revalidated on every use otherwise."""
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        # Decided before the view consumes the messages
+        shared = not (_is_personal(request) or _has_messages(request))
+        response = view(request, *args, **kwargs)
+        if response.status_code not in (200, 304):
+            return response
+        if not shared:
+            patch_cache_control(response, private=True, no_cache=True)
+        else:
+            patch_cache_control(response, public=True,
+                                max_age=ANONYMOUS_MAX_AGE)
+        # Logging in or filling a cart changes the page
+        patch_vary_headers(response, ['Cookie'])
+        return response
+    return wrapper
+
+
+def conditional_catalog_page(etag_func, last_modified_func):
+    def decorator(view):
+        return catalog_cache_control(condition(
+            etag_func=etag_func, last_modified_func=last_modified_func
+        )(view))
+    return decorator
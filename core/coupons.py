@@ -0,0 +1,49 @@
+import threading
+import time
+
+from .models import Coupon
+
+COUPON_CACHE_TTL = 60
+# Bounds the memory that guessing random codes can use up
+MAX_CACHED_CODES = 10000
+
+
+class CouponRegistry:
+    """Process-local cache of coupon lookups by code.
+
+    Unknown codes are cached too (as None), so guessing codes doesn't
+    reach the database either. Entries expire after `ttl` seconds; the
+    Coupon signals clear this process's entries on every coupon change,
+    other processes pick changes up when their entries expire.
+    """
+
+    def __init__(self, ttl=COUPON_CACHE_TTL, max_entries=MAX_CACHED_CODES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def get(self, code):
+        now = time.monotonic()
+        entry = self._entries.get(code)
+        if entry is not None and entry[0] > now:
+            return entry[1]
+        coupon = Coupon.objects.filter(code=code).first()
+        with self._lock:
+            if len(self._entries) >= self.max_entries:
+                self._purge(now)
+            self._entries[code] = (now + self.ttl, coupon)
+        return coupon
+
+    def _purge(self, now):
+        self._entries = {code: entry for code, entry in self._entries.items()
+                         if entry[0] > now}
+        if len(self._entries) >= self.max_entries:
+            self._entries = {}
+
+    def clear(self):
+        with self._lock:
+            self._entries = {}
+
+
+coupon_registry = CouponRegistry()
@@ -0,0 +1,189 @@
+"""Streaming exports of orders with their items, payment and refunds.
+
+Used by the order admin's export actions, the staff export URL and the
+export_orders command. Orders are read `chunk_size` at a time and each
+chunk's related rows are prefetched for that chunk only, so memory stays
+flat whatever the number of orders, and the first rows go out before the
+last ones are read.
+"""
+import csv
+import json
+from collections import defaultdict
+from datetime import datetime, time, timedelta
+
+from django.db.models import Q
+from django.http import StreamingHttpResponse
+from django.utils import timezone
+
+from .models import Order, Refund
+
+EXPORT_CHUNK_SIZE = 500
+EXPORT_FORMAT_CHOICES = (
+    ('csv', 'CSV'),
+    ('jsonl', 'JSON Lines'),
+)
+EXPORT_STATUS_CHOICES = (
+    ('not_delivered', 'Not delivered yet'),
+    ('being_delivered', 'Being delivered'),
+    ('received', 'Received'),
+    ('refund_requested', 'Refund requested'),
+    ('refund_granted', 'Refund granted'),
+)
+STATUS_FILTERS = {
+    'not_delivered': Q(being_delivered=False, received=False),
+    'being_delivered': Q(being_delivered=True, received=False),
+    'received': Q(received=True),
+    'refund_requested': Q(refund_requested=True, refund_granted=False),
+    'refund_granted': Q(refund_granted=True),
+}
+CONTENT_TYPES = {
+    'csv': 'text/csv',
+    'jsonl': 'application/x-ndjson',
+}
+COLUMNS = [
+    'order_id', 'ref_code', 'username', 'email', 'ordered_date',
+    'being_delivered', 'received', 'refund_requested', 'refund_granted',
+    'items', 'subtotal', 'savings', 'coupon', 'coupon_discount',
+    'grand_total', 'stripe_payment_id', 'stripe_payment_intent_id',
+    'payment_amount', 'paid_at', 'refunds',
+]
+
+
+def _start_of(day):
+    return timezone.make_aware(datetime.combine(day, time.min))
+
+
+def filter_orders(queryset, since=None, until=None, status=None):
+    """Paid orders of `queryset` ordered on the dates from `since` to
+    `until` (both included), in `status` (see EXPORT_STATUS_CHOICES)."""
+    queryset = queryset.filter(ordered=True)
+    if since:
+        queryset = queryset.filter(ordered_date__gte=_start_of(since))
+    if until:
+        queryset = queryset.filter(
+            ordered_date__lt=_start_of(until + timedelta(days=1)))
+    if status:
+        queryset = queryset.filter(STATUS_FILTERS[status])
+    return queryset
+
+
+def _rupees(paise):
+    # Exact, unlike a float
+    if paise is None:
+        return None
+    sign = '-' if paise < 0 else ''
+    return '%s%d.%02d' % ((sign,) + divmod(abs(paise), 100))
+
+
+def _prefetched(orders):
+    # Two queries per chunk for the items and refunds of its orders, as
+    # plain values: prefetch_related() would build a related manager and
+    # model instances for each of them, several times slower.
+    # No item prices: today's would sit next to totals computed from
+    # older ones. The money is in the order's stored totals and payment
+    pks = [order.pk for order in orders]
+    lines = defaultdict(list)
+    for line in Order.items.through.objects.filter(
+            order_id__in=pks).order_by('pk').values(
+            'order_id', 'orderitem__quantity', 'orderitem__item__slug',
+            'orderitem__item__title'):
+        lines[line['order_id']].append({
+            'slug': line['orderitem__item__slug'],
+            'title': line['orderitem__item__title'],
+            'quantity': line['orderitem__quantity'],
+        })
+    refunds = defaultdict(list)
+    for refund in Refund.objects.filter(order_id__in=pks).order_by(
+            'pk').values('order_id', 'reason', 'accepted', 'email'):
+        refunds[refund.pop('order_id')].append(refund)
+    for order in orders:
+        order.export_items = lines[order.pk]
+        order.export_refunds = refunds[order.pk]
+    return orders
+
+
+def iter_orders(queryset, chunk_size=EXPORT_CHUNK_SIZE):
+    """Yield the orders of `queryset` with their user, payment and
+    coupon, and their items and refunds as export_items and
+    export_refunds."""
+    # iterator() ignores prefetch_related(), so prefetch chunk by chunk
+    queryset = queryset.select_related(
+        'user', 'payment', 'coupon').order_by('pk')
+    chunk = []
+    for order in queryset.iterator(chunk_size=chunk_size):
+        chunk.append(order)
+        if len(chunk) >= chunk_size:
+            yield from _prefetched(chunk)
+            chunk = []
+    yield from _prefetched(chunk)
+
+
+def _timestamp(value):
+    return timezone.localtime(value).isoformat() if value else None
+
+
+def order_record(order):
+    payment = order.payment
+    return {
+        'order_id': order.pk,
+        'ref_code': order.ref_code,
+        'username': order.user.username,
+        'email': order.user.email,
+        'ordered_date': _timestamp(order.ordered_date),
+        'being_delivered': order.being_delivered,
+        'received': order.received,
+        'refund_requested': order.refund_requested,
+        'refund_granted': order.refund_granted,
+        'items': order.export_items,
+        'subtotal': _rupees(order.subtotal),
+        'savings': _rupees(order.savings),
+        'coupon': order.coupon.code if order.coupon else None,
+        'coupon_discount': _rupees(order.coupon_discount),
+        'grand_total': _rupees(order.grand_total),
+        'stripe_payment_id': payment.stripe_payment_id if payment else None,
+        'stripe_payment_intent_id': (payment.stripe_payment_intent_id
+                                     if payment else None),
+        'payment_amount': _rupees(payment.amount) if payment else None,
+        'paid_at': _timestamp(payment.timestamp) if payment else None,
+        'refunds': order.export_refunds,
+    }
+
+
+def _csv_row(record):
+    # One line per order: its items and refunds go in one cell each
+    row = dict(record)
+    row['items'] = '; '.join('%d x %s' % (item['quantity'], item['slug'])
+                             for item in record['items'])
+    row['refunds'] = '; '.join(
+        '%s (%s)' % (refund['reason'],
+                     'accepted' if refund['accepted'] else 'pending')
+        for refund in record['refunds'])
+    return [row[column] for column in COLUMNS]
+
+
+class _Echo:
+    # File-like object for csv.writer returning what it's given
+    def write(self, value):
+        return value
+
+
+def export_lines(queryset, file_format, chunk_size=EXPORT_CHUNK_SIZE):
+    """Yield the orders of `queryset` as lines of CSV (with a header) or
+    JSON Lines."""
+    if file_format == 'csv':
+        writer = csv.writer(_Echo())
+        yield writer.writerow(COLUMNS)
+        for order in iter_orders(queryset, chunk_size):
+            yield writer.writerow(_csv_row(order_record(order)))
+    else:
+        for order in iter_orders(queryset, chunk_size):
+            yield json.dumps(order_record(order)) + '\n'
+
+
+def export_response(queryset, file_format, chunk_size=EXPORT_CHUNK_SIZE):
+    response = StreamingHttpResponse(
+        export_lines(queryset, file_format, chunk_size),
+        content_type=CONTENT_TYPES[file_format])
+    response['Content-Disposition'] = 'attachment; filename="%s"' % (
+        'orders-%s.%s' % (timezone.localdate().isoformat(), file_format))
+    return response
@@ -2,6 +2,8 @@ from django import forms
 from django_countries.fields import CountryField
 from django_countries.widgets import CountrySelectWidget
 
+from .exports import EXPORT_FORMAT_CHOICES, EXPORT_STATUS_CHOICES
+
 PAYMENT_CHOICES = (
     ('S', 'Stripe'),
     ('P', 'PayPal')
@@ -77,3 +79,18 @@ class RefundForm(forms.Form):
         'rows': 4
     }))
     email = forms.EmailField()
+
+
+class OrderExportForm(forms.Form):
+    format = forms.ChoiceField(choices=EXPORT_FORMAT_CHOICES, required=False)
+    since = forms.DateField(required=False)
+    until = forms.DateField(required=False)
+    status = forms.ChoiceField(choices=EXPORT_STATUS_CHOICES, required=False)
+
+    def clean(self):
+        cleaned_data = super().clean()
+        since = cleaned_data.get('since')
+        until = cleaned_data.get('until')
+        if since and until and since > until:
+            raise forms.ValidationError('since is after until')
+        return cleaned_data
@@ -0,0 +1,168 @@
+import hashlib
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import connections, transaction
+from django.utils import timezone
+from PIL import Image
+
+from .models import Item
+
+logger = logging.getLogger(__name__)
+
+DERIVATIVE_DIR = 'derivatives'
+# Where import_catalog stores the images it ingests
+INGESTED_DIR = 'catalog'
+# Widths (in px) of the resized copies made of every Item.image
+DERIVATIVE_WIDTHS = {
+    'thumb': 150,
+    'card': 400,
+    'detail': 800,
+}
+# extension: (Pillow format, save options)
+DERIVATIVE_FORMATS = {
+    'webp': ('WEBP', {'quality': 80, 'method': 4}),
+    'jpg': ('JPEG', {'quality': 82, 'optimize': True, 'progressive': True}),
+}
+# Threads making the copies of newly uploaded images, per process
+UPLOAD_WORKERS = 2
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def derivative_widths(original_width):
+    # Never upscale: images narrower than a size only get the sizes below
+    # them, plus a copy at their own width
+    widths = sorted(w for w in DERIVATIVE_WIDTHS.values()
+                    if w < original_width)
+    if len(widths) < len(DERIVATIVE_WIDTHS):
+        widths.append(original_width)
+    return widths
+
+
+def derivative_name(image_name, width, extension):
+    base = os.path.splitext(image_name)[0]
+    return '%s/%s-%dw.%s' % (DERIVATIVE_DIR, base, width, extension)
+
+
+def generate_derivatives(image_name):
+    """Write every width/format copy of a stored image.
+
+    Returns the original (width, height), or None if the image could not
+    be read. Only touches the storage, never the database, so it can run
+    in worker processes.
+    """
+    try:
+        with default_storage.open(image_name, 'rb') as f:
+            original = Image.open(f)
+            original.load()
+    except (OSError, ValueError) as e:
+        logger.warning("Can't generate derivatives of %s: %s",
+                       image_name, e)
+        return None
+
+    width, height = original.size
+    for target_width in derivative_widths(width):
+        resized = original.copy()
+        resized.thumbnail((target_width, height), Image.LANCZOS)
+        for extension, (image_format, options) in \
+                DERIVATIVE_FORMATS.items():
+            converted = resized
+            if image_format == 'JPEG' and resized.mode != 'RGB':
+                converted = _flatten(resized)
+            buffer = BytesIO()
+            converted.save(buffer, image_format, **options)
+            name = derivative_name(image_name, target_width, extension)
+            if default_storage.exists(name):
+                default_storage.delete(name)
+            default_storage.save(name, ContentFile(buffer.getvalue()))
+    return width, height
+
+
+def _flatten(image):
+    image = image.convert('RGBA')
+    background = Image.new('RGB', image.size, (255, 255, 255))
+    background.paste(image, mask=image.split()[-1])
+    return background
+
+
+def ingest_image(source_path):
+    """Copy a local image file into the storage and make its derivatives.
+
+    The stored name includes a hash of the content, so ingesting the
+    same file again (e.g. when an import is resumed) finds it done.
+    Returns (name, width, height), or None if the file can't be read.
+    Like generate_derivatives(), it never touches the database.
+    """
+    try:
+        with open(source_path, 'rb') as f:
+            data = f.read()
+        with Image.open(BytesIO(data)) as image:
+            width, height = image.size
+    except (OSError, ValueError) as e:
+        logger.warning("Can't ingest %s: %s", source_path, e)
+        return None
+
+    name = '%s/%s-%s' % (INGESTED_DIR, hashlib.sha1(data).hexdigest()[:16],
+                         os.path.basename(source_path))
+    if default_storage.exists(name):
+        largest = derivative_widths(width)[-1]
+        if default_storage.exists(derivative_name(name, largest, 'jpg')):
+            return name, width, height
+    else:
+        name = default_storage.save(name, ContentFile(data))
+    if generate_derivatives(name) is None:
+        return None
+    return name, width, height
+
+
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=UPLOAD_WORKERS,
+                thread_name_prefix='image-derivatives')
+        return _executor
+
+
+def generate_item_derivatives(pk, image_name):
+    """Make the copies of an item's image and record its size.
+
+    The size is only recorded if the item still has that image, so a
+    slow resize can't overwrite a newer upload's.
+    """
+    size = generate_derivatives(image_name)
+    if size is not None:
+        Item.objects.filter(pk=pk, image=image_name).update(
+            image_width=size[0], image_height=size[1],
+            updated_at=timezone.now())
+
+
+def _generate_in_worker(pk, image_name):
+    try:
+        generate_item_derivatives(pk, image_name)
+    except Exception:
+        logger.exception("Can't generate derivatives of %s", image_name)
+    finally:
+        # This thread's connections; the pool may not reuse it for a while
+        connections.close_all()
+
+
+def schedule_item_derivatives(item):
+    """Make the copies of a newly uploaded item image in a worker thread.
+
+    Submitted once the transaction saving the item commits, so the
+    request doesn't wait for the resize and the worker sees the item.
+    The generate_image_derivatives command backfills anything missed,
+    e.g. when the process exits first.
+    """
+    pk, image_name = item.pk, item.image.name
+    transaction.on_commit(lambda: _get_executor().submit(
+        _generate_in_worker, pk, image_name))
@@ -0,0 +1,327 @@
+"""Load-test harness for the shopping funnel, used by the loadtest command.
+
+Every simulated shopper is a separate user driven through the funnel by
+a test Client in its own thread, against whatever database is
+configured. Stripe is replaced by FakeStripe: Checkout Sessions are made
+up locally and the webhook receives correctly signed events for them.
+"""
+import hashlib
+import hmac
+import json
+import logging
+import math
+import threading
+import time
+import uuid
+from unittest import mock
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.test import Client
+from django.test.utils import override_settings
+from django.urls import reverse
+
+from .models import Item, Payment, StripeEvent
+from .payments import process_stripe_events
+from .search import invalidate_search_index
+
+logger = logging.getLogger(__name__)
+
+PREFIX = 'loadtest'
+WEBHOOK_SECRET = 'whsec_%s' % PREFIX
+STEPS = ['home', 'product', 'add_to_cart', 'order_summary', 'checkout',
+         'checkout_session', 'stripe_webhook']
+# Status codes each step answers with when it works
+EXPECTED_STATUS = {
+    'home': (200,),
+    'product': (200,),
+    'add_to_cart': (302,),
+    'order_summary': (200,),
+    'checkout': (302,),
+    'checkout_session': (200,),
+    'stripe_webhook': (200,),
+}
+CHECKOUT_FORM = {
+    'shipping_address': '1 Load Test Road',
+    'shipping_country': 'IN',
+    'shipping_zip': '400001',
+    'same_billing_address': 'on',
+    'payment_option': 'S',
+}
+
+
+class FakeStripe:
+    """Stands in for stripe.checkout.Session.create and signs webhook
+    events the way Stripe does, so stripe_webhook verifies them."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.sessions = {}
+
+    def create_session(self, **kwargs):
+        line_items = kwargs['line_items']
+        session = {
+            'id': 'cs_%s_%s' % (PREFIX, uuid.uuid4().hex),
+            'object': 'checkout.session',
+            'payment_intent': 'pi_%s_%s' % (PREFIX, uuid.uuid4().hex),
+            'amount_total': sum(line['price_data']['unit_amount'] *
+                                line['quantity'] for line in line_items),
+            # Stripe hands metadata back as strings
+            'metadata': {key: '' if value is None else str(value)
+                         for key, value in kwargs['metadata'].items()},
+        }
+        with self.lock:
+            self.sessions[session['id']] = session
+        return mock.Mock(id=session['id'])
+
+    def completed_event(self, session_id):
+        with self.lock:
+            session = self.sessions[session_id]
+        payload = json.dumps({
+            'id': 'evt_%s_%s' % (PREFIX, uuid.uuid4().hex),
+            'object': 'event',
+            'type': 'checkout.session.completed',
+            'data': {'object': session},
+        })
+        timestamp = int(time.time())
+        signature = hmac.new(
+            WEBHOOK_SECRET.encode(),
+            ('%d.%s' % (timestamp, payload)).encode(),
+            hashlib.sha256).hexdigest()
+        return payload, 't=%d,v1=%s' % (timestamp, signature)
+
+
+def seed(items, shoppers):
+    """Make sure there are `items` load-test items and `shoppers` fresh
+    users (without a cart or orders) to browse as."""
+    existing = Item.objects.filter(slug__startswith=PREFIX + '-').count()
+    if existing < items:
+        Item.objects.bulk_create([
+            Item(title='Load test item %d' % index,
+                 slug='%s-item-%d' % (PREFIX, index),
+                 price=(100 + index % 900) * 100,
+                 discount_price=((90 + index % 900) * 100
+                                 if index % 3 == 0 else None),
+                 category=('S', 'SW', 'OW')[index % 3],
+                 label=('P', 'S', 'D')[index % 3],
+                 description='Load test item number %d' % index)
+            for index in range(existing, items)
+        ], batch_size=500)
+        # bulk_create sends no signals
+        invalidate_search_index()
+
+    User = get_user_model()
+    run = uuid.uuid4().hex[:8]
+    User.objects.bulk_create([
+        User(username='%s-%s-%d' % (PREFIX, run, index))
+        for index in range(shoppers)
+    ], batch_size=500)
+    return list(User.objects.filter(
+        username__startswith='%s-%s-' % (PREFIX, run)).order_by('pk'))
+
+
+def cleanup():
+    """Delete everything seed() and the funnel created."""
+    Payment.objects.filter(
+        stripe_payment_id__startswith='cs_%s_' % PREFIX).delete()
+    StripeEvent.objects.filter(
+        event_id__startswith='evt_%s_' % PREFIX).delete()
+    # Takes the users' orders and addresses with them
+    get_user_model().objects.filter(
+        username__startswith=PREFIX + '-').delete()
+    Item.objects.filter(slug__startswith=PREFIX + '-').delete()
+
+
+def run_funnel(shopper, stripe, item):
+    """Drive one Shopper through the funnel, buying `item`. Stops at the
+    first step that fails."""
+    requests = [
+        ('home', lambda: shopper.get(reverse('core:item_list'))),
+        ('product', lambda: shopper.get(item.get_absolute_url())),
+        ('add_to_cart', lambda: shopper.get(item.get_add_to_cart_url())),
+        ('order_summary',
+         lambda: shopper.get(reverse('core:order-summary'))),
+        ('checkout', lambda: shopper.post(reverse('core:checkout'),
+                                          CHECKOUT_FORM)),
+        ('checkout_session', lambda: shopper.post(
+            reverse('core:create-checkout-session'))),
+    ]
+    for step, request in requests:
+        response = request()
+        if not shopper.record(step, response):
+            return
+
+    payload, signature = stripe.completed_event(
+        json.loads(response.content)['id'])
+    response = shopper.post(reverse('core:stripe-webhook'), payload,
+                            content_type='application/json',
+                            HTTP_STRIPE_SIGNATURE=signature)
+    shopper.record('stripe_webhook', response)
+
+
+def percentile(values, percent):
+    # Nearest-rank percentile of sorted values
+    if not values:
+        return None
+    rank = max(math.ceil(percent / 100 * len(values)), 1)
+    return values[rank - 1]
+
+
+def summarize(samples, seconds):
+    latencies = sorted(sample[0] for sample in samples)
+    queries = [sample[1] for sample in samples]
+    return {
+        'requests': len(samples),
+        'errors': sum(1 for sample in samples if not sample[2]),
+        'rps': round(len(samples) / seconds, 2) if seconds else None,
+        'p50_ms': _ms(percentile(latencies, 50)),
+        'p95_ms': _ms(percentile(latencies, 95)),
+        'p99_ms': _ms(percentile(latencies, 99)),
+        'max_ms': _ms(latencies[-1] if latencies else None),
+        'queries_per_request': (round(sum(queries) / len(queries), 2)
+                                if queries else None),
+        'max_queries': max(queries) if queries else None,
+    }
+
+
+def _ms(seconds):
+    return None if seconds is None else round(seconds * 1000, 2)
+
+
+class QueryCounter:
+    """Database execute wrapper counting queries; unlike
+    CaptureQueriesContext it keeps no (capped) log of them."""
+
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+class Shopper:
+    """Test client that times each request and counts its queries."""
+
+    def __init__(self, user, samples, lock):
+        self.client = Client()
+        self.client.force_login(user)
+        self.samples = samples
+        self.lock = lock
+        self.last = None
+
+    def request(self, method, *args, **kwargs):
+        counter = QueryCounter()
+        with connection.execute_wrapper(counter):
+            start = time.perf_counter()
+            try:
+                response = getattr(self.client, method)(*args, **kwargs)
+            except Exception:
+                # The test client re-raises view errors; count them as
+                # failed requests instead
+                logger.exception('Request to %s failed', args[0])
+                response = None
+            seconds = time.perf_counter() - start
+        self.last = (seconds, counter.count)
+        return response
+
+    def get(self, *args, **kwargs):
+        return self.request('get', *args, **kwargs)
+
+    def post(self, *args, **kwargs):
+        return self.request('post', *args, **kwargs)
+
+    def record(self, step, response):
+        seconds, queries = self.last
+        ok = (response is not None and
+              response.status_code in EXPECTED_STATUS[step])
+        with self.lock:
+            self.samples[step].append((seconds, queries, ok))
+        return ok
+
+
+def run(funnels=100, concurrency=10, items=200, fulfil=True):
+    """Run `funnels` shoppers through the funnel, `concurrency` at a time.
+
+    Returns the results as a JSON-serializable dict: for each step the
+    number of requests and errors, requests/sec over the whole run,
+    latency percentiles and queries per request, then the same for all
+    steps together and, with `fulfil`, how fast process_stripe_events
+    drained the webhook events afterwards.
+    """
+    users = seed(items, funnels)
+    catalog = list(Item.objects.filter(
+        slug__startswith=PREFIX + '-').order_by('pk')[:items])
+    stripe = FakeStripe()
+    samples = {step: [] for step in STEPS}
+    lock = threading.Lock()
+    queue = list(enumerate(users))
+
+    def worker():
+        try:
+            while True:
+                with lock:
+                    if not queue:
+                        return
+                    index, user = queue.pop()
+                shopper = Shopper(user, samples, lock)
+                run_funnel(shopper, stripe, catalog[index % len(catalog)])
+        finally:
+            connection.close()
+
+    # The test client's requests come from the 'testserver' host
+    with override_settings(
+            ALLOWED_HOSTS=list(settings.ALLOWED_HOSTS) + ['testserver'],
+            STRIPE_WEBHOOK_KEY=WEBHOOK_SECRET), \
+            mock.patch('stripe.checkout.Session.create',
+                       stripe.create_session):
+        threads = [threading.Thread(target=worker)
+                   for _ in range(concurrency)]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        seconds = time.perf_counter() - start
+
+    results = {
+        'vendor': connection.vendor,
+        'funnels': funnels,
+        'concurrency': concurrency,
+        'items': len(catalog),
+        'seconds': round(seconds, 3),
+        'steps': {step: summarize(samples[step], seconds)
+                  for step in STEPS},
+        'total': summarize([sample for step in STEPS
+                            for sample in samples[step]], seconds),
+    }
+    if fulfil:
+        results['fulfilment'] = drain_inbox()
+    return results
+
+
+def drain_inbox(batch_size=100):
+    """Run process_stripe_events until the inbox is empty."""
+    events = StripeEvent.objects.filter(status='P').count()
+    counter = QueryCounter()
+    processed = failed = 0
+    start = time.perf_counter()
+    with connection.execute_wrapper(counter):
+        while True:
+            done, errors = process_stripe_events(batch_size)
+            processed += done
+            failed += errors
+            if done + errors < batch_size:
+                break
+    seconds = time.perf_counter() - start
+    return {
+        'events': events,
+        'processed': processed,
+        'failed': failed,
+        'seconds': round(seconds, 3),
+        'events_per_second': (round(processed / seconds, 2)
+                              if seconds else None),
+        'queries_per_event': (round(counter.count / processed, 2)
+                              if processed else None),
+    }
@@ -0,0 +1,71 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Case, When
+
+from core.models import Address, Order
+
+
+class Command(BaseCommand):
+    help = ('Fingerprints the addresses saved before fingerprints existed, '
+            'merging the duplicates of each user into one row and '
+            'repointing their orders to it')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500,
+                            help='Number of users per transaction')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        users = Address.objects.filter(fingerprint__isnull=True).values_list(
+            'user_id', flat=True).distinct().order_by('user_id')
+        merged = fingerprinted = 0
+        last_user_id = 0
+        while True:
+            batch = list(users.filter(user_id__gt=last_user_id)[:batch_size])
+            if not batch:
+                break
+            last_user_id = batch[-1]
+            with transaction.atomic():
+                batch_merged, batch_fingerprinted = self.dedupe(batch)
+            merged += batch_merged
+            fingerprinted += batch_fingerprinted
+
+        self.stdout.write(self.style.SUCCESS(
+            'Fingerprinted %d addresses, merged %d duplicates' % (
+                fingerprinted, merged)))
+
+    def dedupe(self, user_ids):
+        groups = {}
+        for address in Address.objects.select_for_update().filter(
+                user_id__in=user_ids).order_by('pk'):
+            key = (address.user_id, address.address_type,
+                   address.compute_fingerprint())
+            groups.setdefault(key, []).append(address)
+
+        replacements = {}
+        changed = []
+        for (user_id, address_type, fingerprint), addresses in \
+                groups.items():
+            # Keep the oldest row, default if any of them was
+            kept = addresses[0]
+            default = any(address.default for address in addresses)
+            for duplicate in addresses[1:]:
+                replacements[duplicate.pk] = kept.pk
+            if kept.fingerprint != fingerprint or kept.default != default:
+                kept.fingerprint = fingerprint
+                kept.default = default
+                changed.append(kept)
+
+        if replacements:
+            for field in ('shipping_address', 'billing_address'):
+                Order.objects.filter(**{
+                    field + '__in': list(replacements)
+                }).update(**{field: Case(*[
+                    When(**{field: duplicate, 'then': kept})
+                    for duplicate, kept in replacements.items()
+                ])})
+            # Before the fingerprints are set, or they'd collide
+            Address.objects.filter(pk__in=list(replacements)).delete()
+        if changed:
+            Address.objects.bulk_update(changed, ['fingerprint', 'default'])
+        return len(replacements), len(changed)
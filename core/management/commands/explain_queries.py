@@ -0,0 +1,125 @@
+import re
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test import Client
+from django.test.utils import (CaptureQueriesContext,
+                               setup_test_environment,
+                               teardown_test_environment)
+from django.urls import reverse
+
+from core.models import Item
+
+# Plan lines of a query that reads a whole table
+SEQ_SCAN_PATTERNS = {
+    'postgresql': re.compile(r'Seq Scan on (\w+)'),
+    'sqlite': re.compile(r'\bSCAN (?:TABLE )?(\w+)\b(?! USING)'),
+}
+EXPLAINABLE = ('SELECT', 'UPDATE', 'DELETE')
+
+
+class Command(BaseCommand):
+    help = ('Requests the shop pages and cart actions as a user, runs '
+            'EXPLAIN on every query they make and reports the ones that '
+            'scan a whole table. Run it against a seeded database: on '
+            'small tables the planner prefers scans anyway. Everything '
+            'it changes is rolled back.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--username',
+                            help='User to browse as (default: the first '
+                                 'user)')
+        parser.add_argument('--fail', action='store_true',
+                            help='Exit with an error if any query scans '
+                                 'a table')
+
+    def handle(self, *args, **options):
+        pattern = SEQ_SCAN_PATTERNS.get(connection.vendor)
+        if pattern is None:
+            raise CommandError("Can't read %s query plans" %
+                               connection.vendor)
+        users = get_user_model().objects.order_by('pk')
+        if options['username']:
+            users = users.filter(username=options['username'])
+        user = users.first()
+        item = Item.objects.order_by('pk').first()
+        if user is None or item is None:
+            raise CommandError('Seed the database with users and items '
+                               'first')
+        self.tables = set(connection.introspection.table_names())
+
+        # For the test client; already done when run by the test runner
+        try:
+            setup_test_environment()
+        except RuntimeError:
+            own_environment = False
+        else:
+            own_environment = True
+        try:
+            with transaction.atomic():
+                scans = self.explain_steps(pattern, user, item)
+                transaction.set_rollback(True)
+        finally:
+            if own_environment:
+                teardown_test_environment()
+
+        if scans:
+            message = '%d queries scan a whole table' % scans
+            if options['fail']:
+                raise CommandError(message)
+            self.stdout.write(self.style.WARNING(message))
+        else:
+            self.stdout.write(self.style.SUCCESS('No sequential scans'))
+
+    def steps(self, item):
+        word = item.title.split()[0] if item.title.split() else item.slug
+        return [
+            ('home', reverse('core:item_list')),
+            ('category', reverse('core:item_list') +
+             '?category=%s' % item.category),
+            ('search', reverse('core:search') + '?q=%s' % word),
+            ('product', item.get_absolute_url()),
+            ('add to cart (new line)', item.get_add_to_cart_url()),
+            ('add to cart (increment)', item.get_add_to_cart_url()),
+            ('order summary', reverse('core:order-summary')),
+            ('cart api', reverse('core:cart-api')),
+            ('checkout', reverse('core:checkout')),
+            ('payment', reverse('core:payment',
+                                kwargs={'payment_option': 'stripe'})),
+            ('remove one', reverse('core:remove-single-item-from-cart',
+                                   kwargs={'slug': item.slug})),
+            ('remove from cart', item.get_remove_from_cart_url()),
+        ]
+
+    def explain_steps(self, pattern, user, item):
+        client = Client()
+        client.force_login(user)
+        scans = 0
+        for name, url in self.steps(item):
+            with CaptureQueriesContext(connection) as queries:
+                client.get(url)
+            self.stdout.write('%s (%s): %d queries' % (
+                name, url, len(queries)))
+            for query in queries:
+                sql = query['sql']
+                if not sql.lstrip().upper().startswith(EXPLAINABLE):
+                    continue
+                tables = self.scanned_tables(pattern, sql)
+                if tables:
+                    scans += 1
+                    self.stdout.write(self.style.WARNING(
+                        '  scans %s: %s' % (', '.join(tables), sql[:300])))
+        return scans
+
+    def scanned_tables(self, pattern, sql):
+        with connection.cursor() as cursor:
+            cursor.execute('%s %s' % (
+                connection.ops.explain_query_prefix(), sql))
+            plan = [str(row[-1]) for row in cursor.fetchall()]
+        tables = []
+        for line in plan:
+            for table in pattern.findall(line):
+                if table in self.tables and table not in tables:
+                    tables.append(table)
+        return tables
@@ -0,0 +1,45 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from core import exports
+from core.forms import OrderExportForm
+from core.models import Order
+
+
+class Command(BaseCommand):
+    help = ('Exports paid orders with their items, payment and refunds as '
+            'CSV or JSON Lines, streamed a chunk of orders at a time')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--format', default='csv',
+                            choices=[code for code, name
+                                     in exports.EXPORT_FORMAT_CHOICES])
+        parser.add_argument('--since', help='First day, YYYY-MM-DD')
+        parser.add_argument('--until', help='Last day, YYYY-MM-DD')
+        parser.add_argument('--status',
+                            choices=[code for code, name
+                                     in exports.EXPORT_STATUS_CHOICES])
+        parser.add_argument('--output',
+                            help='File to write to (default: stdout)')
+        parser.add_argument('--chunk-size', type=int,
+                            default=exports.EXPORT_CHUNK_SIZE)
+
+    def handle(self, *args, **options):
+        # Same validation as the export URL
+        form = OrderExportForm({
+            field: options[field] or ''
+            for field in ('format', 'since', 'until', 'status')})
+        if not form.is_valid():
+            raise CommandError(form.errors.as_text())
+        data = form.cleaned_data
+        orders = exports.filter_orders(
+            Order.objects.all(), data['since'], data['until'], data['status'])
+        lines = exports.export_lines(orders, data['format'],
+                                     options['chunk_size'])
+
+        if options['output']:
+            with open(options['output'], 'w', newline='',
+                      encoding='utf-8') as f:
+                f.writelines(lines)
+        else:
+            for line in lines:
+                self.stdout.write(line, ending='')
@@ -0,0 +1,61 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+from django.utils import timezone
+
+from core.images import generate_derivatives
+from core.models import Item
+
+
+class Command(BaseCommand):
+    # Uploads through the admin get theirs in a worker thread
+    # (images.schedule_item_derivatives); this backfills the rest
+    help = ('Generates the resized WebP/JPEG copies of item images that '
+            'have none yet')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=os.cpu_count(),
+                            help='Number of worker processes')
+        parser.add_argument('--force', action='store_true',
+                            help='Regenerate images that already have '
+                                 'derivatives')
+
+    def handle(self, *args, **options):
+        items = Item.objects.exclude(image='')
+        if not options['force']:
+            items = items.filter(image_width__isnull=True)
+        pks_by_image = {}
+        for pk, image_name in items.values_list('pk', 'image').iterator():
+            pks_by_image.setdefault(image_name, []).append(pk)
+        if not pks_by_image:
+            self.stdout.write(self.style.SUCCESS('Nothing to do'))
+            return
+
+        # Workers only touch the storage; don't let them inherit our
+        # database connections
+        connections.close_all()
+        image_names = list(pks_by_image)
+        failed = 0
+        updated = []
+        now = timezone.now()
+        with ProcessPoolExecutor(max_workers=options['workers']) as pool:
+            results = pool.map(generate_derivatives, image_names,
+                               chunksize=8)
+            for image_name, size in zip(image_names, results):
+                if size is None:
+                    failed += 1
+                    continue
+                for pk in pks_by_image[image_name]:
+                    updated.append(Item(
+                        pk=pk, image_width=size[0], image_height=size[1],
+                        updated_at=now))
+
+        Item.objects.bulk_update(
+            updated, ['image_width', 'image_height', 'updated_at'],
+            batch_size=500)
+
+        self.stdout.write(self.style.SUCCESS(
+            'Generated derivatives for %d images (%d failed)' % (
+                len(image_names) - failed, failed)))
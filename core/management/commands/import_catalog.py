@@ -0,0 +1,250 @@
+import csv
+import json
+import os
+import time
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from decimal import ROUND_HALF_UP, Decimal, InvalidOperation
+
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand, CommandError
+from django.core.validators import validate_slug
+from django.db import connections, transaction
+from django.utils import timezone
+
+from core.images import ingest_image
+from core.models import CATEGORY_CHOICES, LABEL_CHOICES, Item, Order
+from core.search import invalidate_search_index
+
+CATEGORIES = {code for code, name in CATEGORY_CHOICES}
+LABELS = {code for code, name in LABEL_CHOICES}
+# Item fields set from each row (besides the slug and image)
+ROW_FIELDS = ['title', 'price', 'discount_price', 'category', 'label',
+              'description']
+UPDATE_FIELDS = ROW_FIELDS + ['image', 'image_width', 'image_height',
+                              'updated_at']
+PRICE_FIELDS = ['price', 'discount_price']
+
+
+class InvalidRow(Exception):
+    pass
+
+
+def read_rows(path, file_format):
+    """Yield (row number, row) without reading the whole file. JSONL
+    rows are left unparsed so that a bad line only fails that row."""
+    with open(path, newline='', encoding='utf-8') as f:
+        if file_format == 'csv':
+            yield from enumerate(csv.DictReader(f), 1)
+        else:
+            number = 0
+            for line in f:
+                if line.strip():
+                    number += 1
+                    yield number, line
+
+
+def _price(value, field):
+    # Rupees in the file, paise in the database
+    try:
+        price = Decimal(str(value)) * 100
+    except InvalidOperation:
+        raise InvalidRow('invalid %s: %r' % (field, value))
+    if not price.is_finite():
+        raise InvalidRow('invalid %s: %r' % (field, value))
+    if price < 0:
+        raise InvalidRow('negative %s' % field)
+    return int(price.to_integral_value(ROUND_HALF_UP))
+
+
+def clean_row(row):
+    if isinstance(row, str):
+        try:
+            row = json.loads(row)
+        except ValueError as e:
+            raise InvalidRow('invalid JSON: %s' % e)
+        if not isinstance(row, dict):
+            raise InvalidRow('not a JSON object')
+
+    slug = str(row.get('slug') or '').strip()
+    try:
+        validate_slug(slug)
+    except ValidationError:
+        raise InvalidRow('invalid slug: %r' % slug)
+    title = str(row.get('title') or '').strip()
+    if not title or len(title) > 100 or len(slug) > 50:
+        raise InvalidRow('missing or too long title or slug')
+    category = row.get('category')
+    label = row.get('label')
+    if category not in CATEGORIES or label not in LABELS:
+        raise InvalidRow('unknown category %r or label %r' % (
+            category, label))
+    discount_price = row.get('discount_price')
+    return {
+        'slug': slug,
+        'title': title,
+        'price': _price(row.get('price'), 'price'),
+        'discount_price': (_price(discount_price, 'discount_price')
+                           if discount_price not in (None, '') else None),
+        'category': category,
+        'label': label,
+        'description': str(row.get('description') or ''),
+        'image': str(row.get('image') or '').strip(),
+    }
+
+
+class Command(BaseCommand):
+    help = ('Creates or updates Items from a CSV or JSONL file, matched '
+            'by slug. Columns: slug, title, price and discount_price (in '
+            'rupees), category, label, description and image, a path to an '
+            'image file (relative to --images-dir). The file is streamed '
+            'and written in chunks; an interrupted import can be resumed.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('path')
+        parser.add_argument('--format', choices=['csv', 'jsonl'],
+                            help='Default: from the file extension')
+        parser.add_argument('--chunk-size', type=int, default=1000,
+                            help='Rows per transaction')
+        parser.add_argument('--workers', type=int, default=os.cpu_count(),
+                            help='Processes ingesting images')
+        parser.add_argument('--images-dir',
+                            help="Base of relative image paths (default: "
+                                 "the file's directory)")
+        parser.add_argument('--resume', action='store_true',
+                            help='Skip the rows a previous, interrupted '
+                                 'import of the same file committed')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        if not os.path.isfile(path):
+            raise CommandError('No such file: %s' % path)
+        file_format = options['format'] or (
+            'jsonl' if path.endswith(('.jsonl', '.ndjson')) else 'csv')
+        images_dir = options['images_dir'] or os.path.dirname(
+            os.path.abspath(path))
+        checkpoint = path + '.progress'
+        skip = self.read_checkpoint(checkpoint, path) \
+            if options['resume'] else 0
+        if skip:
+            self.stdout.write('Resuming after row %d' % skip)
+
+        stats = Counter()
+        start = time.perf_counter()
+        with ProcessPoolExecutor(max_workers=options['workers']) as pool:
+            chunk = []
+            for number, row in read_rows(path, file_format):
+                if number <= skip:
+                    continue
+                chunk.append((number, row))
+                if len(chunk) >= options['chunk_size']:
+                    self.import_chunk(chunk, pool, images_dir, stats)
+                    self.write_checkpoint(checkpoint, path, number)
+                    self.report(stats, start)
+                    chunk = []
+            if chunk:
+                self.import_chunk(chunk, pool, images_dir, stats)
+                self.report(stats, start)
+
+        if os.path.exists(checkpoint):
+            os.remove(checkpoint)
+        self.stdout.write(self.style.SUCCESS(
+            'Imported %d rows in %.1fs: %d created, %d updated, '
+            '%d unchanged, %d invalid; %d images ingested, %d failed' % (
+                stats['rows'], time.perf_counter() - start,
+                stats['created'], stats['updated'], stats['unchanged'],
+                stats['invalid'],
+                stats['images'], stats['images_failed'])))
+
+    def import_chunk(self, chunk, pool, images_dir, stats):
+        rows = {}
+        for number, row in chunk:
+            stats['rows'] += 1
+            try:
+                cleaned = clean_row(row)
+            except InvalidRow as e:
+                stats['invalid'] += 1
+                self.stderr.write('Row %d: %s' % (number, e))
+                continue
+            # A slug repeated in the chunk: the last row wins
+            rows[cleaned['slug']] = cleaned
+
+        sources = sorted({os.path.join(images_dir, row['image'])
+                          for row in rows.values() if row['image']})
+        images = {}
+        if sources:
+            # Workers only touch the storage; don't let them inherit our
+            # database connections
+            connections.close_all()
+            results = pool.map(ingest_image, sources, chunksize=8)
+            for source, result in zip(sources, results):
+                images[source] = result
+                stats['images' if result else 'images_failed'] += 1
+
+        now = timezone.now()
+        with transaction.atomic():
+            existing = Item.objects.in_bulk(list(rows), field_name='slug')
+            created = []
+            updated = []
+            repriced = []
+            for slug, row in rows.items():
+                item = existing.get(slug) or Item(slug=slug)
+                values = {field: row[field] for field in ROW_FIELDS}
+                image = images.get(os.path.join(images_dir, row['image'])) \
+                    if row['image'] else None
+                if image is not None:
+                    values.update(zip(['image', 'image_width', 'image_height'],
+                                      image))
+                if item.pk and all(getattr(item, field) == value
+                                   for field, value in values.items()):
+                    stats['unchanged'] += 1
+                    continue
+                if item.pk and any(getattr(item, field) != values[field]
+                                   for field in PRICE_FIELDS):
+                    repriced.append(item.pk)
+                for field, value in values.items():
+                    setattr(item, field, value)
+                item.updated_at = now
+                (updated if item.pk else created).append(item)
+            Item.objects.bulk_create(created, batch_size=500)
+            # Small batches: each one is an UPDATE with a CASE per field
+            # listing every row of the batch
+            Item.objects.bulk_update(updated, UPDATE_FIELDS, batch_size=100)
+            # Open carts holding them are charged at the new prices, as
+            # when an item is edited in the admin
+            if repriced:
+                Order.objects.filter(
+                    ordered=False,
+                    items__item__in=repriced).update_totals()
+        stats['created'] += len(created)
+        stats['updated'] += len(updated)
+
+        # bulk_create and bulk_update send no signals
+        invalidate_search_index()
+
+    def report(self, stats, start):
+        seconds = time.perf_counter() - start
+        self.stdout.write('%d rows, %.0f rows/s, %d images' % (
+            stats['rows'], stats['rows'] / seconds if seconds else 0,
+            stats['images']))
+
+    def read_checkpoint(self, checkpoint, path):
+        try:
+            with open(checkpoint) as f:
+                progress = json.load(f)
+        except (OSError, ValueError):
+            return 0
+        stat = os.stat(path)
+        if progress.get('size') != stat.st_size or \
+                progress.get('mtime') != stat.st_mtime:
+            raise CommandError('%s changed since the interrupted import, '
+                               'run it again without --resume' % path)
+        return progress['rows']
+
+    def write_checkpoint(self, checkpoint, path, rows):
+        # Written after the chunk is committed: resuming redoes at most
+        # one chunk, which upserting makes harmless
+        stat = os.stat(path)
+        with open(checkpoint, 'w') as f:
+            json.dump({'size': stat.st_size, 'mtime': stat.st_mtime,
+                       'rows': rows}, f)
@@ -0,0 +1,59 @@
+import json
+
+from django.core.management.base import BaseCommand
+
+from core import loadtest
+
+
+class Command(BaseCommand):
+    help = ('Drives simulated shoppers through the whole funnel, from the '
+            'home page to the Stripe webhook, against a local fake Stripe '
+            'and reports the throughput, latency and queries of each step')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--funnels', type=int, default=100,
+                            help='Number of shoppers to run through the '
+                                 'funnel, each one a new user')
+        parser.add_argument('--concurrency', type=int, default=10,
+                            help='Number of shoppers at a time (threads)')
+        parser.add_argument('--items', type=int, default=200,
+                            help='Number of items to seed and shop from')
+        parser.add_argument('--output',
+                            help='Write the results to this JSON file')
+        parser.add_argument('--no-fulfil', action='store_false',
+                            dest='fulfil',
+                            help="Don't time process_stripe_events on the "
+                                 "webhook events afterwards")
+        parser.add_argument('--cleanup', action='store_true',
+                            help='Delete the seeded users, items and their '
+                                 'orders and payments afterwards')
+
+    def handle(self, *args, **options):
+        results = loadtest.run(options['funnels'], options['concurrency'],
+                               options['items'], options['fulfil'])
+        if options['cleanup']:
+            loadtest.cleanup()
+
+        self.stdout.write('%-18s %8s %6s %8s %8s %8s %8s %8s' % (
+            'step', 'requests', 'errors', 'rps', 'p50 ms', 'p95 ms',
+            'p99 ms', 'queries'))
+        rows = list(results['steps'].items()) + [('total', results['total'])]
+        for step, stats in rows:
+            self.stdout.write(
+                '%-18s %8d %6d %8s %8s %8s %8s %8s' % (
+                    step, stats['requests'], stats['errors'], stats['rps'],
+                    stats['p50_ms'], stats['p95_ms'], stats['p99_ms'],
+                    stats['queries_per_request']))
+        if 'fulfilment' in results:
+            self.stdout.write(
+                'Fulfilment: {processed} events in {seconds}s '
+                '({events_per_second}/s, {queries_per_event} queries each, '
+                '{failed} failed)'.format(**results['fulfilment']))
+
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(results, f, indent=2, sort_keys=True)
+            self.stdout.write('Results written to %s' % options['output'])
+        if results['total']['errors']:
+            self.stdout.write(self.style.WARNING(
+                '%d requests failed' % results['total']['errors']))
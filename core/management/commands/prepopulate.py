@@ -0,0 +1,360 @@
+import random
+import string
+import time
+from contextlib import contextmanager
+from datetime import timedelta
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand, CommandError
+from django.core.management.color import no_style
+from django.db import connection, transaction
+from django.db.models import Max
+from django.utils import timezone
+
+from core.coupons import coupon_registry
+from core.models import (CATEGORY_CHOICES, LABEL_CHOICES, Address, Coupon,
+                         Item, Order, OrderItem, Payment, Refund)
+from core.search import invalidate_search_index
+
+# Marks everything this command creates: usernames, item slugs, coupon
+# codes and Stripe ids start with it
+PREFIX = 'prepop'
+STREETS = ['MG Road', 'Park Street', 'Linking Road', 'Brigade Road',
+           'Anna Salai', 'Residency Road', 'Station Road', 'Church Street']
+COUNTRIES = ['IN'] * 8 + ['US', 'GB']
+REFUND_REASONS = ['Wrong size', 'Arrived damaged', 'Not as described',
+                  'Changed my mind']
+REF_CODE_CHARS = string.ascii_lowercase + string.digits
+
+
+def skewed(rng, n):
+    # Index in range(n), low ones much more often: a few popular items
+    # and regular customers, like real traffic
+    return int(n * rng.random() ** 3)
+
+
+@contextmanager
+def backdated(*fields):
+    # Lets bulk_create write past values into auto_now_add fields
+    for field in fields:
+        field.auto_now_add = False
+    try:
+        yield
+    finally:
+        for field in fields:
+            field.auto_now_add = True
+
+
+class Command(BaseCommand):
+    help = ('Fills the database with synthetic users, items, addresses, '
+            'coupons, carts and paid orders with their payments and '
+            'refunds, for load testing and for looking at query plans at '
+            'production volumes. The same --seed generates the same data.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--users', type=int, default=100)
+        parser.add_argument('--items', type=int, default=200)
+        parser.add_argument('--orders', type=int, default=1000,
+                            help='Number of paid orders')
+        parser.add_argument('--coupons', type=int, default=10)
+        parser.add_argument('--carts', type=float, default=0.2,
+                            help='Fraction of the users with a cart')
+        parser.add_argument('--refunds', type=float, default=0.05,
+                            help='Fraction of the orders with a refund '
+                                 'request')
+        parser.add_argument('--days', type=int, default=365,
+                            help='The orders are spread over this many '
+                                 'days before today')
+        parser.add_argument('--batch-size', type=int, default=5000,
+                            help='Number of rows (or orders) per '
+                                 'transaction')
+        parser.add_argument('--clear', action='store_true',
+                            help='Delete the data of a previous run first')
+
+    def handle(self, *args, **options):
+        if options['orders'] and not (options['users'] and options['items']):
+            raise CommandError('Paid orders need --users and --items')
+        User = get_user_model()
+        if User.objects.filter(username__startswith=PREFIX + '-').exists():
+            if not options['clear']:
+                raise CommandError('The database is prepopulated already, '
+                                   'run with --clear to start over')
+            self.clear()
+
+        self.rng = random.Random(options['seed'])
+        self.batch_size = options['batch_size']
+        self.start = time.perf_counter()
+        # Whole days, so the same seed gives the same dates all day
+        self.today = timezone.now().replace(hour=0, minute=0, second=0,
+                                            microsecond=0)
+        # Primary keys are assigned here rather than read back after
+        # each insert, which most backends can't do for bulk inserts
+        self.next_pk = {
+            model: (model.objects.aggregate(last=Max('pk'))['last'] or 0) + 1
+            for model in (User, Item, Address, Coupon, Payment, Order,
+                          OrderItem)
+        }
+
+        self.create_users(options['users'])
+        self.create_items(options['items'])
+        self.create_addresses()
+        self.create_coupons(options['coupons'])
+        self.create_orders(options['orders'], options['days'],
+                           options['refunds'])
+        self.create_carts(options['carts'])
+
+        # The sequences behind the primary keys set above
+        with connection.cursor() as cursor:
+            for sql in connection.ops.sequence_reset_sql(
+                    no_style(), list(self.next_pk)):
+                cursor.execute(sql)
+        # bulk_create sends no signals
+        invalidate_search_index()
+        coupon_registry.clear()
+
+        self.stdout.write(self.style.SUCCESS(
+            'Prepopulated in %.1fs' % (time.perf_counter() - self.start)))
+
+    def take_pk(self, model):
+        pk = self.next_pk[model]
+        self.next_pk[model] += 1
+        return pk
+
+    def insert(self, model, objects):
+        # One transaction per batch; bulk_create splits it into as many
+        # INSERTs as the backend needs
+        for start in range(0, len(objects), self.batch_size):
+            with transaction.atomic():
+                model.objects.bulk_create(
+                    objects[start:start + self.batch_size])
+
+    def report(self, name, count):
+        self.stdout.write('%d %s (%.1fs)' % (
+            count, name, time.perf_counter() - self.start))
+
+    def create_users(self, count):
+        User = get_user_model()
+        # Hashing is slow on purpose: every user shares one, the
+        # password is PREFIX
+        password = make_password(PREFIX)
+        self.user_pks = []
+        users = []
+        for index in range(count):
+            username = '%s-user-%d' % (PREFIX, index)
+            user = User(
+                pk=self.take_pk(User), username=username, password=password,
+                email='%s@example.com' % username,
+                date_joined=self.today - timedelta(
+                    days=self.rng.randrange(730)))
+            users.append(user)
+            self.user_pks.append(user.pk)
+        self.insert(User, users)
+        self.report('users', count)
+
+    def create_items(self, count):
+        # (pk, price, discount_price) of every item, for the order lines
+        self.items = []
+        items = []
+        for index in range(count):
+            # In paise, whole rupees
+            price = self.rng.randrange(200, 5000, 10) * 100
+            discount_price = None
+            if self.rng.random() < 0.3:
+                discount_price = int(round(
+                    price * self.rng.choice([0.7, 0.8, 0.9]), -2))
+            item = Item(
+                pk=self.take_pk(Item),
+                title='%s item %d' % (PREFIX.title(), index),
+                slug='%s-item-%d' % (PREFIX, index),
+                price=price, discount_price=discount_price,
+                category=self.rng.choice(CATEGORY_CHOICES)[0],
+                label=self.rng.choice(LABEL_CHOICES)[0],
+                description='Synthetic item number %d' % index)
+            items.append(item)
+            self.items.append((item.pk, price, discount_price))
+        self.insert(Item, items)
+        self.report('items', count)
+
+    def new_address(self, user_pk, address_type, default):
+        address = Address(
+            pk=self.take_pk(Address), user_id=user_pk,
+            street_address='%d %s' % (self.rng.randrange(1, 1000),
+                                      self.rng.choice(STREETS)),
+            apartment_address='Flat %d' % self.rng.randrange(1, 100),
+            country=self.rng.choice(COUNTRIES),
+            zip='%06d' % self.rng.randrange(110000, 860000),
+            address_type=address_type, default=default)
+        # Address.save() isn't called
+        address.fingerprint = address.compute_fingerprint()
+        return address
+
+    def create_addresses(self):
+        # A default shipping and billing address per user, and an old
+        # shipping address for some
+        self.addresses = {}
+        addresses = []
+        for user_pk in self.user_pks:
+            shipping = self.new_address(user_pk, 'S', True)
+            billing = self.new_address(user_pk, 'B', True)
+            addresses += [shipping, billing]
+            if self.rng.random() < 0.2:
+                addresses.append(self.new_address(user_pk, 'S', False))
+            self.addresses[user_pk] = (shipping.pk, billing.pk)
+        self.insert(Address, addresses)
+        self.report('addresses', len(addresses))
+
+    def create_coupons(self, count):
+        self.coupons = []
+        coupons = []
+        for index in range(count):
+            coupon = Coupon(pk=self.take_pk(Coupon),
+                            code='%s%d' % (PREFIX.upper(), index),
+                            amount=self.rng.choice([50, 100, 200]) * 100)
+            coupons.append(coupon)
+            self.coupons.append(coupon)
+        self.insert(Coupon, coupons)
+        self.report('coupons', count)
+
+    def new_lines(self, user_pk, ordered, max_lines):
+        # Order items for distinct items, and their totals
+        lines = []
+        item_indexes = set()
+        count = min(self.rng.randint(1, max_lines), len(self.items))
+        while len(item_indexes) < count:
+            item_indexes.add(skewed(self.rng, len(self.items)))
+        subtotal = savings = 0
+        for index in sorted(item_indexes):
+            item_pk, price, discount_price = self.items[index]
+            quantity = self.rng.choice([1, 1, 1, 2, 3])
+            line = OrderItem(pk=self.take_pk(OrderItem), user_id=user_pk,
+                             item_id=item_pk, quantity=quantity,
+                             ordered=ordered)
+            if ordered:
+                line.price = price
+                line.final_price = discount_price or price
+            lines.append(line)
+            subtotal += quantity * price
+            if discount_price:
+                savings += quantity * (price - discount_price)
+        return lines, subtotal, savings
+
+    def create_orders(self, count, days, refund_rate):
+        if not count:
+            return
+        Through = Order.items.through
+        span = timedelta(days=days).total_seconds()
+        totals = {'payments': 0, 'order items': 0, 'refunds': 0}
+        for first in range(0, count, self.batch_size):
+            payments, orders, lines, through, refunds = [], [], [], [], []
+            for index in range(first, min(first + self.batch_size, count)):
+                # Ascending dates, as the primary keys would be
+                ordered_date = self.today - timedelta(
+                    seconds=span * (1 - (index + self.rng.random()) / count))
+                user_index = skewed(self.rng, len(self.user_pks))
+                user_pk = self.user_pks[user_index]
+                order_lines, subtotal, savings = self.new_lines(
+                    user_pk, True, 4)
+                coupon = self.rng.choice(self.coupons) \
+                    if self.coupons and self.rng.random() < 0.1 else None
+                if coupon and coupon.amount >= subtotal - savings:
+                    coupon = None
+                coupon_discount = coupon.amount if coupon else 0
+                grand_total = subtotal - savings - coupon_discount
+
+                payment = Payment(
+                    pk=self.take_pk(Payment),
+                    stripe_payment_id='cs_%s_%d' % (PREFIX, index),
+                    stripe_payment_intent_id='pi_%s_%d' % (PREFIX, index),
+                    user_id=user_pk, amount=grand_total,
+                    timestamp=ordered_date + timedelta(minutes=2),
+                    coupon=coupon.code if coupon else '',
+                    coupon_amount=str(coupon_discount) if coupon else '')
+                shipping_pk, billing_pk = self.addresses[user_pk]
+                age = self.today - ordered_date
+                order = Order(
+                    pk=self.take_pk(Order), user_id=user_pk,
+                    ref_code=''.join(self.rng.choices(REF_CODE_CHARS, k=14)),
+                    start_date=ordered_date - timedelta(
+                        minutes=self.rng.randrange(5, 600)),
+                    ordered_date=ordered_date, ordered=True,
+                    shipping_address_id=shipping_pk,
+                    billing_address_id=billing_pk,
+                    payment_id=payment.pk, coupon=coupon,
+                    being_delivered=age > timedelta(days=1),
+                    received=age > timedelta(days=7),
+                    subtotal=subtotal, savings=savings,
+                    coupon_discount=coupon_discount, grand_total=grand_total)
+                if self.rng.random() < refund_rate:
+                    accepted = self.rng.random() < 0.6
+                    order.refund_requested = True
+                    order.refund_granted = accepted
+                    refunds.append(Refund(
+                        order_id=order.pk, accepted=accepted,
+                        reason=self.rng.choice(REFUND_REASONS),
+                        email='%s-user-%d@example.com' % (PREFIX,
+                                                          user_index)))
+                payments.append(payment)
+                orders.append(order)
+                lines += order_lines
+                through += [Through(order_id=order.pk, orderitem_id=line.pk)
+                            for line in order_lines]
+
+            with transaction.atomic(), backdated(
+                    Payment._meta.get_field('timestamp'),
+                    Order._meta.get_field('start_date')):
+                Payment.objects.bulk_create(payments)
+                Order.objects.bulk_create(orders)
+                OrderItem.objects.bulk_create(lines)
+                Through.objects.bulk_create(through)
+                Refund.objects.bulk_create(refunds)
+            totals['payments'] += len(payments)
+            totals['order items'] += len(lines)
+            totals['refunds'] += len(refunds)
+            self.report('paid orders', first + len(orders))
+        for name, total in totals.items():
+            self.report(name, total)
+
+    def create_carts(self, fraction):
+        Through = Order.items.through
+        carts, lines, through = [], [], []
+        for user_pk in self.user_pks:
+            if not self.items or self.rng.random() >= fraction:
+                continue
+            cart_lines, subtotal, savings = self.new_lines(user_pk, False, 3)
+            started = self.today - timedelta(
+                minutes=self.rng.randrange(1, 60 * 24 * 14))
+            cart = Order(
+                pk=self.take_pk(Order), user_id=user_pk,
+                start_date=started, ordered_date=started,
+                subtotal=subtotal, savings=savings,
+                grand_total=subtotal - savings)
+            carts.append(cart)
+            lines += cart_lines
+            through += [Through(order_id=cart.pk, orderitem_id=line.pk)
+                        for line in cart_lines]
+        with backdated(Order._meta.get_field('start_date')):
+            self.insert(Order, carts)
+        self.insert(OrderItem, lines)
+        self.insert(Through, through)
+        self.report('carts', len(carts))
+
+    def clear(self):
+        User = get_user_model()
+        users = User.objects.filter(username__startswith=PREFIX + '-')
+        # Leaves first, each in one DELETE: QuerySet.delete() would load
+        # every row to follow the cascades itself
+        for queryset in (
+                Refund.objects.filter(order__user__in=users),
+                Order.items.through.objects.filter(order__user__in=users),
+                Order.objects.filter(user__in=users),
+                OrderItem.objects.filter(user__in=users),
+                Payment.objects.filter(user__in=users),
+                Address.objects.filter(user__in=users)):
+            queryset._raw_delete(queryset.db)
+        # Few rows, and other users' rows may point to them
+        users.delete()
+        Item.objects.filter(slug__startswith=PREFIX + '-').delete()
+        Coupon.objects.filter(code__startswith=PREFIX.upper()).delete()
+        self.stdout.write('Deleted the previous prepopulated data')
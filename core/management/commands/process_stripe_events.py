@@ -0,0 +1,44 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from core.payments import MAX_ATTEMPTS, inbox_stats, process_stripe_events
+
+
+class Command(BaseCommand):
+    help = 'Fulfils the Stripe webhook events waiting in the inbox'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=100)
+        parser.add_argument('--max-attempts', type=int, default=MAX_ATTEMPTS)
+        parser.add_argument('--loop', action='store_true',
+                            help='Keep polling the inbox instead of exiting '
+                                 'once it is drained')
+        parser.add_argument('--interval', type=float, default=2,
+                            help='Seconds to wait when the inbox is empty '
+                                 '(with --loop)')
+        parser.add_argument('--stats', action='store_true',
+                            help='Only print the inbox depth and lag')
+
+    def handle(self, *args, **options):
+        if options['stats']:
+            self.print_stats()
+            return
+
+        while True:
+            processed, failed = process_stripe_events(
+                options['batch_size'], options['max_attempts'])
+            if processed or failed:
+                self.stdout.write('Processed %d events, %d failed' % (
+                    processed, failed))
+                self.print_stats()
+            if processed + failed < options['batch_size']:
+                if not options['loop']:
+                    break
+                time.sleep(options['interval'])
+
+    def print_stats(self):
+        stats = inbox_stats()
+        self.stdout.write(
+            'Inbox depth: {depth}, lag: {lag_seconds:.1f}s, '
+            'failed: {failed}'.format(**stats))
@@ -0,0 +1,55 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from core.models import ORDER_TOTAL_FIELDS, Order
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds (or verifies) the stored totals of open carts'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--verify', action='store_true',
+                            help='Only report orders whose stored totals '
+                                 'are out of date, without fixing them')
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        # Stored and computed totals side by side, one query per batch.
+        # Paid orders keep the totals they were charged: recomputing them
+        # at today's prices would no longer match Payment.amount
+        orders = Order.objects.filter(ordered=False).with_totals()
+        orders = orders.order_by('pk').values('pk', *ORDER_TOTAL_FIELDS, *[
+            'computed_' + field for field in ORDER_TOTAL_FIELDS])
+
+        checked = 0
+        stale = []
+        batch_size = options['batch_size']
+        last_pk = 0
+        while True:
+            batch = list(orders.filter(pk__gt=last_pk)[:batch_size])
+            if not batch:
+                break
+            last_pk = batch[-1]['pk']
+            checked += len(batch)
+            rebuilt = []
+            for row in batch:
+                if all(row[field] == row['computed_' + field]
+                       for field in ORDER_TOTAL_FIELDS):
+                    continue
+                stale.append(row['pk'])
+                rebuilt.append(Order(pk=row['pk'], **{
+                    field: row['computed_' + field]
+                    for field in ORDER_TOTAL_FIELDS}))
+            if rebuilt and not options['verify']:
+                Order.objects.bulk_update(rebuilt, ORDER_TOTAL_FIELDS)
+
+        if options['verify']:
+            if stale:
+                raise CommandError(
+                    '%d of %d open carts have stale totals: %s' % (
+                        len(stale), checked,
+                        ', '.join(str(pk) for pk in stale[:20])))
+            self.stdout.write(self.style.SUCCESS(
+                'All %d open cart totals are up to date' % checked))
+        else:
+            self.stdout.write(self.style.SUCCESS(
+                'Checked %d open carts, rebuilt %d' % (checked, len(stale))))
@@ -0,0 +1,26 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from core.rollups import refresh_sales_rollups
+
+
+class Command(BaseCommand):
+    help = ('Updates the daily sales rollups read by the sales dashboard '
+            'with the payments and refunds since the last run. Meant to '
+            'run every few minutes, from cron or similar; overlapping runs '
+            'wait for each other.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rebuild', action='store_true',
+                            help='Recompute every day from the first '
+                                 'payment on')
+
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+        days = refresh_sales_rollups(options['rebuild'])
+        self.stdout.write(self.style.SUCCESS(
+            'Recomputed %d days%s in %.1fs' % (
+                len(days),
+                ' (%s to %s)' % (days[0], days[-1]) if days else '',
+                time.perf_counter() - start)))
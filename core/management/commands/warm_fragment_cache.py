@@ -0,0 +1,42 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.template.loader import render_to_string
+
+from core.caching import attach_item_versions
+from core.models import Item
+
+# Caches that only live as long as this command
+PROCESS_LOCAL_CACHES = [
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+]
+
+
+class Command(BaseCommand):
+    help = 'Renders the cached product card and detail fragments of every item'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        backend = settings.CACHES['default']['BACKEND']
+        if backend in PROCESS_LOCAL_CACHES:
+            raise CommandError(
+                'The cache (%s) is local to each process, there is '
+                'nothing to warm for the web workers' % backend)
+        batch_size = options['batch_size']
+        warmed = 0
+        last_pk = 0
+        while True:
+            items = list(Item.objects.filter(
+                pk__gt=last_pk).order_by('pk')[:batch_size])
+            if not items:
+                break
+            last_pk = items[-1].pk
+            for item in attach_item_versions(items):
+                # Rendering fills the {% cache %} blocks of both templates
+                render_to_string('item_card.html', {'item': item})
+                render_to_string('product_detail.html', {'object': item})
+                warmed += 1
+        self.stdout.write(self.style.SUCCESS(
+            'Warmed fragments for %d items' % warmed))
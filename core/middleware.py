@@ -0,0 +1,183 @@
+import json
+import logging
+import random
+import threading
+import time
+from collections import Counter, defaultdict
+from contextlib import ExitStack, contextmanager
+
+from django.conf import settings
+from django.db import connections
+from django.template.backends.django import Template
+
+logger = logging.getLogger(__name__)
+
+# Statements listed in a slow request's log record
+REPEATED_SQL_LIMIT = 5
+
+_state = threading.local()
+# Both render() and TemplateResponse go through the backend's Template
+_template_render = Template.render
+_timed_templates_lock = threading.Lock()
+_timed_templates_users = 0
+
+
+class RequestTiming:
+    """What one request spent in the database and in templates.
+
+    Installed as an execute wrapper on the database connections, it also
+    counts how often each SQL statement ran: with the parameters left
+    out, a statement run once per row of a list is an N+1.
+    """
+
+    def __init__(self):
+        self.queries = 0
+        self.db_time = 0.0
+        self.template_time = 0.0
+        self.rendering = False
+        self.statements = Counter()
+        self.statement_time = defaultdict(float)
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            elapsed = time.perf_counter() - start
+            self.queries += 1
+            self.db_time += elapsed
+            self.statements[sql] += 1
+            self.statement_time[sql] += elapsed
+
+    def repeated(self):
+        return [
+            {'sql': sql, 'count': count,
+             'ms': _ms(self.statement_time[sql])}
+            for sql, count in self.statements.most_common(
+                REPEATED_SQL_LIMIT)
+            if count > 1
+        ]
+
+
+def _timed_render(self, *args, **kwargs):
+    timing = getattr(_state, 'timing', None)
+    # Templates rendered while rendering another one are part of its
+    # time already, and other threads' unsampled requests aren't timed
+    if timing is None or timing.rendering:
+        return _template_render(self, *args, **kwargs)
+    timing.rendering = True
+    start = time.perf_counter()
+    try:
+        return _template_render(self, *args, **kwargs)
+    finally:
+        timing.template_time += time.perf_counter() - start
+        timing.rendering = False
+
+
+@contextmanager
+def timed_templates(timing):
+    """Add the time spent rendering templates in this thread to `timing`.
+
+    Template.render is only wrapped while at least one thread is inside
+    this block, so unsampled traffic renders templates untouched.
+    """
+    global _timed_templates_users
+    with _timed_templates_lock:
+        if not _timed_templates_users:
+            Template.render = _timed_render
+        _timed_templates_users += 1
+    _state.timing = timing
+    try:
+        yield timing
+    finally:
+        _state.timing = None
+        with _timed_templates_lock:
+            _timed_templates_users -= 1
+            if not _timed_templates_users:
+                Template.render = _template_render
+
+
+def _ms(seconds):
+    return round(seconds * 1000, 1)
+
+
+class RequestTimingMiddleware:
+    """Times requests and reports it in a Server-Timing header.
+
+    A REQUEST_TIMING_SAMPLE_RATE fraction of requests is instrumented:
+    their queries are counted and timed, and so are their templates.
+    Any request slower than REQUEST_TIMING_SLOW_MS is logged, with the
+    most repeated SQL statements when it was sampled. Goes first in
+    MIDDLEWARE so that the total covers the other middleware too.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.sample_rate = getattr(settings, 'REQUEST_TIMING_SAMPLE_RATE', 1)
+        self.slow_ms = getattr(settings, 'REQUEST_TIMING_SLOW_MS', 500)
+
+    def __call__(self, request):
+        start = time.perf_counter()
+        if random.random() >= self.sample_rate:
+            response = self.get_response(request)
+            total_ms = _ms(time.perf_counter() - start)
+            if total_ms >= self.slow_ms:
+                self.log(request, response, {'total_ms': total_ms,
+                                             'sampled': False})
+            return response
+
+        timing = RequestTiming()
+        with ExitStack() as stack:
+            stack.enter_context(timed_templates(timing))
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(timing))
+            response = self.get_response(request)
+        end = time.perf_counter()
+
+        record = {
+            'total_ms': _ms(end - start),
+            # Up to the response, including the template rendered by the
+            # view; missing if no view was reached
+            'view_ms': _ms(end - getattr(request, '_view_start', end)),
+            'db_ms': _ms(timing.db_time),
+            'queries': timing.queries,
+            'template_ms': _ms(timing.template_time),
+            'sampled': True,
+        }
+        response['Server-Timing'] = ', '.join([
+            'db;dur=%s;desc="%d queries"' % (record['db_ms'],
+                                             record['queries']),
+            'tpl;dur=%s' % record['template_ms'],
+            'view;dur=%s' % record['view_ms'],
+            'total;dur=%s' % record['total_ms'],
+        ])
+        if record['total_ms'] >= self.slow_ms:
+            record['repeated_sql'] = timing.repeated()
+            self.log(request, response, record)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        request._view_start = time.perf_counter()
+
+    def log(self, request, response, record):
+        record.update({
+            'method': request.method,
+            'path': request.path,
+            'status': response.status_code,
+        })
+        logger.warning('Slow request %s', json.dumps(record, sort_keys=True))
+
+
+class GuestCartMiddleware:
+    """Writes back the guest cart cookie of requests that changed it
+    (see core.cart.GuestCart)."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        response = self.get_response(request)
+        guest_cart = getattr(request, '_guest_cart', None)
+        if guest_cart is not None:
+            guest_cart.save(response)
+        return response
@@ -0,0 +1,56 @@
+# Generated by Django 2.2 on 2026-10-18 19:58
+
+from django.db import migrations, models
+
+
+def populate_totals(apps, schema_editor):
+    Order = apps.get_model('core', 'Order')
+    orders = Order.objects.select_related('coupon').prefetch_related(
+        'items__item')
+    for order in orders:
+        subtotal = 0
+        savings = 0
+        for order_item in order.items.all():
+            item = order_item.item
+            subtotal += order_item.quantity * item.price
+            if item.discount_price:
+                savings += order_item.quantity * (
+                    item.price - item.discount_price)
+        coupon_discount = order.coupon.amount if order.coupon else 0
+        Order.objects.filter(pk=order.pk).update(
+            subtotal=subtotal,
+            savings=savings,
+            coupon_discount=coupon_discount,
+            grand_total=subtotal - savings - coupon_discount,
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='coupon_discount',
+            field=models.FloatField(default=0),
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='grand_total',
+            field=models.FloatField(default=0),
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='savings',
+            field=models.FloatField(default=0),
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='subtotal',
+            field=models.FloatField(default=0),
+        ),
+        migrations.RunPython(populate_totals, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 2.2 on 2026-10-18 20:21
+
+from django.db import migrations
+
+SEARCH_VECTOR_SQL = (
+    "setweight(to_tsvector('english', coalesce(title, '')), 'A') || "
+    "setweight(to_tsvector('english', coalesce(description, '')), 'B')"
+)
+
+
+def create_search_index(apps, schema_editor):
+    # Other backends search through core.search.InvertedIndex instead
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute(
+        'CREATE INDEX core_item_search_idx ON core_item '
+        'USING gin ((%s))' % SEARCH_VECTOR_SQL)
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute('DROP INDEX IF EXISTS core_item_search_idx')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0002_order_totals'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,78 @@
+# Generated by Django 2.2 on 2026-10-18 21:02
+
+from django.db import migrations, models
+from django.db.models import Count, Sum
+
+
+def rebuild_totals(order):
+    subtotal = 0
+    savings = 0
+    for order_item in order.items.select_related('item'):
+        item = order_item.item
+        subtotal += order_item.quantity * item.price
+        if item.discount_price:
+            savings += order_item.quantity * (
+                item.price - item.discount_price)
+    coupon_discount = order.coupon.amount if order.coupon else 0
+    type(order).objects.filter(pk=order.pk).update(
+        subtotal=subtotal,
+        savings=savings,
+        coupon_discount=coupon_discount,
+        grand_total=subtotal - savings - coupon_discount,
+    )
+
+
+def merge_duplicate_carts(apps, schema_editor):
+    Order = apps.get_model('core', 'Order')
+    OrderItem = apps.get_model('core', 'OrderItem')
+
+    # Lines the old remove views detached from the cart but left behind
+    OrderItem.objects.filter(ordered=False, order__isnull=True).delete()
+
+    touched = set()
+    duplicate_orders = Order.objects.filter(ordered=False).values(
+        'user').annotate(count=Count('pk')).filter(count__gt=1)
+    for row in duplicate_orders:
+        orders = list(Order.objects.filter(
+            user=row['user'], ordered=False).order_by('pk'))
+        kept = orders[0]
+        for order in orders[1:]:
+            kept.items.add(*order.items.all())
+            order.delete()
+        touched.add(kept.pk)
+
+    duplicate_lines = OrderItem.objects.filter(ordered=False).values(
+        'user', 'item').annotate(
+            count=Count('pk'), quantity=Sum('quantity')).filter(count__gt=1)
+    for row in duplicate_lines:
+        lines = list(OrderItem.objects.filter(
+            user=row['user'], item=row['item'], ordered=False).order_by('pk'))
+        OrderItem.objects.filter(pk=lines[0].pk).update(
+            quantity=row['quantity'])
+        OrderItem.objects.filter(
+            pk__in=[line.pk for line in lines[1:]]).delete()
+        touched.update(Order.objects.filter(
+            items=lines[0]).values_list('pk', flat=True))
+
+    for order in Order.objects.filter(pk__in=touched):
+        rebuild_totals(order)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0004_item_image_size'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicate_carts,
+                             migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='order',
+            constraint=models.UniqueConstraint(condition=models.Q(ordered=False), fields=('user',), name='unique_active_order'),
+        ),
+        migrations.AddConstraint(
+            model_name='orderitem',
+            constraint=models.UniqueConstraint(condition=models.Q(ordered=False), fields=('user', 'item'), name='unique_active_order_item'),
+        ),
+    ]
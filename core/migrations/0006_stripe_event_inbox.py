@@ -0,0 +1,33 @@
+# Generated by Django 2.2 on 2026-10-18 21:37
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0005_unique_active_cart'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StripeEvent',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('event_id', models.CharField(max_length=100, unique=True)),
+                ('type', models.CharField(max_length=100)),
+                ('payload', models.TextField()),
+                ('status', models.CharField(choices=[('P', 'Pending'), ('D', 'Done'), ('F', 'Failed')], default='P', max_length=1)),
+                ('attempts', models.PositiveIntegerField(default=0)),
+                ('last_error', models.TextField(blank=True)),
+                ('received_at', models.DateTimeField(auto_now_add=True)),
+                ('next_attempt_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('processed_at', models.DateTimeField(blank=True, null=True)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='stripeevent',
+            index=models.Index(fields=['status', 'next_attempt_at'], name='core_stripeevent_due_idx'),
+        ),
+    ]
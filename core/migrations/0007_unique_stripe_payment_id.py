@@ -0,0 +1,35 @@
+# Generated by Django 2.2 on 2026-10-18 22:05
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def merge_duplicate_payments(apps, schema_editor):
+    # Replayed webhooks used to record the same Checkout Session twice
+    Order = apps.get_model('core', 'Order')
+    Payment = apps.get_model('core', 'Payment')
+    duplicates = Payment.objects.values('stripe_payment_id').annotate(
+        count=Count('pk')).filter(count__gt=1)
+    for row in duplicates:
+        payments = list(Payment.objects.filter(
+            stripe_payment_id=row['stripe_payment_id']).order_by('pk'))
+        extra = [payment.pk for payment in payments[1:]]
+        Order.objects.filter(payment__in=extra).update(payment=payments[0])
+        Payment.objects.filter(pk__in=extra).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0006_stripe_event_inbox'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicate_payments,
+                             migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='payment',
+            name='stripe_payment_id',
+            field=models.CharField(max_length=100, unique=True),
+        ),
+    ]
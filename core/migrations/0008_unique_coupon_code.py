@@ -0,0 +1,36 @@
+# Generated by Django 2.2 on 2026-10-18 22:31
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def merge_duplicate_coupons(apps, schema_editor):
+    Coupon = apps.get_model('core', 'Coupon')
+    Order = apps.get_model('core', 'Order')
+    duplicates = Coupon.objects.values('code').annotate(
+        count=Count('pk')).filter(count__gt=1)
+    for row in duplicates:
+        # Coupon.objects.get(code=...) used to fail on these, keep the
+        # oldest one
+        coupons = list(Coupon.objects.filter(
+            code=row['code']).order_by('pk'))
+        extra = [coupon.pk for coupon in coupons[1:]]
+        Order.objects.filter(coupon__in=extra).update(coupon=coupons[0])
+        Coupon.objects.filter(pk__in=extra).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0007_unique_stripe_payment_id'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicate_coupons,
+                             migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='coupon',
+            name='code',
+            field=models.CharField(max_length=15, unique=True),
+        ),
+    ]
@@ -0,0 +1,94 @@
+# Generated by Django 2.2 on 2026-10-18 22:58
+
+import random
+import string
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def remove_duplicates(apps, schema_editor):
+    Item = apps.get_model('core', 'Item')
+    Order = apps.get_model('core', 'Order')
+    Address = apps.get_model('core', 'Address')
+
+    # Later items with a taken slug get their pk appended to it
+    slugs = Item.objects.values('slug').annotate(
+        count=Count('pk')).filter(count__gt=1)
+    for row in slugs:
+        items = Item.objects.filter(slug=row['slug']).order_by('pk')
+        for item in items[1:]:
+            suffix = '-%d' % item.pk
+            item.slug = item.slug[:50 - len(suffix)] + suffix
+            item.save(update_fields=['slug'])
+
+    # Carts have no reference code yet
+    Order.objects.filter(ref_code='').update(ref_code=None)
+    ref_codes = Order.objects.exclude(ref_code=None).values(
+        'ref_code').annotate(count=Count('pk')).filter(count__gt=1)
+    for row in ref_codes:
+        orders = Order.objects.filter(
+            ref_code=row['ref_code']).order_by('pk')
+        for order in orders[1:]:
+            order.ref_code = ''.join(random.choices(
+                string.ascii_lowercase + string.digits, k=14))
+            order.save(update_fields=['ref_code'])
+
+    # Keep the most recent of several default addresses
+    defaults = Address.objects.filter(default=True).values(
+        'user', 'address_type').annotate(
+        count=Count('pk')).filter(count__gt=1)
+    for row in defaults:
+        addresses = Address.objects.filter(
+            user=row['user'], address_type=row['address_type'],
+            default=True).order_by('-pk')
+        Address.objects.filter(
+            pk__in=[address.pk for address in addresses[1:]]
+        ).update(default=False)
+
+
+def restore_empty_ref_codes(apps, schema_editor):
+    Order = apps.get_model('core', 'Order')
+    Order.objects.filter(ref_code=None).update(ref_code='')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0008_unique_coupon_code'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='order',
+            name='ref_code',
+            field=models.CharField(blank=True, max_length=20, null=True),
+        ),
+        migrations.RunPython(remove_duplicates, restore_empty_ref_codes),
+        migrations.AlterField(
+            model_name='item',
+            name='slug',
+            field=models.SlugField(unique=True),
+        ),
+        migrations.AlterField(
+            model_name='order',
+            name='ref_code',
+            field=models.CharField(blank=True, max_length=20, null=True, unique=True),
+        ),
+        migrations.AddIndex(
+            model_name='address',
+            index=models.Index(fields=['user', 'address_type', 'default'], name='core_address_lookup_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='item',
+            index=models.Index(fields=['category', 'id'], name='core_item_category_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['user', 'ordered'], name='core_order_user_ordered_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='address',
+            constraint=models.UniqueConstraint(condition=models.Q(default=True), fields=('user', 'address_type'), name='unique_default_address'),
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 2.2 on 2026-10-18 23:24
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0009_indexes_and_constraints'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='address',
+            name='fingerprint',
+            field=models.CharField(blank=True, editable=False, max_length=64, null=True),
+        ),
+        migrations.AddConstraint(
+            model_name='address',
+            constraint=models.UniqueConstraint(fields=('user', 'address_type', 'fingerprint'), name='unique_address_fingerprint'),
+        ),
+    ]
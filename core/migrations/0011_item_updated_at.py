@@ -0,0 +1,18 @@
+# Generated by Django 2.2 on 2026-10-18 23:52
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0010_address_fingerprint'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='item',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True),
+        ),
+    ]
@@ -0,0 +1,55 @@
+# Generated by Django 2.2 on 2026-10-19 00:21
+
+from django.db import migrations
+from django.db.models import F
+from django.db.models.functions import Round
+
+# Rupee amounts, multiplied by 100 here while the columns are still
+# floats; 0013 then makes them integers
+MONEY_FIELDS = {
+    'Item': ['price', 'discount_price'],
+    'Order': ['subtotal', 'savings', 'coupon_discount', 'grand_total'],
+    'Coupon': ['amount'],
+    'Payment': ['amount'],
+}
+
+
+def _convert_coupon_amounts(Payment, convert):
+    # A CharField holding what the checkout sent to Stripe
+    payments = []
+    for payment in Payment.objects.exclude(coupon_amount=None).exclude(
+            coupon_amount='').iterator():
+        try:
+            amount = float(payment.coupon_amount)
+        except ValueError:
+            continue
+        payment.coupon_amount = convert(amount)
+        payments.append(payment)
+    Payment.objects.bulk_update(payments, ['coupon_amount'], batch_size=500)
+
+
+def to_paise(apps, schema_editor):
+    for model_name, fields in MONEY_FIELDS.items():
+        apps.get_model('core', model_name).objects.update(**{
+            field: Round(F(field) * 100) for field in fields})
+    _convert_coupon_amounts(apps.get_model('core', 'Payment'),
+                            lambda amount: str(round(amount * 100)))
+
+
+def to_rupees(apps, schema_editor):
+    for model_name, fields in MONEY_FIELDS.items():
+        apps.get_model('core', model_name).objects.update(**{
+            field: F(field) / 100.0 for field in fields})
+    _convert_coupon_amounts(apps.get_model('core', 'Payment'),
+                            lambda amount: str(amount / 100))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0011_item_updated_at'),
+    ]
+
+    operations = [
+        migrations.RunPython(to_paise, to_rupees),
+    ]
@@ -0,0 +1,53 @@
+# Generated by Django 2.2 on 2026-10-19 00:22
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0012_money_to_paise'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='coupon',
+            name='amount',
+            field=models.IntegerField(help_text='In paise'),
+        ),
+        migrations.AlterField(
+            model_name='item',
+            name='discount_price',
+            field=models.IntegerField(blank=True, help_text='In paise', null=True),
+        ),
+        migrations.AlterField(
+            model_name='item',
+            name='price',
+            field=models.IntegerField(help_text='In paise'),
+        ),
+        migrations.AlterField(
+            model_name='order',
+            name='coupon_discount',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AlterField(
+            model_name='order',
+            name='grand_total',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AlterField(
+            model_name='order',
+            name='savings',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AlterField(
+            model_name='order',
+            name='subtotal',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AlterField(
+            model_name='payment',
+            name='amount',
+            field=models.IntegerField(),
+        ),
+    ]
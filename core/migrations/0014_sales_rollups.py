@@ -0,0 +1,92 @@
+# Generated by Django 2.2 on 2026-10-19 00:47
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0013_money_integer_fields'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyCategorySales',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('orders', models.PositiveIntegerField(default=0)),
+                ('units', models.PositiveIntegerField(default=0)),
+                ('revenue', models.BigIntegerField(default=0)),
+                ('discount', models.BigIntegerField(default=0)),
+                ('refund_requests', models.PositiveIntegerField(default=0)),
+                ('refunds_granted', models.PositiveIntegerField(default=0)),
+                ('category', models.CharField(choices=[('S', 'Shirt'), ('SW', 'Sport Wear'), ('OW', 'Outerwear')], max_length=2)),
+            ],
+            options={
+                'verbose_name_plural': 'Daily category sales',
+            },
+        ),
+        migrations.CreateModel(
+            name='DailyItemSales',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('orders', models.PositiveIntegerField(default=0)),
+                ('units', models.PositiveIntegerField(default=0)),
+                ('revenue', models.BigIntegerField(default=0)),
+                ('discount', models.BigIntegerField(default=0)),
+                ('refund_requests', models.PositiveIntegerField(default=0)),
+                ('refunds_granted', models.PositiveIntegerField(default=0)),
+            ],
+            options={
+                'verbose_name_plural': 'Daily item sales',
+            },
+        ),
+        migrations.CreateModel(
+            name='DailySales',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('orders', models.PositiveIntegerField(default=0)),
+                ('units', models.PositiveIntegerField(default=0)),
+                ('revenue', models.BigIntegerField(default=0)),
+                ('discount', models.BigIntegerField(default=0)),
+                ('refund_requests', models.PositiveIntegerField(default=0)),
+                ('refunds_granted', models.PositiveIntegerField(default=0)),
+            ],
+            options={
+                'verbose_name_plural': 'Daily sales',
+            },
+        ),
+        migrations.CreateModel(
+            name='RollupWatermark',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=50, unique=True)),
+                ('timestamp', models.DateTimeField(blank=True, null=True)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='payment',
+            index=models.Index(fields=['timestamp'], name='core_payment_timestamp_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='dailysales',
+            constraint=models.UniqueConstraint(fields=('date',), name='unique_daily_sales'),
+        ),
+        migrations.AddField(
+            model_name='dailyitemsales',
+            name='item',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='core.Item'),
+        ),
+        migrations.AddConstraint(
+            model_name='dailycategorysales',
+            constraint=models.UniqueConstraint(fields=('date', 'category'), name='unique_daily_category_sales'),
+        ),
+        migrations.AddConstraint(
+            model_name='dailyitemsales',
+            constraint=models.UniqueConstraint(fields=('date', 'item'), name='unique_daily_item_sales'),
+        ),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 2.2 on 2026-10-19 01:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0014_sales_rollups'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='order',
+            name='core_order_user_ordered_idx',
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['user', 'ordered', 'ordered_date'], name='core_order_user_history_idx'),
+        ),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 2.2 on 2026-10-19 01:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0015_order_history_index'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='item',
+            index=models.Index(fields=['price', 'id'], name='core_item_price_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='item',
+            index=models.Index(fields=['category', 'price', 'id'], name='core_item_category_price_idx'),
+        ),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 2.2 on 2026-10-19 02:40
+
+from django.db import migrations, models
+from django.db.models import Case, F, OuterRef, Subquery, When
+
+
+def record_paid_prices(apps, schema_editor):
+    # What each paid line sold for is lost: the items' current prices
+    # are the best guess
+    Item = apps.get_model('core', 'Item')
+    OrderItem = apps.get_model('core', 'OrderItem')
+    items = Item.objects.filter(pk=OuterRef('item'))
+    OrderItem.objects.filter(ordered=True).update(
+        price=Subquery(items.values('price')[:1]),
+        final_price=Subquery(items.annotate(final_price=Case(
+            When(discount_price__gt=0, then=F('discount_price')),
+            default=F('price'),
+        )).values('final_price')[:1]))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0017_order_refund_updated_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='orderitem',
+            name='price',
+            field=models.IntegerField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='orderitem',
+            name='final_price',
+            field=models.IntegerField(blank=True, editable=False, null=True),
+        ),
+        migrations.RunPython(record_paid_prices, migrations.RunPython.noop),
+    ]
@@ -1,5 +1,10 @@
-from django.db import models
+import hashlib
+
+from django.db import models, transaction
+from django.db.models import Case, F, IntegerField, Sum, Value, When
+from django.db.models.functions import Coalesce
 from django.conf import settings
+from django.utils import timezone
 from django.shortcuts import reverse
 from django_countries.fields import CountryField
 
@@ -20,16 +25,35 @@ ADDRESS_CHOICES = (
     ('S', 'Shipping'),
 )
 
+# Money is stored in paise, as integers; the rupees template filter
+# (core.templatetags.money_tags) formats it
+ORDER_TOTAL_FIELDS = ('subtotal', 'savings', 'coupon_discount', 'grand_total')
+
+STRIPE_EVENT_STATUS_CHOICES = (
+    ('P', 'Pending'),
+    ('D', 'Done'),
+    ('F', 'Failed'),
+)
+
 
 class Item(models.Model):
     title = models.CharField(max_length=100)
-    price = models.FloatField()
-    discount_price = models.FloatField(blank=True, null=True)
+    price = models.IntegerField(help_text='In paise')
+    discount_price = models.IntegerField(blank=True, null=True,
+                                         help_text='In paise')
     category = models.CharField(choices=CATEGORY_CHOICES, max_length=2)
     label = models.CharField(choices=LABEL_CHOICES, max_length=1)
-    slug = models.SlugField()
+    slug = models.SlugField(unique=True)
     description = models.TextField()
     image = models.ImageField()
+    # Size of the original image, filled in by the derivative pipeline
+    # (core.images); null until its resized copies exist
+    image_width = models.PositiveIntegerField(
+        blank=True, null=True, editable=False)
+    image_height = models.PositiveIntegerField(
+        blank=True, null=True, editable=False)
+    # Last-Modified of the item's page. Bulk updates must set it too
+    updated_at = models.DateTimeField(auto_now=True)
 
     def __str__(self):
         return self.title
@@ -51,6 +75,18 @@ class Item(models.Model):
             "slug": self.slug
         })
 
+    class Meta:
+        indexes = [
+            # Category listings, in the order they're paginated
+            models.Index(fields=['category', 'id'],
+                         name='core_item_category_idx'),
+            # The same, sorted by price (HomeView's ?sort=price)
+            models.Index(fields=['price', 'id'],
+                         name='core_item_price_idx'),
+            models.Index(fields=['category', 'price', 'id'],
+                         name='core_item_category_price_idx'),
+        ]
+
 
 class OrderItem(models.Model):
     user = models.ForeignKey(settings.AUTH_USER_MODEL,
@@ -59,6 +95,11 @@ class OrderItem(models.Model):
 
     item = models.ForeignKey(Item, on_delete=models.CASCADE)
     quantity = models.IntegerField(default=1)
+    # The item's unit price and the price charged for it, in paise, as
+    # they were when the order was paid; null while in a cart
+    price = models.IntegerField(blank=True, null=True, editable=False)
+    final_price = models.IntegerField(blank=True, null=True,
+                                      editable=False)
 
     def __str__(self):
         return f"{self.quantity} of {self.item.title}"
@@ -79,11 +120,61 @@ class OrderItem(models.Model):
         else:
             return self.get_total_item_price()
 
+    class Meta:
+        constraints = [
+            # One cart line per item
+            models.UniqueConstraint(fields=['user', 'item'],
+                                    condition=models.Q(ordered=False),
+                                    name='unique_active_order_item'),
+        ]
+
+
+class OrderQuerySet(models.QuerySet):
+    def with_totals(self):
+        """Annotate each order with the totals of its current items and
+        coupon, computed in SQL in the same query: computed_subtotal,
+        computed_savings, computed_coupon_discount and
+        computed_grand_total, in paise."""
+        quantity = F('items__quantity')
+        price = F('items__item__price')
+        discount_price = F('items__item__discount_price')
+        return self.annotate(
+            computed_subtotal=Coalesce(Sum(quantity * price), 0),
+            computed_savings=Coalesce(Sum(Case(
+                When(items__item__discount_price__gt=0,
+                     then=quantity * (price - discount_price)),
+                default=Value(0),
+                output_field=IntegerField(),
+            )), 0),
+            computed_coupon_discount=Coalesce(F('coupon__amount'), 0),
+        ).annotate(
+            computed_grand_total=(F('computed_subtotal')
+                                  - F('computed_savings')
+                                  - F('computed_coupon_discount')),
+        )
+
+    def update_totals(self, batch_size=500):
+        """Rebuild the stored totals of these orders from their items and
+        coupon; returns the number of orders."""
+        # By pk: with_totals() on a queryset filtered on its items would
+        # only sum the matching ones
+        rows = self.model.objects.filter(
+            pk__in=self.values('pk')).with_totals().values(
+            'pk', *['computed_' + field for field in ORDER_TOTAL_FIELDS])
+        orders = [self.model(pk=row['pk'], **{
+            field: row['computed_' + field] for field in ORDER_TOTAL_FIELDS})
+            for row in rows]
+        self.model.objects.bulk_update(orders, ORDER_TOTAL_FIELDS,
+                                       batch_size=batch_size)
+        return len(orders)
+
 
 class Order(models.Model):
     user = models.ForeignKey(settings.AUTH_USER_MODEL,
                              on_delete=models.CASCADE)
-    ref_code = models.CharField(max_length=20)
+    # Set when the order is paid; null while it's a cart
+    ref_code = models.CharField(max_length=20, blank=True, null=True,
+                                unique=True)
     items = models.ManyToManyField(OrderItem)
     start_date = models.DateTimeField(auto_now_add=True)
     ordered_date = models.DateTimeField()
@@ -106,17 +197,76 @@ class Order(models.Model):
     received = models.BooleanField(default=False)
     refund_requested = models.BooleanField(default=False)
     refund_granted = models.BooleanField(default=False)
+    # When either refund field last changed, for the sales rollups.
+    # Whatever changes them must set it too
+    refund_updated_at = models.DateTimeField(blank=True, null=True,
+                                             editable=False, db_index=True)
+    # Denormalized totals, kept up to date by the cart views so that
+    # rendering an order never has to walk its items:
+    subtotal = models.IntegerField(default=0)
+    savings = models.IntegerField(default=0)
+    coupon_discount = models.IntegerField(default=0)
+    grand_total = models.IntegerField(default=0)
+
+    objects = OrderQuerySet.as_manager()
 
     def __str__(self):
         return self.user.username
 
     def get_total(self):
-        total = 0
-        for order_item in self.items.all():
-            total += order_item.get_final_price()
-        if self.coupon:
-            total -= self.coupon.amount
-        return total
+        return self.grand_total
+
+    def compute_totals(self):
+        # From the saved items and coupon
+        order = Order.objects.with_totals().get(pk=self.pk)
+        return {field: getattr(order, 'computed_' + field)
+                for field in ORDER_TOTAL_FIELDS}
+
+    def update_totals(self):
+        # Full rebuild from the order items, used by the admin
+        totals = self.compute_totals()
+        for field, value in totals.items():
+            setattr(self, field, value)
+        self.save(update_fields=list(totals))
+
+    def adjust_totals(self, item, quantity):
+        # Incremental update for `quantity` units of `item` being added
+        # (or removed, when negative) from the order
+        self.adjust_totals_many([(item, quantity)])
+
+    def adjust_totals_many(self, changes):
+        # Same, for several (item, quantity) pairs in one UPDATE
+        subtotal = 0
+        savings = 0
+        for item, quantity in changes:
+            subtotal += quantity * item.price
+            if item.discount_price:
+                savings += quantity * (item.price - item.discount_price)
+        Order.objects.filter(pk=self.pk).update(
+            subtotal=F('subtotal') + subtotal,
+            savings=F('savings') + savings,
+            grand_total=F('grand_total') + subtotal - savings,
+        )
+
+    def apply_coupon(self, coupon):
+        self.coupon = coupon
+        self.coupon_discount = coupon.amount if coupon else 0
+        self.save(update_fields=['coupon', 'coupon_discount'])
+        Order.objects.filter(pk=self.pk).update(
+            grand_total=F('subtotal') - F('savings') - F('coupon_discount'))
+
+    class Meta:
+        constraints = [
+            # One cart per user
+            models.UniqueConstraint(fields=['user'],
+                                    condition=models.Q(ordered=False),
+                                    name='unique_active_order'),
+        ]
+        indexes = [
+            # A user's past orders, newest first
+            models.Index(fields=['user', 'ordered', 'ordered_date'],
+                         name='core_order_user_history_idx'),
+        ]
 
 
 class Address(models.Model):
@@ -128,6 +278,11 @@ class Address(models.Model):
     zip = models.CharField(max_length=100)
     address_type = models.CharField(max_length=1, choices=ADDRESS_CHOICES)
     default = models.BooleanField(default=False)
+    # Hash of the normalized address, unique per user and type so that
+    # entering the same address again reuses its row. Null on rows
+    # saved before it existed, until dedupe_addresses fills it in
+    fingerprint = models.CharField(max_length=64, blank=True, null=True,
+                                   editable=False)
     # same_shipping_address =
     # save_info =
     # payment_option =
@@ -135,16 +290,51 @@ class Address(models.Model):
     def __str__(self):
         return self.user.username
 
+    def save(self, *args, **kwargs):
+        self.fingerprint = self.compute_fingerprint()
+        super().save(*args, **kwargs)
+
+    def compute_fingerprint(self):
+        # Case and whitespace don't make a different address
+        parts = [' '.join(str(value).split()).casefold() for value in (
+            self.street_address, self.apartment_address,
+            self.country.code, self.zip.replace(' ', ''))]
+        return hashlib.sha256('\n'.join(parts).encode()).hexdigest()
+
+    def make_default(self):
+        # Unset the previous default first, there can only be one
+        with transaction.atomic():
+            Address.objects.filter(
+                user=self.user_id, address_type=self.address_type,
+                default=True
+            ).exclude(pk=self.pk).update(default=False)
+            self.default = True
+            self.save(update_fields=['default'])
+
     class Meta:
         verbose_name_plural = 'Addresses'
+        constraints = [
+            # One default address of each type per user
+            models.UniqueConstraint(fields=['user', 'address_type'],
+                                    condition=models.Q(default=True),
+                                    name='unique_default_address'),
+            models.UniqueConstraint(
+                fields=['user', 'address_type', 'fingerprint'],
+                name='unique_address_fingerprint'),
+        ]
+        indexes = [
+            models.Index(fields=['user', 'address_type', 'default'],
+                         name='core_address_lookup_idx'),
+        ]
 
 
 class Payment(models.Model):
-    stripe_payment_id = models.CharField(max_length=100)
+    stripe_payment_id = models.CharField(max_length=100, unique=True)
     stripe_payment_intent_id = models.CharField(max_length=100)
     user = models.ForeignKey(settings.AUTH_USER_MODEL,
                              on_delete=models.SET_NULL, blank=True, null=True)
-    amount = models.FloatField()
+    # In paise
+    amount = models.IntegerField()
     timestamp = models.DateTimeField(auto_now_add=True)
     coupon = models.CharField(max_length=100, blank=True, null=True)
     coupon_amount = models.CharField(max_length=100, blank=True, null=True)
@@ -152,10 +342,17 @@ class Payment(models.Model):
     def __str__(self):
         return self.user.username
 
+    class Meta:
+        indexes = [
+            # Read by range when refreshing the sales rollups
+            models.Index(fields=['timestamp'],
+                         name='core_payment_timestamp_idx'),
+        ]
+
 
 class Coupon(models.Model):
-    code = models.CharField(max_length=15)
-    amount = models.FloatField()
+    code = models.CharField(max_length=15, unique=True)
+    amount = models.IntegerField(help_text='In paise')
 
     def __str__(self):
         return self.code
@@ -169,3 +366,85 @@ class Refund(models.Model):
 
     def __str__(self):
         return f"{self.pk}"
+
+
+class StripeEvent(models.Model):
+    # Inbox of verified Stripe webhook events, fulfilled asynchronously
+    # by the process_stripe_events command
+    event_id = models.CharField(max_length=100, unique=True)
+    type = models.CharField(max_length=100)
+    payload = models.TextField()
+    status = models.CharField(max_length=1,
+                              choices=STRIPE_EVENT_STATUS_CHOICES,
+                              default='P')
+    attempts = models.PositiveIntegerField(default=0)
+    last_error = models.TextField(blank=True)
+    received_at = models.DateTimeField(auto_now_add=True)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    processed_at = models.DateTimeField(blank=True, null=True)
+
+    def __str__(self):
+        return self.event_id
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'next_attempt_at'],
+                         name='core_stripeevent_due_idx'),
+        ]
+
+
+class SalesRollup(models.Model):
+    # Sales of one day, by the date (in TIME_ZONE) of their payments.
+    # Written by core.rollups, never edited
+    date = models.DateField()
+    orders = models.PositiveIntegerField(default=0)
+    units = models.PositiveIntegerField(default=0)
+    # In paise
+    revenue = models.BigIntegerField(default=0)
+    discount = models.BigIntegerField(default=0)
+    # Orders with a refund requested (or granted), and granted
+    refund_requests = models.PositiveIntegerField(default=0)
+    refunds_granted = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        abstract = True
+
+
+class DailySales(SalesRollup):
+    class Meta:
+        verbose_name_plural = 'Daily sales'
+        constraints = [
+            models.UniqueConstraint(fields=['date'],
+                                    name='unique_daily_sales'),
+        ]
+
+
+class DailyItemSales(SalesRollup):
+    item = models.ForeignKey(Item, on_delete=models.CASCADE)
+
+    class Meta:
+        verbose_name_plural = 'Daily item sales'
+        constraints = [
+            models.UniqueConstraint(fields=['date', 'item'],
+                                    name='unique_daily_item_sales'),
+        ]
+
+
+class DailyCategorySales(SalesRollup):
+    category = models.CharField(choices=CATEGORY_CHOICES, max_length=2)
+
+    class Meta:
+        verbose_name_plural = 'Daily category sales'
+        constraints = [
+            models.UniqueConstraint(fields=['date', 'category'],
+                                    name='unique_daily_category_sales'),
+        ]
+
+
+class RollupWatermark(models.Model):
+    # How far a rollup has read its source table
+    name = models.CharField(max_length=50, unique=True)
+    timestamp = models.DateTimeField(blank=True, null=True)
+
+    def __str__(self):
+        return self.name
@@ -0,0 +1,155 @@
+import base64
+import hashlib
+import json
+
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.db import connection
+from django.db.models import Q
+
+COUNT_CACHE_TIMEOUT = 300
+
+
+class InvalidCursor(Exception):
+    pass
+
+
+class CursorPage:
+    def __init__(self, object_list, next_cursor, previous_cursor):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+    def has_other_pages(self):
+        return self.has_next() or self.has_previous()
+
+
+class CursorPaginator:
+    """Keyset pagination over a queryset.
+
+    Pages are addressed by opaque cursors holding the ordering values of
+    the first/last row of the neighbouring page, so every page is a
+    single indexed range query: no OFFSET and no COUNT(*). `ordering`
+    must end with a unique field (usually 'pk'); prefix a field with '-'
+    to sort it descending.
+    """
+
+    def __init__(self, queryset, per_page, ordering=('pk',)):
+        self.queryset = queryset
+        self.per_page = per_page
+        self.ordering = tuple(ordering)
+        self.fields = [field.lstrip('-') for field in self.ordering]
+
+    def encode_cursor(self, obj, direction):
+        values = [getattr(obj, field) for field in self.fields]
+        data = json.dumps([direction, values],
+                          cls=_CursorEncoder, separators=(',', ':'))
+        return base64.urlsafe_b64encode(data.encode()).decode().rstrip('=')
+
+    def decode_cursor(self, cursor):
+        try:
+            padded = cursor + '=' * (-len(cursor) % 4)
+            direction, values = json.loads(
+                base64.urlsafe_b64decode(padded.encode()).decode())
+        except (ValueError, TypeError):
+            raise InvalidCursor(cursor)
+        if direction not in ('n', 'p') or not isinstance(values, list) or \
+                len(values) != len(self.fields) or \
+                not all(isinstance(value, (str, int, float))
+                        for value in values):
+            raise InvalidCursor(cursor)
+        return direction, values
+
+    def _keyset_filter(self, values, forward):
+        # (a, b) > (x, y)  <=>  a > x OR (a = x AND b > y), with the
+        # comparison flipped for descending fields and backward paging
+        condition = Q()
+        equal = Q()
+        for ordering, field, value in zip(self.ordering, self.fields, values):
+            ascending = not ordering.startswith('-')
+            lookup = 'gt' if ascending == forward else 'lt'
+            condition |= equal & Q(**{'%s__%s' % (field, lookup): value})
+            equal &= Q(**{field: value})
+        return condition
+
+    def page(self, cursor=None):
+        direction, values = 'n', None
+        if cursor:
+            direction, values = self.decode_cursor(cursor)
+        forward = direction == 'n'
+
+        queryset = self.queryset
+        if forward:
+            ordering = self.ordering
+        else:
+            ordering = [_reverse(field) for field in self.ordering]
+        try:
+            if values is not None:
+                queryset = queryset.filter(
+                    self._keyset_filter(values, forward))
+            rows = list(queryset.order_by(*ordering)[:self.per_page + 1])
+        except (TypeError, ValueError, ValidationError):
+            # Values of the wrong type for their field
+            raise InvalidCursor(cursor)
+
+        has_more = len(rows) > self.per_page
+        rows = rows[:self.per_page]
+        if not forward:
+            rows.reverse()
+
+        if forward:
+            has_next, has_previous = has_more, values is not None
+        else:
+            has_next, has_previous = True, has_more
+        next_cursor = previous_cursor = None
+        if rows and has_next:
+            next_cursor = self.encode_cursor(rows[-1], 'n')
+        if rows and has_previous:
+            previous_cursor = self.encode_cursor(rows[0], 'p')
+        return CursorPage(rows, next_cursor, previous_cursor)
+
+
+def _reverse(field):
+    return field[1:] if field.startswith('-') else '-' + field
+
+
+class _CursorEncoder(json.JSONEncoder):
+    def default(self, o):
+        if hasattr(o, 'isoformat'):
+            return o.isoformat()
+        return str(o)
+
+
+def cached_count(queryset, timeout=COUNT_CACHE_TIMEOUT):
+    """Approximate queryset.count(), cheap enough to show on every page.
+
+    Unfiltered PostgreSQL tables use the planner's row estimate; anything
+    else is counted for real at most once per `timeout` seconds.
+    """
+    if connection.vendor == 'postgresql' and not queryset.query.where:
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'SELECT reltuples::bigint FROM pg_class WHERE relname = %s',
+                [queryset.model._meta.db_table])
+            row = cursor.fetchone()
+        if row and row[0] > 0:
+            return row[0]
+
+    key = 'count:' + hashlib.md5(str(queryset.query).encode()).hexdigest()
+    count = cache.get(key)
+    if count is None:
+        count = queryset.count()
+        cache.set(key, count, timeout)
+    return count
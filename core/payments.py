@@ -0,0 +1,140 @@
+import json
+import logging
+import random
+import string
+from datetime import timedelta
+
+from django.db import transaction
+from django.db.models import (Case, Count, F, Min, OuterRef, Subquery,
+                              When)
+from django.utils import timezone
+
+from .models import Item, Order, OrderItem, Payment, StripeEvent
+
+logger = logging.getLogger(__name__)
+
+# Retry delay after the n-th failed attempt: 2**n seconds, capped
+MAX_RETRY_DELAY = timedelta(hours=1)
+MAX_ATTEMPTS = 10
+
+
+def create_ref_code():
+    return ''.join(random.choices(
+        string.ascii_lowercase + string.digits, k=14))
+
+
+def fulfill_order(session):
+    """Mark an order paid for a completed Checkout Session.
+
+    Idempotent: the Payment is keyed by the session id, so a replayed
+    session finds it already recorded and changes nothing. Runs in one
+    transaction and a fixed number of queries, whatever the order size.
+    """
+    metadata = session["metadata"]
+    order_id = metadata["order_id"]
+
+    with transaction.atomic():
+        payment, created = Payment.objects.get_or_create(
+            stripe_payment_id=session["id"],
+            defaults={
+                'stripe_payment_intent_id': session["payment_intent"],
+                'user_id': metadata["user_id"],
+                'amount': int(session["amount_total"]),
+                'coupon': metadata["coupon"],
+                'coupon_amount': metadata["coupon_amount"],
+            })
+        if not created:
+            return payment
+
+        # Assign payment to order
+        updated = Order.objects.filter(pk=order_id, ordered=False).update(
+            ordered=True,
+            payment=payment,
+            ref_code=create_ref_code(),
+        )
+        if not updated:
+            if not Order.objects.filter(pk=order_id).exists():
+                # Rolls back the Payment too, so the event is retried
+                raise Order.DoesNotExist(
+                    "No order %s for session %s" % (order_id, session["id"]))
+            # Paid again through a different session: keep the Payment
+            # on record for a refund, but leave the order alone
+            logger.warning("Order %s was already paid, session %s",
+                           order_id, session["id"])
+            return payment
+        # Setting ordered is True for all ordered Items, recording what
+        # they sold for
+        items = Item.objects.filter(pk=OuterRef('item'))
+        OrderItem.objects.filter(order__pk=order_id).update(
+            ordered=True,
+            price=Subquery(items.values('price')[:1]),
+            final_price=Subquery(items.annotate(final_price=Case(
+                When(discount_price__gt=0, then=F('discount_price')),
+                default=F('price'),
+            )).values('final_price')[:1]))
+    return payment
+
+
+def handle_checkout_session_completed(event):
+    fulfill_order(event['data']['object'])
+
+
+# Stripe event type -> handler; other event types are just marked done
+EVENT_HANDLERS = {
+    'checkout.session.completed': handle_checkout_session_completed,
+}
+
+
+def process_stripe_events(batch_size=100, max_attempts=MAX_ATTEMPTS):
+    """Fulfil a batch of due events from the StripeEvent inbox.
+
+    Events are claimed with SELECT ... FOR UPDATE SKIP LOCKED, so several
+    workers can drain the inbox at once. Failed events are retried with
+    exponential backoff and given up on after `max_attempts`.
+    Returns (processed, failed) counts.
+    """
+    processed = failed = 0
+    with transaction.atomic():
+        events = list(StripeEvent.objects.select_for_update(
+            skip_locked=True
+        ).filter(
+            status='P', next_attempt_at__lte=timezone.now()
+        ).order_by('received_at')[:batch_size])
+        for event in events:
+            event.attempts += 1
+            try:
+                with transaction.atomic():
+                    handler = EVENT_HANDLERS.get(event.type)
+                    if handler is not None:
+                        handler(json.loads(event.payload))
+            except Exception as e:
+                logger.exception("Stripe event %s failed (attempt %d)",
+                                 event.event_id, event.attempts)
+                failed += 1
+                event.last_error = repr(e)
+                if event.attempts >= max_attempts:
+                    event.status = 'F'
+                else:
+                    event.next_attempt_at = timezone.now() + min(
+                        timedelta(seconds=2 ** event.attempts),
+                        MAX_RETRY_DELAY)
+            else:
+                processed += 1
+                event.status = 'D'
+                event.processed_at = timezone.now()
+                event.last_error = ''
+            event.save(update_fields=['attempts', 'status', 'last_error',
+                                      'next_attempt_at', 'processed_at'])
+    return processed, failed
+
+
+def inbox_stats():
+    """Depth of the StripeEvent inbox and age of its oldest pending event."""
+    stats = StripeEvent.objects.filter(status='P').aggregate(
+        depth=Count('pk'), oldest=Min('received_at'))
+    lag = timezone.now() - stats['oldest'] if stats['oldest'] else None
+    return {
+        'depth': stats['depth'],
+        'lag_seconds': lag.total_seconds() if lag else 0,
+        'failed': StripeEvent.objects.filter(status='F').count(),
+    }
@@ -0,0 +1,124 @@
+"""Daily sales rollups: revenue, units, discounts and refunds per day,
+per item and per category, for reports that shouldn't scan the orders.
+
+Refreshed by the refresh_sales_rollups command from a watermark on
+Payment.timestamp and Order.refund_updated_at: each run recomputes,
+from scratch, the days with payments newer than the watermark and the
+days of the orders whose refund state changed since. Paid orders'
+totals and line prices don't change after payment, so no other day
+can have. Recomputing whole days makes a run safe to repeat or
+interrupt.
+"""
+from datetime import datetime, time, timedelta
+
+from django.db import transaction
+from django.db.models import Count, F, Q, Sum
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from .models import (DailyCategorySales, DailyItemSales, DailySales, Order,
+                     Payment, RollupWatermark)
+
+SALES_WATERMARK = 'sales'
+# Payments this recent are left for the next run: a transaction that
+# started earlier may still commit one with an older timestamp
+SETTLE_DELAY = timedelta(minutes=1)
+
+REFUND_REQUESTED = Q(refund_requested=True) | Q(refund_granted=True)
+
+
+def _day_bounds(day):
+    start = timezone.make_aware(datetime.combine(day, time.min))
+    return start, timezone.make_aware(
+        datetime.combine(day + timedelta(days=1), time.min))
+
+
+def _line_metrics():
+    # Over Order.items.through rows, at the prices the lines were paid
+    # at. Coupons apply to whole orders, so they're only in DailySales
+    quantity = F('orderitem__quantity')
+    price = F('orderitem__price')
+    final_price = F('orderitem__final_price')
+    return {
+        'orders': Count('order', distinct=True),
+        'units': Sum(quantity),
+        'revenue': Sum(quantity * final_price),
+        'discount': Sum(quantity * (price - final_price)),
+        'refund_requests': Count('order', distinct=True, filter=(
+            Q(order__refund_requested=True) |
+            Q(order__refund_granted=True))),
+        'refunds_granted': Count('order', distinct=True,
+                                 filter=Q(order__refund_granted=True)),
+    }
+
+
+def rollup_day(day):
+    """Recompute the rollups of `day` from the orders paid on it."""
+    start, end = _day_bounds(day)
+    orders = Order.objects.filter(payment__timestamp__gte=start,
+                                  payment__timestamp__lt=end)
+    # From the through table rather than OrderItem, so that every join
+    # is an inner one and the query starts from the payments' index
+    lines = Order.items.through.objects.filter(
+        order__payment__timestamp__gte=start,
+        order__payment__timestamp__lt=end)
+    totals = orders.aggregate(
+        orders=Count('pk'),
+        revenue=Coalesce(Sum('payment__amount'), 0),
+        discount=Coalesce(Sum(F('savings') + F('coupon_discount')), 0),
+        refund_requests=Count('pk', filter=REFUND_REQUESTED),
+        refunds_granted=Count('pk', filter=Q(refund_granted=True)),
+    )
+    totals['units'] = lines.aggregate(
+        units=Coalesce(Sum('orderitem__quantity'), 0))['units']
+    items = [
+        DailyItemSales(date=day, item_id=row.pop('orderitem__item'), **row)
+        for row in lines.values('orderitem__item').annotate(
+            **_line_metrics()).order_by()]
+    categories = [
+        DailyCategorySales(
+            date=day, category=row.pop('orderitem__item__category'), **row)
+        for row in lines.values('orderitem__item__category').annotate(
+            **_line_metrics()).order_by()]
+
+    with transaction.atomic():
+        for model in (DailySales, DailyItemSales, DailyCategorySales):
+            model.objects.filter(date=day).delete()
+        if totals['orders']:
+            DailySales.objects.create(date=day, **totals)
+            DailyItemSales.objects.bulk_create(items)
+            DailyCategorySales.objects.bulk_create(categories)
+
+
+def refresh_sales_rollups(rebuild=False):
+    """Bring the rollups up to date; returns the days recomputed."""
+    with transaction.atomic():
+        RollupWatermark.objects.get_or_create(name=SALES_WATERMARK)
+        # Held until the refresh commits, so an overlapping run waits
+        # and then starts from where this one stopped
+        watermark = RollupWatermark.objects.select_for_update().get(
+            name=SALES_WATERMARK)
+        high = timezone.now() - SETTLE_DELAY
+        payments = Payment.objects.filter(timestamp__lte=high)
+        refunded = Order.objects.none()
+        if watermark.timestamp and not rebuild:
+            payments = payments.filter(timestamp__gt=watermark.timestamp)
+            # Orders paid earlier whose refund state changed since
+            refunded = Order.objects.filter(
+                payment__isnull=False,
+                refund_updated_at__gt=watermark.timestamp,
+                refund_updated_at__lte=high)
+        if rebuild:
+            for model in (DailySales, DailyItemSales, DailyCategorySales):
+                model.objects.all().delete()
+
+        days = {timezone.localdate(paid_at) for paid_at in
+                payments.datetimes('timestamp', 'day')}
+        days.update(timezone.localdate(paid_at) for paid_at in
+                    refunded.datetimes('payment__timestamp', 'day'))
+
+        for day in sorted(days):
+            rollup_day(day)
+        watermark.timestamp = high
+        watermark.save(update_fields=['timestamp'])
+    return sorted(days)
@@ -0,0 +1,145 @@
+import re
+import threading
+from collections import defaultdict
+from math import log
+
+from django.contrib.postgres.search import (SearchQuery, SearchRank,
+                                           SearchVectorField)
+from django.core.cache import cache
+from django.db import connection
+from django.db.models import Case, F, Func, IntegerField, When
+
+from .models import Item
+
+# Must stay identical to the expression of the core_item_search_idx GIN
+# index (see migration 0003), otherwise PostgreSQL won't use the index.
+# Django's SearchVector can't be used: on 2.2 it wraps the columns in
+# concat(), which isn't immutable and so can't be indexed
+SEARCH_VECTOR_TEMPLATE = (
+    "(setweight(to_tsvector('english', coalesce(%s, '')), 'A') || "
+    "setweight(to_tsvector('english', coalesce(%s, '')), 'B'))"
+)
+SEARCH_CONFIG = 'english'
+
+# Ranked results beyond this are not worth paginating through
+MAX_RESULTS = 1000
+
+INDEX_VERSION_KEY = 'item-search-index-version'
+TITLE_WEIGHT = 2
+DESCRIPTION_WEIGHT = 1
+
+TOKEN_RE = re.compile(r'\w+')
+
+
+def tokenize(text):
+    return TOKEN_RE.findall(text.lower())
+
+
+class InvertedIndex:
+    """In-process full text index over Item titles and descriptions.
+
+    Used on databases without full text search (SQLite in development).
+    It is built on first use and rebuilt whenever the Item signals bump
+    the index version in the cache.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._postings = None
+        self._categories = {}
+        self._version = None
+
+    def _build(self):
+        postings = defaultdict(dict)
+        categories = {}
+        items = Item.objects.values_list(
+            'pk', 'category', 'title', 'description').iterator()
+        for pk, category, title, description in items:
+            categories[pk] = category
+            for weight, text in ((TITLE_WEIGHT, title),
+                                 (DESCRIPTION_WEIGHT, description)):
+                for token in tokenize(text or ''):
+                    postings[token][pk] = postings[token].get(pk, 0) + weight
+        return dict(postings), categories
+
+    def _ensure_built(self):
+        version = cache.get(INDEX_VERSION_KEY, 0)
+        with self._lock:
+            if self._postings is None or self._version != version:
+                self._postings, self._categories = self._build()
+                self._version = version
+
+    def search(self, query, category=None):
+        """Return item pks matching every term of `query`, best first."""
+        terms = set(tokenize(query))
+        if not terms:
+            return []
+        self._ensure_built()
+        postings, categories = self._postings, self._categories
+
+        matches = [postings.get(term, {}) for term in terms]
+        matches.sort(key=len)
+        candidates = set(matches[0])
+        for posting in matches[1:]:
+            candidates.intersection_update(posting)
+        if category:
+            candidates = {pk for pk in candidates
+                          if categories.get(pk) == category}
+
+        total = len(categories) or 1
+        scores = {}
+        for pk in candidates:
+            scores[pk] = sum(
+                posting[pk] * log(1 + total / len(posting))
+                for posting in matches)
+        ranked = sorted(candidates, key=lambda pk: (-scores[pk], pk))
+        return ranked[:MAX_RESULTS]
+
+
+inverted_index = InvertedIndex()
+
+
+class ItemSearchVector(Func):
+    """The weighted title and description of an Item, as indexed."""
+    output_field = SearchVectorField()
+
+    def __init__(self):
+        super().__init__(F('title'), F('description'))
+
+    def as_sql(self, compiler, connection):
+        columns = []
+        params = []
+        for expression in self.get_source_expressions():
+            sql, expression_params = compiler.compile(expression)
+            columns.append(sql)
+            params.extend(expression_params)
+        return SEARCH_VECTOR_TEMPLATE % tuple(columns), params
+
+
+def invalidate_search_index():
+    try:
+        cache.incr(INDEX_VERSION_KEY)
+    except ValueError:
+        cache.set(INDEX_VERSION_KEY, 1, None)
+
+
+def search_items(queryset, query, category=None):
+    """Filter an Item queryset down to its best MAX_RESULTS matches of
+    `query`, ordered by rank."""
+    if connection.vendor == 'postgresql':
+        search_query = SearchQuery(query, config=SEARCH_CONFIG)
+        queryset = queryset.annotate(
+            search_document=ItemSearchVector(),
+            rank=SearchRank(ItemSearchVector(), search_query),
+        ).filter(search_document=search_query)
+        if category:
+            queryset = queryset.filter(category=category)
+        return queryset.order_by('-rank', 'pk')[:MAX_RESULTS]
+
+    pks = inverted_index.search(query, category)
+    if not pks:
+        return queryset.none()
+    ranking = Case(
+        *[When(pk=pk, then=position) for position, pk in enumerate(pks)],
+        output_field=IntegerField())
+    return queryset.filter(pk__in=pks).order_by(ranking)
@@ -0,0 +1,41 @@
+from django.contrib.auth.signals import user_logged_in
+from django.db.models import F
+from django.db.models.signals import post_delete, post_save, pre_delete
+from django.dispatch import receiver
+
+from .cart import merge_guest_cart
+from .coupons import coupon_registry
+from .models import Coupon, Item, Order
+from .search import invalidate_search_index
+
+
+@receiver(post_save, sender=Item)
+@receiver(post_delete, sender=Item)
+def item_changed(sender, instance, **kwargs):
+    invalidate_search_index()
+
+
+@receiver(post_save, sender=Coupon)
+@receiver(post_delete, sender=Coupon)
+def coupon_changed(sender, instance, **kwargs):
+    coupon_registry.clear()
+
+
+@receiver(post_save, sender=Coupon)
+def coupon_saved(sender, instance, **kwargs):
+    # Keep the stored discount of carts using the coupon in step
+    Order.objects.filter(ordered=False, coupon=instance).update(
+        coupon_discount=instance.amount,
+        grand_total=F('subtotal') - F('savings') - instance.amount)
+
+
+@receiver(pre_delete, sender=Coupon)
+def coupon_deleted(sender, instance, **kwargs):
+    Order.objects.filter(ordered=False, coupon=instance).update(
+        coupon_discount=0, grand_total=F('subtotal') - F('savings'))
+
+
+@receiver(user_logged_in)
+def guest_cart_logged_in(sender, request, user, **kwargs):
+    if request is not None:
+        merge_guest_cart(request, user)
@@ -1,14 +1,14 @@
 from django import template
-from core.models import Order
+from core.cart import get_active_order, get_guest_cart
 
 register = template.Library()
 
 
 @register.filter
-def cart_item_count(user):
-    if user.is_authenticated:
-        qs = Order.objects.filter(user=user, ordered=False)
-        if qs.exists():
-            return qs[0].items.count()
-    else:
-        return "0"
+def cart_item_count(request):
+    if not request.user.is_authenticated:
+        return len(get_guest_cart(request).lines)
+    order = get_active_order(request)
+    if order is None:
+        return 0
+    return order.item_count
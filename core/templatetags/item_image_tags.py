@@ -0,0 +1,56 @@
+from django import template
+from django.core.files.storage import default_storage
+from django.utils.html import format_html
+
+from core.images import (DERIVATIVE_WIDTHS,
+                         derivative_name,
+                         derivative_widths)
+
+register = template.Library()
+
+# `sizes` hint for each slot an item image is shown in
+SLOT_SIZES = {
+    'thumb': '150px',
+    'card': '(min-width: 992px) 25vw, (min-width: 768px) 50vw, 100vw',
+    'detail': '(min-width: 768px) 50vw, 100vw',
+}
+
+
+def _srcset(image_name, widths, extension):
+    return ', '.join(
+        '%s %dw' % (default_storage.url(
+            derivative_name(image_name, width, extension)), width)
+        for width in widths)
+
+
+@register.simple_tag
+def item_image(item, slot='card', css_class=''):
+    """Render a responsive <picture> of the item's image for `slot`.
+
+    Falls back to the original upload while the resized copies made by
+    core.images have not been generated yet.
+    """
+    if not item.image:
+        return ''
+    if item.image_width is None:
+        return format_html('<img src="{}" class="{}" alt="{}" />',
+                           item.image.url, css_class, item.title)
+
+    image_name = item.image.name
+    widths = derivative_widths(item.image_width)
+    default_width = min(DERIVATIVE_WIDTHS[slot], widths[-1])
+    default_width = min(w for w in widths if w >= default_width)
+    height = round(item.image_height * default_width / item.image_width)
+    sizes = SLOT_SIZES[slot]
+
+    return format_html(
+        '<picture>'
+        '<source type="image/webp" srcset="{}" sizes="{}" />'
+        '<img src="{}" srcset="{}" sizes="{}" width="{}" height="{}" '
+        'class="{}" alt="{}" loading="lazy" />'
+        '</picture>',
+        _srcset(image_name, widths, 'webp'), sizes,
+        default_storage.url(derivative_name(image_name, default_width, 'jpg')),
+        _srcset(image_name, widths, 'jpg'), sizes,
+        default_width, height, css_class, item.title,
+    )
@@ -0,0 +1,13 @@
+from django import template
+
+register = template.Library()
+
+
+@register.filter
+def rupees(paise):
+    """Format an amount in paise as rupees: 123450 as 1,234.50."""
+    if paise is None or paise == '':
+        return ''
+    sign = '-' if paise < 0 else ''
+    whole, fraction = divmod(abs(int(paise)), 100)
+    return '%s%s.%02d' % (sign, format(whole, ','), fraction)
@@ -1,3 +1,1217 @@
-from django.test import TestCase
+import base64
+import csv
+import json
+import os
+import re
+import shutil
+import tempfile
+import threading
+from io import StringIO
+from unittest import mock, skipIf, skipUnless
 
-# Create your tests here.
+from django.contrib import admin
+from django.contrib.auth.models import User
+from django.core.files.storage import default_storage
+from django.template.backends.django import Template
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.test import (TestCase, TransactionTestCase, override_settings,
+                         skipUnlessDBFeature)
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from PIL import Image
+
+from . import images, loadtest, middleware
+from .admin import (EstimatedCountPaginator, ItemAdmin, OrderAdmin,
+                    OrderItemAdmin, estimated_count, make_refund_accepted,
+                    plan_rows)
+from .cart import (GUEST_CART_COOKIE, add_item, apply_operations,
+                   remove_item, remove_single_item)
+from .coupons import CouponRegistry
+from .pagination import CursorPaginator, InvalidCursor
+from .search import search_items
+from .models import (Address, Coupon, DailyCategorySales, DailyItemSales,
+                     DailySales, Item, Order, OrderItem, Payment,
+                     RollupWatermark, StripeEvent)
+from .payments import fulfill_order, process_stripe_events
+from .rollups import refresh_sales_rollups
+from .images import derivative_name
+from .templatetags.item_image_tags import item_image
+from .templatetags.money_tags import rupees
+
+
+def create_item(slug, price=100, discount_price=None):
+    return Item.objects.create(
+        title=slug, slug=slug, price=price, discount_price=discount_price,
+        category='S', label='P', description=slug)
+
+
+class CartTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('shopper')
+        self.shirt = create_item('shirt', price=100, discount_price=80)
+        self.hat = create_item('hat', price=50)
+
+    def test_cart_mutations_keep_totals_in_step(self):
+        self.assertTrue(add_item(self.user, 'shirt'))
+        self.assertFalse(add_item(self.user, 'shirt'))
+        self.assertTrue(add_item(self.user, 'hat'))
+        self.assertTrue(remove_single_item(self.user, 'shirt'))
+        self.assertTrue(remove_single_item(self.user, 'hat'))
+        self.assertFalse(remove_item(self.user, 'hat'))
+
+        order = Order.objects.get(user=self.user, ordered=False)
+        self.assertEqual(
+            [(line.item.slug, line.quantity) for line in order.items.all()],
+            [('shirt', 1)])
+        self.assertEqual(order.grand_total, 80)
+        self.assertEqual(order.compute_totals(), {
+            'subtotal': order.subtotal,
+            'savings': order.savings,
+            'coupon_discount': order.coupon_discount,
+            'grand_total': order.grand_total,
+        })
+
+    def test_increment_is_two_queries(self):
+        add_item(self.user, 'shirt')
+        with CaptureQueriesContext(connection) as queries:
+            add_item(self.user, 'shirt')
+        # Inside TestCase's transaction, atomic() only adds savepoints
+        statements = [query['sql'] for query in queries
+                      if 'SAVEPOINT' not in query['sql']]
+        self.assertEqual(len(statements), 2)
+
+
+class CartPagesQueryCountTest(TestCase):
+    PAGES = ['/order-summary/', '/checkout/', '/payment/stripe/']
+
+    def setUp(self):
+        self.user = User.objects.create_user('shopper')
+        self.client.force_login(self.user)
+        self.lines = 0
+
+    def add_lines(self, count):
+        for _ in range(count):
+            self.lines += 1
+            slug = 'item-%d' % self.lines
+            create_item(slug, price=100,
+                        discount_price=80 if self.lines % 2 else None)
+            add_item(self.user, slug)
+
+    def page_queries(self, urls=PAGES):
+        queries = {}
+        for url in urls:
+            with CaptureQueriesContext(connection) as captured:
+                response = self.client.get(url)
+            self.assertEqual(response.status_code, 200, url)
+            queries[url] = [query['sql'] for query in captured]
+        return queries
+
+    def add_line_queries(self):
+        # The item is created outside the count
+        self.add_lines(1)
+        remove_item(self.user, 'item-%d' % self.lines)
+        with CaptureQueriesContext(connection) as captured:
+            add_item(self.user, 'item-%d' % self.lines)
+        return len(captured)
+
+    def test_cart_pages_do_not_depend_on_cart_size(self):
+        self.add_lines(1)
+        small = self.page_queries()
+        small_add = self.add_line_queries()
+        self.add_lines(24)
+        large = self.page_queries()
+        for url in self.PAGES:
+            self.assertEqual(len(small[url]), len(large[url]), url)
+        self.assertEqual(small_add, self.add_line_queries())
+
+    def test_active_order_is_read_once_per_request(self):
+        self.add_lines(3)
+        for url, queries in self.page_queries(['/'] + self.PAGES).items():
+            # The view, the conditional GET and the navbar badge share it
+            order_lookups = [sql for sql in queries
+                             if sql.startswith('SELECT')
+                             and 'FROM "core_order" ' in sql]
+            self.assertEqual(len(order_lookups), 1, url)
+
+
+class OrderTotalsTest(TestCase):
+    def test_totals_of_many_orders_in_one_query(self):
+        create_item('shirt', price=10050, discount_price=8025)
+        create_item('hat', price=4999)
+        coupon = Coupon.objects.create(code='TEN', amount=1000)
+        for index in range(3):
+            user = User.objects.create_user('shopper-%d' % index)
+            for slug in ('shirt', 'shirt', 'hat'):
+                add_item(user, slug)
+        Order.objects.get(user__username='shopper-0').apply_coupon(coupon)
+        empty = Order.objects.create(user=user, ordered=True,
+                                     ordered_date=timezone.now())
+
+        with self.assertNumQueries(1):
+            orders = list(Order.objects.with_totals().order_by('pk'))
+        self.assertEqual(
+            [order.computed_grand_total for order in orders],
+            [25099 - 4050 - 1000, 25099 - 4050, 25099 - 4050, 0])
+        for order in orders:
+            self.assertEqual(order.computed_subtotal, order.subtotal)
+            self.assertEqual(order.computed_savings, order.savings)
+            self.assertEqual(order.computed_grand_total, order.grand_total)
+        self.assertEqual(orders[-1].pk, empty.pk)
+
+    def repriced_orders(self):
+        create_item('shirt', price=10000)
+        paid_user = User.objects.create_user('paid')
+        add_item(paid_user, 'shirt')
+        Order.objects.filter(user=paid_user).update(
+            ordered=True, ordered_date=timezone.now())
+        open_user = User.objects.create_user('open')
+        add_item(open_user, 'shirt')
+        Item.objects.filter(slug='shirt').update(price=12000)
+        return (Order.objects.get(user=paid_user),
+                Order.objects.get(user=open_user))
+
+    def test_rebuild_leaves_paid_orders_alone(self):
+        paid, cart = self.repriced_orders()
+        with self.assertRaisesRegex(CommandError, '1 of 1 open carts'):
+            call_command('rebuild_order_totals', verify=True,
+                         stdout=StringIO())
+        call_command('rebuild_order_totals', stdout=StringIO())
+        paid.refresh_from_db()
+        cart.refresh_from_db()
+        self.assertEqual(paid.grand_total, 10000)
+        self.assertEqual(cart.grand_total, 12000)
+        call_command('rebuild_order_totals', verify=True, stdout=StringIO())
+
+    def test_admin_leaves_paid_orders_alone(self):
+        paid, cart = self.repriced_orders()
+        form = mock.Mock(changed_data=[], instance=paid)
+        OrderAdmin(Order, admin.site).save_related(None, form, [], True)
+        line = paid.items.get()
+        OrderItemAdmin(OrderItem, admin.site).save_model(
+            None, line, mock.Mock(changed_data=[]), True)
+        paid.refresh_from_db()
+        self.assertEqual(paid.grand_total, 10000)
+
+        form = mock.Mock(changed_data=[], instance=cart)
+        OrderAdmin(Order, admin.site).save_related(None, form, [], True)
+        cart.refresh_from_db()
+        self.assertEqual(cart.grand_total, 12000)
+
+    def test_rupees_filter(self):
+        self.assertEqual(rupees(123456789), '1,234,567.89')
+        self.assertEqual(rupees(5), '0.05')
+        self.assertEqual(rupees(-1050), '-10.50')
+        self.assertEqual(rupees(None), '')
+
+
+@skipUnlessDBFeature('has_select_for_update')
+class ConcurrentCartTest(TransactionTestCase):
+    def test_concurrent_adds_lose_no_increments(self):
+        user = User.objects.create_user('shopper')
+        create_item('shirt', price=100)
+        errors = []
+
+        def add_five():
+            try:
+                for _ in range(5):
+                    add_item(user, 'shirt')
+            except Exception as e:
+                errors.append(e)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=add_five) for _ in range(10)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        order = Order.objects.get(user=user, ordered=False)
+        line = OrderItem.objects.get(user=user, ordered=False)
+        self.assertEqual(line.quantity, 50)
+        self.assertEqual(list(order.items.all()), [line])
+        self.assertEqual(order.grand_total, 5000)
+
+    @skipUnless(connection.vendor == 'postgresql', 'Needs PostgreSQL')
+    def test_batches_and_single_changes_do_not_deadlock(self):
+        user = User.objects.create_user('shopper')
+        create_item('shirt', price=100)
+        create_item('hat', price=50)
+        add_item(user, 'shirt')
+        add_item(user, 'hat')
+        errors = []
+
+        def run(change):
+            try:
+                for _ in range(10):
+                    change()
+            except Exception as e:
+                errors.append(e)
+            finally:
+                connection.close()
+
+        def add_and_remove_hat():
+            add_item(user, 'hat')
+            remove_single_item(user, 'hat')
+
+        changes = [
+            lambda: apply_operations(user, [{'slug': 'shirt', 'delta': 1},
+                                            {'slug': 'hat', 'delta': 1}]),
+            lambda: add_item(user, 'shirt'),
+            add_and_remove_hat,
+        ]
+        threads = [threading.Thread(target=run, args=(change,))
+                   for change in changes]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        quantities = dict(OrderItem.objects.filter(
+            user=user, ordered=False).values_list('item__slug', 'quantity'))
+        self.assertEqual(quantities, {'shirt': 21, 'hat': 11})
+        order = Order.objects.get(user=user, ordered=False)
+        self.assertEqual(order.grand_total, 21 * 100 + 11 * 50)
+
+
+class CartApiTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('shopper')
+        self.client.force_login(self.user)
+        for index in range(20):
+            create_item('item-%d' % index, price=10 + index)
+
+    def post(self, operations):
+        return self.client.post('/api/cart/',
+                                json.dumps({'operations': operations}),
+                                content_type='application/json')
+
+    def test_batch_is_applied_in_constant_queries(self):
+        add_item(self.user, 'item-0')
+        add_item(self.user, 'item-1')
+        add_item(self.user, 'item-5')
+        # One update, one new line and one removal...
+        with CaptureQueriesContext(connection) as small:
+            response = self.post([{'slug': 'item-0', 'delta': 1},
+                                  {'slug': 'item-3', 'delta': 1},
+                                  {'slug': 'item-5', 'quantity': 0}])
+        self.assertEqual(response.status_code, 200)
+
+        # ...cost the same as many of each
+        operations = [{'slug': 'item-%d' % index, 'delta': 2}
+                      for index in range(20)]
+        operations += [{'slug': 'item-0', 'quantity': 0},
+                       {'slug': 'item-1', 'delta': -1},
+                       {'slug': 'item-2', 'quantity': 5}]
+        with CaptureQueriesContext(connection) as large:
+            response = self.post(operations)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(large), len(small))
+
+        cart = response.json()
+        quantities = {line['slug']: line['quantity'] for line in cart['lines']}
+        self.assertNotIn('item-0', quantities)
+        self.assertEqual(quantities['item-1'], 2)
+        self.assertEqual(quantities['item-2'], 5)
+        self.assertEqual(len(quantities), 19)
+        order = Order.objects.get(user=self.user, ordered=False)
+        self.assertEqual(cart['grand_total'],
+                         order.compute_totals()['grand_total'])
+
+    def test_invalid_batch_changes_nothing(self):
+        response = self.post([{'slug': 'item-0', 'delta': 1},
+                              {'slug': 'missing', 'delta': 1}])
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(OrderItem.objects.exists())
+
+
+class FulfillOrderTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('shopper')
+
+    def checkout_session(self, lines):
+        for index in range(lines):
+            slug = 'item-%d-of-%d' % (index, lines)
+            create_item(slug)
+            add_item(self.user, slug)
+        order = Order.objects.get(user=self.user, ordered=False)
+        return order, {
+            'id': 'cs_%d' % lines,
+            'payment_intent': 'pi_%d' % lines,
+            'amount_total': order.grand_total,
+            'metadata': {
+                'user_id': str(self.user.pk),
+                'order_id': str(order.pk),
+                'coupon': 'None',
+                'coupon_amount': '0',
+            },
+        }
+
+    def test_replayed_session_is_a_no_op(self):
+        order, session = self.checkout_session(2)
+        payment = fulfill_order(session)
+        order.refresh_from_db()
+        ref_code = order.ref_code
+        self.assertTrue(order.ordered)
+        self.assertEqual(order.payment, payment)
+        self.assertFalse(OrderItem.objects.filter(ordered=False).exists())
+
+        self.assertEqual(fulfill_order(session), payment)
+        order.refresh_from_db()
+        self.assertEqual(order.ref_code, ref_code)
+        self.assertEqual(Payment.objects.count(), 1)
+
+    def test_query_count_does_not_depend_on_order_size(self):
+        counts = []
+        for lines in (1, 20):
+            order, session = self.checkout_session(lines)
+            with CaptureQueriesContext(connection) as queries:
+                fulfill_order(session)
+            counts.append(len(queries))
+        self.assertEqual(counts[0], counts[1])
+
+    def deliver(self, event_id, session):
+        # As Stripe would, signature included
+        event = {'id': event_id, 'type': 'checkout.session.completed',
+                 'data': {'object': session}}
+        with mock.patch('stripe.Webhook.construct_event',
+                        return_value=event):
+            response = self.client.post(
+                '/webhook/stripe/', json.dumps(event),
+                content_type='application/json',
+                HTTP_STRIPE_SIGNATURE='t=1,v1=x')
+        self.assertEqual(response.status_code, 200)
+
+    def test_redelivered_event_is_stored_once(self):
+        order, session = self.checkout_session(1)
+        self.deliver('evt_1', session)
+        self.deliver('evt_1', session)
+        self.assertEqual(StripeEvent.objects.count(), 1)
+        self.assertEqual(process_stripe_events(), (1, 0))
+        self.assertEqual(process_stripe_events(), (0, 0))
+        self.assertEqual(StripeEvent.objects.get().status, 'D')
+
+    def test_replayed_session_in_a_new_event_is_a_no_op(self):
+        order, session = self.checkout_session(1)
+        self.deliver('evt_1', session)
+        process_stripe_events()
+        ref_code = Order.objects.get(pk=order.pk).ref_code
+        self.deliver('evt_2', session)
+        self.assertEqual(process_stripe_events(), (1, 0))
+        self.assertEqual(Payment.objects.count(), 1)
+        self.assertEqual(Order.objects.get(pk=order.pk).ref_code, ref_code)
+
+    def test_duplicate_deliveries_pay_the_order_once(self):
+        # What the threaded races come down to, run one after the other
+        order, session = self.checkout_session(2)
+        self.deliver('evt_1', session)
+        self.deliver('evt_1', session)
+        payment = fulfill_order(session)
+        ref_code = Order.objects.get(pk=order.pk).ref_code
+        self.assertEqual(fulfill_order(session), payment)
+        self.assertEqual(process_stripe_events(), (1, 0))
+
+        self.assertEqual(Payment.objects.count(), 1)
+        self.assertEqual(StripeEvent.objects.count(), 1)
+        order.refresh_from_db()
+        self.assertTrue(order.ordered)
+        self.assertEqual(order.payment, payment)
+        self.assertEqual(order.ref_code, ref_code)
+        self.assertEqual(payment.amount, order.grand_total)
+
+    def test_failing_event_is_retried_with_backoff(self):
+        order, session = self.checkout_session(1)
+        session['metadata']['order_id'] = str(order.pk + 100)
+        self.deliver('evt_1', session)
+        with self.assertLogs('core.payments', 'ERROR'):
+            self.assertEqual(process_stripe_events(max_attempts=2), (0, 1))
+        event = StripeEvent.objects.get()
+        self.assertEqual((event.status, event.attempts), ('P', 1))
+        self.assertIn('DoesNotExist', event.last_error)
+        delay = event.next_attempt_at - timezone.now()
+        self.assertTrue(timezone.timedelta(0) < delay
+                        <= timezone.timedelta(seconds=2))
+        # Rolled back with the failure
+        self.assertFalse(Payment.objects.exists())
+        # Not due yet
+        self.assertEqual(process_stripe_events(max_attempts=2), (0, 0))
+
+        StripeEvent.objects.update(next_attempt_at=timezone.now())
+        with self.assertLogs('core.payments', 'ERROR'):
+            self.assertEqual(process_stripe_events(max_attempts=2), (0, 1))
+        event.refresh_from_db()
+        self.assertEqual((event.status, event.attempts), ('F', 2))
+
+
+class CouponRegistryTest(TestCase):
+    def setUp(self):
+        self.registry = CouponRegistry(ttl=60, max_entries=3)
+        self.clock = 1000.0
+        patcher = mock.patch('core.coupons.time.monotonic',
+                             lambda: self.clock)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_unknown_codes_are_cached(self):
+        with self.assertNumQueries(1):
+            self.assertIsNone(self.registry.get('GUESS'))
+            self.assertIsNone(self.registry.get('GUESS'))
+
+    def test_entries_expire(self):
+        Coupon.objects.create(code='TEN', amount=1000)
+        self.assertEqual(self.registry.get('TEN').amount, 1000)
+        # Changed by another process: no signal reaches this registry
+        Coupon.objects.filter(code='TEN').update(amount=500)
+        self.clock += 59
+        with self.assertNumQueries(0):
+            self.assertEqual(self.registry.get('TEN').amount, 1000)
+        self.clock += 1
+        with self.assertNumQueries(1):
+            self.assertEqual(self.registry.get('TEN').amount, 500)
+
+    def test_entries_are_bounded(self):
+        for code in ('A', 'B', 'C'):
+            self.registry.get(code)
+        # Full of live entries: starts over
+        self.registry.get('D')
+        self.assertEqual(list(self.registry._entries), ['D'])
+
+        self.clock += 30
+        self.registry.get('E')
+        self.registry.get('F')
+        self.clock += 31
+        # Full again: only the expired ones are dropped
+        self.registry.get('G')
+        self.assertEqual(sorted(self.registry._entries), ['E', 'F', 'G'])
+
+
+class ExplainQueriesTest(TestCase):
+    def test_reports_every_step(self):
+        User.objects.create_user('shopper')
+        create_item('shirt')
+        out = StringIO()
+        call_command('explain_queries', stdout=out)
+        output = out.getvalue()
+        for name in ('home', 'category', 'search', 'product',
+                     'add to cart (new line)', 'add to cart (increment)',
+                     'order summary', 'cart api', 'checkout', 'payment',
+                     'remove one', 'remove from cart'):
+            self.assertRegex(output, r'(?m)^%s \(/[^)]*\): \d+ queries$'
+                             % re.escape(name))
+        # Everything it did was rolled back
+        self.assertFalse(Order.objects.exists())
+
+
+class LoadTestTest(TransactionTestCase):
+    def test_funnel_ends_in_paid_orders(self):
+        # One thread: sqlite's shared in-memory test database locks whole
+        # tables between connections
+        results = loadtest.run(funnels=3, concurrency=1, items=2)
+
+        self.assertEqual(results['total']['errors'], 0)
+        for step in loadtest.STEPS:
+            self.assertEqual(results['steps'][step]['requests'], 3)
+        self.assertEqual(results['fulfilment']['processed'], 3)
+        self.assertEqual(Order.objects.filter(ordered=True).count(), 3)
+        self.assertEqual(Payment.objects.count(), 3)
+
+
+class RequestTimingTest(TestCase):
+    def setUp(self):
+        for index in range(3):
+            create_item('item-%d' % index)
+
+    @override_settings(REQUEST_TIMING_SAMPLE_RATE=1, REQUEST_TIMING_SLOW_MS=0)
+    def test_timings_header_and_slow_log(self):
+        with self.assertLogs('core.middleware', 'WARNING') as logs:
+            response = self.client.get('/')
+
+        header = response['Server-Timing']
+        for metric in ('db;dur=', 'tpl;dur=', 'view;dur=', 'total;dur='):
+            self.assertIn(metric, header)
+        # Only wrapped during sampled requests
+        self.assertIs(Template.render, middleware._template_render)
+        record = json.loads(logs.records[0].args[0])
+        self.assertEqual(record['path'], '/')
+        self.assertTrue(record['sampled'])
+        self.assertGreater(record['queries'], 0)
+        self.assertGreater(record['template_ms'], 0)
+        self.assertIn('repeated_sql', record)
+
+    @override_settings(REQUEST_TIMING_SAMPLE_RATE=0)
+    def test_unsampled_requests_are_not_instrumented(self):
+        response = self.client.get('/')
+        self.assertFalse(response.has_header('Server-Timing'))
+
+
+class AddressDedupeTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('shopper')
+        self.client.force_login(self.user)
+        create_item('shirt')
+
+    def checkout(self, street):
+        self.client.get('/add-to-cart/shirt/')
+        return self.client.post('/checkout/', {
+            'shipping_address': street,
+            'shipping_country': 'IN',
+            'shipping_zip': '400 001',
+            'same_billing_address': 'on',
+            'payment_option': 'S',
+        })
+
+    def test_repeat_checkout_reuses_addresses(self):
+        self.checkout('1 Main Street')
+        self.checkout('  1 MAIN   street ')
+
+        self.assertEqual(Address.objects.filter(address_type='S').count(), 1)
+        self.assertEqual(Address.objects.filter(address_type='B').count(), 1)
+        order = Order.objects.get(user=self.user, ordered=False)
+        self.assertEqual(order.shipping_address.street_address,
+                         '1 Main Street')
+
+    def test_backfill_merges_duplicates_and_repoints_orders(self):
+        # Rows saved before fingerprints existed
+        Address.objects.bulk_create([
+            Address(user=self.user, street_address=street,
+                    country='IN', zip='400001', address_type='S',
+                    default=default)
+            for street, default in [('1 Main St', False),
+                                    ('1 main st', True),
+                                    ('2 Side St', False)]
+        ])
+        first, duplicate, other = Address.objects.order_by('pk')
+        order = Order.objects.create(
+            user=self.user, ordered=True, ordered_date=timezone.now(),
+            shipping_address=duplicate, billing_address=other)
+
+        call_command('dedupe_addresses', stdout=StringIO())
+
+        self.assertEqual(list(Address.objects.order_by('pk')),
+                         [first, other])
+        first.refresh_from_db()
+        self.assertTrue(first.default)
+        self.assertEqual(first.fingerprint, first.compute_fingerprint())
+        order.refresh_from_db()
+        self.assertEqual(order.shipping_address, first)
+        self.assertEqual(order.billing_address, other)
+
+    def test_checkout_page_queries_dont_depend_on_defaults(self):
+        self.client.get('/add-to-cart/shirt/')
+        with CaptureQueriesContext(connection) as without_defaults:
+            self.client.get('/checkout/')
+        for address_type in ('S', 'B'):
+            Address.objects.create(
+                user=self.user, street_address='1 Main St', country='IN',
+                zip='400001', address_type=address_type, default=True)
+        with CaptureQueriesContext(connection) as with_defaults:
+            response = self.client.get('/checkout/')
+
+        self.assertEqual(len(with_defaults), len(without_defaults))
+        self.assertEqual(
+            response.context['default_shipping_address'].address_type, 'S')
+        self.assertEqual(
+            response.context['default_billing_address'].address_type, 'B')
+
+
+class GuestCartTest(TestCase):
+    def setUp(self):
+        self.shirt = create_item('shirt', price=100, discount_price=80)
+        self.hat = create_item('hat', price=50)
+
+    def test_guest_cart_writes_nothing_and_merges_on_login(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get('/add-to-cart/shirt/')
+            self.client.get('/add-to-cart/shirt/')
+            self.client.get('/add-to-cart/hat/')
+            self.client.get('/remove-item-from-cart/hat/')
+            self.client.get('/add-to-cart/hat/')
+            response = self.client.get('/order-summary/')
+        self.assertTrue(all(query['sql'].startswith('SELECT')
+                            for query in queries))
+        self.assertEqual(response.context['object'].get_total(), 210)
+
+        user = User.objects.create_user('shopper', password='secret')
+        add_item(user, 'shirt')
+        self.client.post('/accounts/login/',
+                         {'login': 'shopper', 'password': 'secret'})
+
+        order = Order.objects.get(user=user, ordered=False)
+        self.assertEqual(
+            sorted((line.item.slug, line.quantity)
+                   for line in order.items.all()),
+            [('hat', 1), ('shirt', 3)])
+        self.assertEqual(order.grand_total, 290)
+        self.assertEqual(order.compute_totals()['grand_total'], 290)
+        # The guest cart is gone
+        self.assertEqual(self.client.cookies[GUEST_CART_COOKIE].value, '')
+
+
+class SearchTest(TestCase):
+    def setUp(self):
+        for slug, title, description, category in [
+                ('red-shirt', 'Red shirt', 'Cotton, red', 'S'),
+                ('blue-shirt', 'Blue shirt', 'Cotton', 'S'),
+                ('red-jacket', 'Jacket', 'A red jacket', 'OW'),
+                ('red-track', 'Red track pants', 'Red and red', 'SW')]:
+            Item.objects.create(slug=slug, title=title, price=100,
+                                description=description, category=category,
+                                label='P')
+
+    def search(self, query, category=None):
+        return [item.slug for item in
+                search_items(Item.objects.all(), query, category)]
+
+    def test_ranking(self):
+        # Every term must match; title matches weigh more
+        self.assertEqual(self.search('shirt'), ['red-shirt', 'blue-shirt'])
+        self.assertEqual(self.search('red shirt'), ['red-shirt'])
+        self.assertEqual(self.search('red')[-1], 'red-jacket')
+        self.assertEqual(self.search('velvet'), [])
+
+    def test_category_and_view(self):
+        self.assertEqual(self.search('red', category='OW'), ['red-jacket'])
+        response = self.client.get('/search/', {'q': 'red',
+                                                'category': 'SW'})
+        self.assertEqual([item.slug for item in response.context[
+            'object_list']], ['red-track'])
+
+    def test_results_are_capped(self):
+        with mock.patch('core.search.MAX_RESULTS', 2):
+            self.assertEqual(len(self.search('red')), 2)
+
+
+class ItemImageTest(TestCase):
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        settings = self.settings(MEDIA_ROOT=media_root)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        Image.new('RGB', (600, 300), 'red').save(
+            os.path.join(media_root, 'shirt.png'))
+        self.shirt = create_item('shirt')
+        self.shirt.image = 'shirt.png'
+        self.shirt.save()
+
+    def test_derivatives_are_generated_by_the_command(self):
+        # The original until the resized copies exist
+        self.assertIsNone(self.shirt.image_width)
+        self.assertHTMLEqual(
+            item_image(self.shirt),
+            '<img src="/media/shirt.png" class="" alt="shirt" />')
+
+        call_command('generate_image_derivatives', workers=1,
+                     stdout=StringIO())
+        self.shirt.refresh_from_db()
+        self.assertEqual((self.shirt.image_width, self.shirt.image_height),
+                         (600, 300))
+        for width in (150, 400, 600):
+            for extension in ('webp', 'jpg'):
+                self.assertTrue(default_storage.exists(derivative_name(
+                    'shirt.png', width, extension)))
+        html = item_image(self.shirt, 'card')
+        self.assertIn('src="/media/derivatives/shirt-400w.jpg"', html)
+        self.assertIn('width="400" height="200"', html)
+        self.assertIn('/media/derivatives/shirt-600w.webp 600w', html)
+
+    def test_uploads_are_resized_after_the_request(self):
+        Item.objects.filter(pk=self.shirt.pk).update(
+            image_width=600, image_height=300)
+        Image.new('RGB', (200, 100), 'blue').save(
+            default_storage.path('other.png'))
+        item = Item.objects.get(pk=self.shirt.pk)
+        item.image = 'other.png'
+        form = mock.Mock(changed_data=['image'])
+        executor = mock.Mock()
+        with mock.patch('core.images.transaction.on_commit') as on_commit, \
+                mock.patch('core.images._get_executor',
+                           return_value=executor):
+            ItemAdmin(Item, admin.site).save_model(None, item, form, True)
+            # Nothing is resized in the request...
+            item.refresh_from_db()
+            self.assertIsNone(item.image_width)
+            self.assertFalse(default_storage.exists(derivative_name(
+                'other.png', 200, 'jpg')))
+            self.assertFalse(executor.submit.called)
+            # ...but handed to a worker once the item is committed
+            on_commit.call_args[0][0]()
+        executor.submit.assert_called_once_with(
+            images._generate_in_worker, item.pk, 'other.png')
+
+        images.generate_item_derivatives(item.pk, 'other.png')
+        item.refresh_from_db()
+        self.assertEqual((item.image_width, item.image_height), (200, 100))
+        self.assertTrue(default_storage.exists(derivative_name(
+            'other.png', 200, 'jpg')))
+
+    def test_a_late_resize_does_not_overwrite_a_newer_upload(self):
+        Item.objects.filter(pk=self.shirt.pk).update(image='other.png')
+        images.generate_item_derivatives(self.shirt.pk, 'shirt.png')
+        self.shirt.refresh_from_db()
+        self.assertIsNone(self.shirt.image_width)
+
+
+def make_cursor(data):
+    return base64.urlsafe_b64encode(json.dumps(data).encode()).decode()
+
+
+class CursorPaginatorTest(TestCase):
+    def setUp(self):
+        for index, price in enumerate([300, 100, 200, 100, 300, 100]):
+            create_item('item-%d' % index, price=price)
+
+    def pages(self, ordering):
+        paginator = CursorPaginator(Item.objects.all(), 2, ordering)
+        pages = [paginator.page()]
+        while pages[-1].has_next():
+            pages.append(paginator.page(pages[-1].next_cursor))
+        # And back again from the last page
+        back = [pages[-1]]
+        while back[-1].has_previous():
+            back.append(paginator.page(back[-1].previous_cursor))
+        self.assertEqual([list(page) for page in reversed(back)],
+                         [list(page) for page in pages])
+        return [[item.slug for item in page] for page in pages]
+
+    def test_ties_and_directions(self):
+        self.assertEqual(self.pages(('price', 'pk')), [
+            ['item-1', 'item-3'], ['item-5', 'item-2'],
+            ['item-0', 'item-4']])
+        self.assertEqual(self.pages(('-price', '-pk')), [
+            ['item-4', 'item-0'], ['item-2', 'item-5'],
+            ['item-3', 'item-1']])
+
+    def test_invalid_cursors(self):
+        paginator = CursorPaginator(Item.objects.all(), 2, ('price', 'pk'))
+        for cursor in ['nope', make_cursor(5), make_cursor(['x', [1, 2]]),
+                       make_cursor(['n', 5]), make_cursor(['n', [1]]),
+                       make_cursor(['n', [[1], {}]]),
+                       make_cursor(['n', [None, 1]]),
+                       make_cursor(['n', ['zzz', 'x']])]:
+            with self.assertRaises(InvalidCursor):
+                paginator.page(cursor)
+
+        user = User.objects.create_user('shopper')
+        self.client.force_login(user)
+        for url, data in [('/?', ['n', 5]), ('/?', ['n', ['x']]),
+                          ('/?sort=price&', ['n', ['x', 1]]),
+                          ('/orders/?', ['n', ['zzz', 'x']]),
+                          ('/orders/?', ['n', [[1], {}]])]:
+            response = self.client.get(url + 'cursor=' + make_cursor(data))
+            self.assertEqual(response.status_code, 404, (url, data))
+
+
+class FragmentCacheTest(TestCase):
+    def test_fragments_follow_bulk_updates(self):
+        shirt = create_item('shirt', price=10000)
+        for url in ('/', '/product/shirt/'):
+            self.assertContains(self.client.get(url), '100.00')
+        # No signals and nothing shared with this process but the database
+        Item.objects.filter(pk=shirt.pk).update(
+            price=12000, updated_at=timezone.now())
+        for url in ('/', '/product/shirt/'):
+            response = self.client.get(url)
+            self.assertContains(response, '120.00')
+            self.assertNotContains(response, '100.00')
+
+
+class ConditionalGetTest(TestCase):
+    def setUp(self):
+        self.shirt = create_item('shirt')
+
+    def test_home_revalidates_with_one_query(self):
+        response = self.client.get('/')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('public', response['Cache-Control'])
+        self.assertIn('max-age=60', response['Cache-Control'])
+
+        # The catalog version, shared by the ETag and Last-Modified
+        with self.assertNumQueries(1):
+            response = self.client.get(
+                '/', HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+
+        etag = response['ETag']
+        self.shirt.save()
+        response = self.client.get('/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+        # An item added then deleted leaves the catalog as it was, but
+        # deleting one that was listed changes the ETag
+        etag = response['ETag']
+        create_item('hat').delete()
+        response = self.client.get('/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.shirt.delete()
+        response = self.client.get('/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+    def test_bulk_updates_change_the_etags(self):
+        # As another process (an import, say) would: no signals
+        responses = [self.client.get(url) for url in ('/', '/product/shirt/')]
+        Item.objects.filter(pk=self.shirt.pk).update(
+            price=250, updated_at=timezone.now())
+        for response in responses:
+            self.assertEqual(self.client.get(
+                response.wsgi_request.path,
+                HTTP_IF_NONE_MATCH=response['ETag']).status_code, 200)
+
+    def test_product_if_modified_since(self):
+        response = self.client.get('/product/shirt/')
+        last_modified = response['Last-Modified']
+        response = self.client.get('/product/shirt/',
+                                   HTTP_IF_MODIFIED_SINCE=last_modified)
+        self.assertEqual(response.status_code, 304)
+
+    def test_pages_showing_the_cart_are_private(self):
+        response = self.client.get('/')
+        self.client.get('/add-to-cart/shirt/')
+        # Shows the "added to your cart" message
+        self.client.get('/order-summary/')
+        # The badge in the navbar changed
+        response = self.client.get('/', HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('private', response['Cache-Control'])
+        self.assertNotIn('Last-Modified', response)
+
+
+class ImportCatalogTest(TestCase):
+    def import_rows(self, *rows):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'catalog.jsonl')
+            with open(path, 'w') as f:
+                for row in rows:
+                    f.write((row if isinstance(row, str)
+                             else json.dumps(row)) + '\n')
+            call_command('import_catalog', path, chunk_size=2, workers=1,
+                         stdout=StringIO(), stderr=StringIO())
+
+    def row(self, slug, price):
+        return {'slug': slug, 'title': slug.title(), 'price': price,
+                'category': 'S', 'label': 'P', 'description': slug}
+
+    def test_upserts_by_slug(self):
+        create_item('shirt', price=100)
+        self.import_rows(self.row('shirt', 120), self.row('hat', 50),
+                         'not json', self.row('bad slug', 1),
+                         self.row('scarf', 30))
+        self.assertEqual(
+            dict(Item.objects.values_list('slug', 'price')),
+            {'shirt': 12000, 'hat': 5000, 'scarf': 3000})
+
+        # Rupees in the file, paise in the database
+        self.import_rows(self.row('hat', '55.10'))
+        self.assertEqual(Item.objects.get(slug='hat').price, 5510)
+        self.assertEqual(Item.objects.count(), 3)
+
+    def test_reprices_open_carts(self):
+        create_item('shirt', price=10000)
+        create_item('hat', price=500)
+        user = User.objects.create_user('shopper')
+        add_item(user, 'shirt')
+        add_item(user, 'hat')
+        self.import_rows(self.row('shirt', 120))
+        order = Order.objects.get(user=user, ordered=False)
+        self.assertEqual((order.subtotal, order.grand_total), (12500, 12500))
+
+        remove_item(user, 'shirt')
+        order.refresh_from_db()
+        self.assertEqual((order.subtotal, order.grand_total), (500, 500))
+
+
+class PrepopulateTest(TestCase):
+    def prepopulate(self, **options):
+        call_command('prepopulate', users=5, items=4, orders=12, coupons=2,
+                     carts=1, refunds=0.5, stdout=StringIO(), **options)
+        return list(Order.objects.order_by('user__username', 'ref_code')
+                    .values_list('user__username', 'ref_code',
+                                 'grand_total', 'ordered_date'))
+
+    def test_same_seed_same_data(self):
+        orders = self.prepopulate(seed=3)
+        self.assertEqual(len(orders), 12 + 5)
+        for order in Order.objects.prefetch_related('items__item'):
+            totals = order.compute_totals()
+            self.assertEqual(order.grand_total, totals['grand_total'])
+        paid = Order.objects.filter(ordered=True)
+        self.assertEqual(paid.filter(payment__isnull=False).count(), 12)
+        self.assertFalse(Address.objects.filter(fingerprint=None).exists())
+
+        self.assertEqual(self.prepopulate(seed=3, clear=True), orders)
+        self.assertNotEqual(self.prepopulate(seed=4, clear=True), orders)
+
+
+class AdminChangelistTest(TestCase):
+    def setUp(self):
+        self.client.force_login(User.objects.create_superuser(
+            'admin', 'admin@example.com', 'admin'))
+        self.coupon = Coupon.objects.create(code='TEN', amount=1000)
+        create_item('shirt')
+
+    def add_orders(self, count):
+        start = Order.objects.count()
+        for index in range(start, start + count):
+            user = User.objects.create_user('shopper-%d' % index)
+            add_item(user, 'shirt')
+            address = Address.objects.create(
+                user=user, street_address='%d Main Street' % index,
+                country='IN', zip='400001', address_type='S')
+            payment = Payment.objects.create(
+                stripe_payment_id='cs_%d' % index, user=user, amount=10000,
+                stripe_payment_intent_id='pi_%d' % index)
+            Order.objects.filter(user=user).update(
+                shipping_address=address, billing_address=address,
+                payment=payment, coupon=self.coupon)
+
+    def test_query_count_does_not_depend_on_rows(self):
+        urls = ['/admin/core/order/', '/admin/core/orderitem/',
+                '/admin/core/address/', '/admin/core/payment/']
+        counts = {url: [] for url in urls}
+        for count in (1, 10):
+            self.add_orders(count)
+            for url in urls:
+                with CaptureQueriesContext(connection) as queries:
+                    response = self.client.get(url)
+                self.assertEqual(response.status_code, 200)
+                counts[url].append(len(queries))
+        for url in urls:
+            self.assertEqual(counts[url][0], counts[url][1], url)
+
+    def test_plan_rows(self):
+        plan = [{'Plan': {'Node Type': 'Seq Scan', 'Plan Rows': 12345}}]
+        self.assertEqual(plan_rows(plan), 12345)
+        self.assertEqual(plan_rows(json.dumps(plan)), 12345)
+
+    @skipUnless(connection.vendor == 'postgresql', 'Needs PostgreSQL')
+    def test_estimated_count(self):
+        self.add_orders(3)
+        self.assertGreater(estimated_count(Order.objects.all()), 0)
+        paginator = EstimatedCountPaginator(
+            Order.objects.order_by('-pk'), 100)
+        # Below the threshold, counted exactly
+        self.assertEqual(paginator.count, 3)
+
+    @skipIf(connection.vendor == 'postgresql', 'Estimates on PostgreSQL')
+    def test_count_is_exact_on_other_databases(self):
+        self.add_orders(2)
+        paginator = EstimatedCountPaginator(Order.objects.order_by('pk'), 1)
+        with self.assertNumQueries(1):
+            self.assertEqual(paginator.count, 2)
+
+
+class ExportOrdersTest(TestCase):
+    def setUp(self):
+        create_item('shirt', price=10050)
+        for index, day in enumerate(['2026-01-10', '2026-02-10']):
+            user = User.objects.create_user('shopper-%d' % index)
+            add_item(user, 'shirt')
+            payment = Payment.objects.create(
+                stripe_payment_id='cs_%d' % index, user=user, amount=10050,
+                stripe_payment_intent_id='pi_%d' % index)
+            Order.objects.filter(user=user).update(
+                ordered=True, ref_code='ref-%d' % index, payment=payment,
+                ordered_date=timezone.make_aware(
+                    timezone.datetime.strptime(day, '%Y-%m-%d')))
+        order = Order.objects.get(ref_code='ref-1')
+        order.refund_requested = True
+        order.save()
+        order.refund_set.create(reason='Too big', email='a@example.com')
+        # A cart, never exported
+        add_item(User.objects.create_user('browser'), 'shirt')
+
+    def test_staff_url_streams_filtered_csv(self):
+        url = '/staff/export/orders/'
+        self.assertEqual(self.client.get(url).status_code, 302)
+        self.client.force_login(User.objects.create_superuser(
+            'admin', 'admin@example.com', 'admin'))
+
+        response = self.client.get(url)
+        self.assertTrue(response.streaming)
+        rows = list(csv.DictReader(
+            b''.join(response.streaming_content).decode().splitlines()))
+        self.assertEqual([row['ref_code'] for row in rows], ['ref-0', 'ref-1'])
+        self.assertEqual(rows[1]['items'], '1 x shirt')
+        self.assertEqual(rows[1]['grand_total'], '100.50')
+        self.assertEqual(rows[1]['refunds'], 'Too big (pending)')
+
+        response = self.client.get(url, {'status': 'refund_requested',
+                                         'format': 'jsonl'})
+        records = [json.loads(line) for line in
+                   b''.join(response.streaming_content).splitlines()]
+        self.assertEqual([record['ref_code'] for record in records],
+                         ['ref-1'])
+        # Only what the order stored: today's item prices could disagree
+        self.assertEqual(records[0]['items'], [
+            {'slug': 'shirt', 'title': 'shirt', 'quantity': 1}])
+        self.assertEqual(records[0]['payment_amount'], '100.50')
+        self.assertEqual(self.client.get(
+            url, {'since': '2026-03-01', 'until': '2026-01-01'}
+        ).status_code, 400)
+
+    def test_command_reads_in_chunks(self):
+        def export(**options):
+            out = StringIO()
+            call_command('export_orders', format='jsonl', stdout=out,
+                         **options)
+            return [json.loads(line)['ref_code']
+                    for line in out.getvalue().splitlines()]
+
+        # The orders, then the items and refunds of each chunk
+        with self.assertNumQueries(1 + 2 * 2):
+            self.assertEqual(export(chunk_size=1), ['ref-0', 'ref-1'])
+        self.assertEqual(export(since='2026-01-01', until='2026-01-31'),
+                         ['ref-0'])
+
+
+class SalesRollupTest(TestCase):
+    def setUp(self):
+        create_item('shirt', price=10050, discount_price=9000)
+        self.now = timezone.now()
+
+    def pay(self, username, quantity, days_ago):
+        user = User.objects.create_user(username)
+        for _ in range(quantity):
+            add_item(user, 'shirt')
+        order = Order.objects.get(user=user)
+        payment = fulfill_order({
+            'id': 'cs_' + username, 'payment_intent': 'pi_' + username,
+            'amount_total': order.grand_total,
+            'metadata': {'user_id': str(user.pk), 'order_id': str(order.pk),
+                         'coupon': 'None', 'coupon_amount': '0'},
+        })
+        paid_at = self.now - timezone.timedelta(days=days_ago, minutes=5)
+        Payment.objects.filter(pk=payment.pk).update(timestamp=paid_at)
+        return order, timezone.localdate(paid_at)
+
+    def test_refresh_is_incremental(self):
+        first, first_day = self.pay('first', 2, days_ago=30)
+        refresh_sales_rollups()
+        day = DailySales.objects.get(date=first_day)
+        self.assertEqual((day.orders, day.units, day.revenue, day.discount),
+                         (1, 2, 18000, 2100))
+        item = DailyItemSales.objects.get(date=first_day)
+        self.assertEqual((item.units, item.revenue), (2, 18000))
+        self.assertEqual(DailyCategorySales.objects.get(
+            date=first_day).category, 'S')
+
+        # As if that run was three days ago. The new payment's day and
+        # the days of orders whose refund state changed since are
+        # redone, however old
+        RollupWatermark.objects.update(
+            timestamp=self.now - timezone.timedelta(days=3))
+        second, second_day = self.pay('second', 1, days_ago=2)
+        Order.objects.filter(pk=first.pk).update(ref_code='first-ref')
+        self.client.post('/request-refund/', {
+            'ref_code': 'first-ref', 'message': 'Too small',
+            'email': 'first@example.com'})
+        # Nothing to wait for before counting what just happened
+        with mock.patch('core.rollups.SETTLE_DELAY', timezone.timedelta()):
+            self.assertEqual(refresh_sales_rollups(),
+                             [first_day, second_day])
+            self.assertEqual(DailySales.objects.get(date=second_day).revenue,
+                             9000)
+            self.assertEqual(DailySales.objects.get(
+                date=first_day).refund_requests, 1)
+
+            make_refund_accepted(None, None,
+                                 Order.objects.filter(pk=first.pk))
+            self.assertEqual(refresh_sales_rollups(), [first_day])
+            self.assertEqual(DailySales.objects.get(
+                date=first_day).refunds_granted, 1)
+            self.assertEqual(refresh_sales_rollups(), [])
+
+        refresh_sales_rollups(rebuild=True)
+        self.assertEqual(DailySales.objects.count(), 2)
+
+    def test_revenue_is_what_the_orders_were_paid(self):
+        _, day = self.pay('first', 2, days_ago=1)
+        Item.objects.filter(slug='shirt').update(price=20000,
+                                                 discount_price=None)
+        refresh_sales_rollups()
+        totals = DailySales.objects.get(date=day)
+        self.assertEqual((totals.revenue, totals.discount), (18000, 2100))
+        for rollup in (DailyItemSales, DailyCategorySales):
+            row = rollup.objects.get()
+            self.assertEqual((row.revenue, row.discount), (18000, 2100))
+
+    def test_dashboard_reads_rollups(self):
+        self.pay('first', 1, days_ago=1)
+        refresh_sales_rollups()
+        url = '/staff/sales/'
+        self.assertEqual(self.client.get(url).status_code, 302)
+        self.client.force_login(User.objects.create_superuser(
+            'admin', 'admin@example.com', 'admin'))
+        # Session, user and the navbar's cart, then days, items,
+        # categories and watermark
+        with self.assertNumQueries(3 + 4):
+            response = self.client.get(url, {'days': 7})
+        self.assertEqual(len(response.context['daily']), 7)
+        self.assertEqual(response.context['totals']['revenue'], 9000)
+        self.assertEqual(response.context['top_items'][0]['item__slug'],
+                         'shirt')
+        self.assertEqual(response.context['categories'][0]['name'], 'Shirt')
+
+
+class OrderHistoryTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('buyer', password='buyer')
+        self.items = [create_item('item-%d' % index) for index in range(3)]
+        self.address = Address.objects.create(
+            user=self.user, street_address='1 Main St', country='IN',
+            zip='110001', address_type='S')
+        self.count = 0
+        add_item(self.user, 'item-0')
+
+    def add_orders(self, count):
+        for _ in range(count):
+            self.count += 1
+            payment = Payment.objects.create(
+                stripe_payment_id='cs_%d' % self.count, user=self.user,
+                amount=300)
+            order = Order.objects.create(
+                user=self.user, ordered=True, payment=payment,
+                ref_code='ref-%02d' % self.count,
+                shipping_address=self.address, billing_address=self.address,
+                ordered_date=timezone.now() + timezone.timedelta(
+                    minutes=self.count))
+            order.items.set([
+                OrderItem.objects.create(user=self.user, item=item,
+                                         ordered=True)
+                for item in self.items])
+            order.refund_set.create(reason='Late', email='b@example.com')
+
+    def get(self, *args):
+        # Session, user and the navbar's cart, then the orders and their
+        # items and refunds
+        with self.assertNumQueries(3 + 3):
+            response = self.client.get(*args)
+        self.assertEqual(response.status_code, 200)
+        return response
+
+    def test_login_required(self):
+        self.assertEqual(self.client.get('/orders/').status_code, 302)
+
+    def test_query_count_is_fixed(self):
+        self.client.force_login(self.user)
+        self.add_orders(1)
+        self.assertEqual(
+            [order.ref_code for order in self.get('/orders/').context[
+                'object_list']], ['ref-01'])
+
+        self.add_orders(24)
+        response = self.get('/orders/')
+        orders = response.context['object_list']
+        self.assertEqual([order.ref_code for order in orders],
+                         ['ref-%02d' % index for index in range(25, 15, -1)])
+        self.assertContains(response, 'Refund request: Late', count=10)
+
+        page = response.context['page_obj']
+        response = self.get('/orders/', {'cursor': page.next_cursor})
+        self.assertEqual(response.context['object_list'][0].ref_code,
+                         'ref-15')
+        self.assertEqual(self.client.get(
+            '/orders/', {'cursor': 'nope'}).status_code, 404)
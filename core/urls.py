@@ -1,11 +1,14 @@
 from django.urls import path
 from .views import (
     HomeView,
+    ItemSearchView,
     ItemDetailView,
     add_to_cart,
     remove_from_cart,
     OrderSummaryView,
+    OrderHistoryView,
     remove_single_item_from_cart,
+    cart_api,
     CheckoutView,
     PaymentLanding,
     CheckoutSession,
@@ -14,12 +17,15 @@ from .views import (
     stripe_webhook,
     AddCouponView,
     RequestRefundView,
+    export_orders,
+    SalesDashboardView,
 )
 
 app_name = "core"
 
 urlpatterns = [
     path('', HomeView.as_view(), name='item_list'),
+    path('search/', ItemSearchView.as_view(), name='search'),
     path('product/<slug>/', ItemDetailView.as_view(), name='product'),
     path('add-to-cart/<slug>/', add_to_cart, name="add-to-cart"),
     path('remove-from-cart/<slug>/',
@@ -27,6 +33,8 @@ urlpatterns = [
     path('remove-item-from-cart/<slug>/',
          remove_single_item_from_cart, name='remove-single-item-from-cart'),
     path('order-summary/', OrderSummaryView.as_view(), name='order-summary'),
+    path('orders/', OrderHistoryView.as_view(), name='order-history'),
+    path('api/cart/', cart_api, name='cart-api'),
     path('checkout/', CheckoutView.as_view(), name="checkout"),
     path('create-checkout-session',
          CheckoutSession.as_view(), name="create-checkout-session"),
@@ -38,5 +46,7 @@ urlpatterns = [
     path('add-coupon/', AddCouponView.as_view(), name="add-coupon"),
     path('request-refund/',
          RequestRefundView.as_view(), name='request-refund'),
+    path('staff/export/orders/', export_orders, name='export-orders'),
+    path('staff/sales/', SalesDashboardView.as_view(), name='sales-dashboard'),
 
 ]
@@ -1,36 +1,49 @@
+import json
 import stripe
-from django.contrib.auth.models import User
+from django.utils.decorators import method_decorator
 from django.views.decorators.csrf import csrf_exempt
-from django.http import JsonResponse, HttpResponse
+from django.views.decorators.http import require_http_methods
+from django.db.models import Prefetch, Sum
+from django.utils import timezone
+from datetime import timedelta
+from django.http import JsonResponse, HttpResponse, Http404
 from django.conf import settings
+from django.contrib.admin.views.decorators import staff_member_required
 from django.contrib.auth.mixins import LoginRequiredMixin
-from django.contrib.auth.decorators import login_required
 from django.core.exceptions import ObjectDoesNotExist
 from django.contrib import messages
-from django.utils import timezone
 from django.shortcuts import redirect
 from django.views.generic import View, ListView, DetailView, TemplateView
 from .forms import (CheckoutForm,
                     CouponForm,
+                    OrderExportForm,
                     RefundForm)
-from django.shortcuts import render, get_object_or_404
-from .models import (Item,
-                     OrderItem,
+from django.shortcuts import render
+from .caching import attach_item_versions
+from .conditional import (catalog_etag, catalog_last_modified,
+                          conditional_catalog_page, item_etag,
+                          item_last_modified)
+from . import cart, exports
+from .addresses import (forget_default_addresses, get_default_addresses,
+                        get_or_create_address)
+from .cart import get_active_order, prefetch_order_lines
+from .coupons import coupon_registry
+from .pagination import CursorPaginator, InvalidCursor, cached_count
+from .rollups import SALES_WATERMARK
+from .search import search_items
+from .models import (CATEGORY_CHOICES,
+                     DailyCategorySales,
+                     DailyItemSales,
+                     DailySales,
+                     Item,
                      Order,
-                     Address,
-                     Payment,
-                     Coupon,
-                     Refund,)
-import random
-import string
+                     OrderItem,
+                     Refund,
+                     RollupWatermark,
+                     StripeEvent,)
 stripe.api_key = settings.STRIPE_SECRET_KEY
 
 
-def create_ref_code():
-    return ''.join(random.choices(
-        string.ascii_lowercase + string.digits, k=14))
-
-
 def Items_list(request):
     context = {
         'items': Item.objects.all(),
@@ -38,24 +51,119 @@ def Items_list(request):
     return render(request, "home.html", context)
 
 
+@method_decorator(conditional_catalog_page(catalog_etag,
+                                           catalog_last_modified),
+                  name='dispatch')
 class HomeView(ListView):
     model = Item
     paginate_by = 10
     template_name = "home.html"
+    # Keyset pagination on ?cursor= instead of OFFSET paging on ?page=
+    cursor_pagination = True
+    orderings = {
+        'price': ('price', 'pk'),
+    }
 
-
-class OrderSummaryView(LoginRequiredMixin, View):
-    def get(self, *args, **kwargs):
+    def get_category(self):
+        category = self.request.GET.get('category')
+        if category in dict(CATEGORY_CHOICES):
+            return category
+        return None
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        category = self.get_category()
+        if category:
+            queryset = queryset.filter(category=category)
+        return queryset
+
+    def paginate_queryset(self, queryset, page_size):
+        if not self.cursor_pagination:
+            return super().paginate_queryset(queryset, page_size)
+        ordering = self.orderings.get(self.request.GET.get('sort'), ('pk',))
+        paginator = CursorPaginator(queryset, page_size, ordering)
         try:
-            order = Order.objects.get(user=self.request.user, ordered=False)
-            context = {
-                'object': order
-            }
-            return render(self.request, 'order_summary.html', context)
+            page = paginator.page(self.request.GET.get('cursor'))
+        except InvalidCursor:
+            raise Http404("Invalid cursor")
+        return (paginator, page, page.object_list, page.has_other_pages())
 
-        except ObjectDoesNotExist:
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        # Carried over to the pagination links
+        params = self.request.GET.copy()
+        params.pop('page', None)
+        params.pop('cursor', None)
+        context.update({
+            'categories': CATEGORY_CHOICES,
+            'current_category': self.get_category(),
+            'query': self.request.GET.get('q', ''),
+            'page_query': params.urlencode() + '&' if params else '',
+            'cursor_pagination': self.cursor_pagination,
+            # Keys the cached item_card.html fragments
+            'object_list': attach_item_versions(context['object_list']),
+        })
+        if self.cursor_pagination:
+            context['item_count'] = cached_count(self.get_queryset())
+        return context
+
+
+class ItemSearchView(HomeView):
+    # Results are ranked, and capped at search.MAX_RESULTS
+    cursor_pagination = False
+
+    def get_queryset(self):
+        query = self.request.GET.get('q', '').strip()
+        queryset = super().get_queryset()
+        if not query:
+            return queryset
+        return search_items(queryset, query, self.get_category())
+
+
+class OrderSummaryView(View):
+    def get(self, *args, **kwargs):
+        if self.request.user.is_authenticated:
+            order = get_active_order(self.request)
+            if order is not None:
+                prefetch_order_lines(order)
+        else:
+            guest_cart = cart.get_guest_cart(self.request)
+            order = guest_cart.get_order() if guest_cart.lines else None
+        if order is None:
             messages.error(self.request, "You do not have an active order.")
             return redirect("/")
+        context = {
+            'object': order
+        }
+        return render(self.request, 'order_summary.html', context)
+
+
+class OrderHistoryView(LoginRequiredMixin, ListView):
+    # The user's paid orders, newest first, keyset paginated on ?cursor=
+    paginate_by = 10
+    template_name = "order_history.html"
+    ordering = ('-ordered_date', '-pk')
+
+    def get_queryset(self):
+        # A fixed number of queries per page, however many orders and
+        # lines it shows
+        return Order.objects.filter(
+            user=self.request.user, ordered=True
+        ).select_related(
+            'shipping_address', 'billing_address', 'payment', 'coupon'
+        ).prefetch_related(
+            Prefetch('items',
+                     queryset=OrderItem.objects.select_related('item')),
+            'refund_set',
+        )
+
+    def paginate_queryset(self, queryset, page_size):
+        paginator = CursorPaginator(queryset, page_size, self.ordering)
+        try:
+            page = paginator.page(self.request.GET.get('cursor'))
+        except InvalidCursor:
+            raise Http404("Invalid cursor")
+        return (paginator, page, page.object_list, page.has_other_pages())
 
 
 def is_valid_form(values):
@@ -66,58 +174,43 @@ def is_valid_form(values):
     return valid
 
 
-class CheckoutView(View):
+class CheckoutView(LoginRequiredMixin, View):
     def get(self, *args, **kwargs):
-        try:
-            order = Order.objects.get(user=self.request.user, ordered=False)
-            form = CheckoutForm()
-            context = {
-                'form': form,
-                'couponform': CouponForm(),
-                'object': order,
-            }
-
-            shipping_address_qs = Address.objects.filter(
-                user=self.request.user,
-                address_type='S',
-                default=True
-            )
-            if shipping_address_qs.exists():
-                context.update(
-                    {'default_shipping_address': shipping_address_qs[0]})
-
-            billing_address_qs = Address.objects.filter(
-                user=self.request.user,
-                address_type='B',
-                default=True
-            )
-            if billing_address_qs.exists():
-                context.update(
-                    {'default_billing_address': billing_address_qs[0]})
-            return render(self.request, "checkout.html", context)
-        except ObjectDoesNotExist:
+        order = get_active_order(self.request)
+        if order is None:
             messages.info(self.request, "You do not have an active order")
-            return redirect("core:checkout")
+            return redirect("core:order-summary")
+        form = CheckoutForm()
+        context = {
+            'form': form,
+            'couponform': CouponForm(),
+            'object': prefetch_order_lines(order),
+        }
+
+        defaults = get_default_addresses(self.request)
+        if defaults['S'] is not None:
+            context['default_shipping_address'] = defaults['S']
+        if defaults['B'] is not None:
+            context['default_billing_address'] = defaults['B']
+        return render(self.request, "checkout.html", context)
 
     def post(self, *args, **kwargs):
         form = CheckoutForm(self.request.POST or None)
         try:
-            order = Order.objects.get(user=self.request.user, ordered=False)
+            order = get_active_order(self.request)
+            if order is None:
+                raise ObjectDoesNotExist
             if form.is_valid():
 
                 use_default_shipping = form.cleaned_data.get(
                     'use_default_shipping')
                 if use_default_shipping:
                     print("Using the defualt shipping address")
-                    address_qs = Address.objects.filter(
-                        user=self.request.user,
-                        address_type='S',
-                        default=True
-                    )
-                    if address_qs.exists():
-                        shipping_address = address_qs[0]
+                    shipping_address = get_default_addresses(
+                        self.request)['S']
+                    if shipping_address is not None:
                         order.shipping_address = shipping_address
-                        order.save()
+                        order.save(update_fields=['shipping_address'])
                     else:
                         messages.info(
                             self.request,
@@ -136,24 +229,22 @@ class CheckoutView(View):
                     if is_valid_form([shipping_address1,
                                       shipping_country,
                                       shipping_zip]):
-                        shipping_address = Address(
-                            user=self.request.user,
+                        shipping_address = get_or_create_address(
+                            self.request.user, 'S',
                             street_address=shipping_address1,
                             apartment_address=shipping_address2,
                             country=shipping_country,
                             zip=shipping_zip,
-                            address_type='S'
                         )
-                        shipping_address.save()
 
                         order.shipping_address = shipping_address
-                        order.save()
+                        order.save(update_fields=['shipping_address'])
 
                         set_default_shipping = form.cleaned_data.get(
                             'set_default_shipping')
                         if set_default_shipping:
-                            shipping_address.default = True
-                            shipping_address.save()
+                            shipping_address.make_default()
+                            forget_default_addresses(self.request)
 
                     else:
                         messages.info(
@@ -167,25 +258,23 @@ class CheckoutView(View):
                     'same_billing_address')
 
                 if same_billing_address:
-                    billing_address = shipping_address
-                    billing_address.pk = None
-                    billing_address.save()
-                    billing_address.address_type = 'B'
-                    billing_address.save()
+                    billing_address = get_or_create_address(
+                        self.request.user, 'B',
+                        street_address=shipping_address.street_address,
+                        apartment_address=shipping_address.apartment_address,
+                        country=shipping_address.country,
+                        zip=shipping_address.zip,
+                    )
                     order.billing_address = billing_address
-                    order.save()
+                    order.save(update_fields=['billing_address'])
 
                 elif use_default_billing:
                     print("Using the defualt billing address")
-                    address_qs = Address.objects.filter(
-                        user=self.request.user,
-                        address_type='B',
-                        default=True
-                    )
-                    if address_qs.exists():
-                        billing_address = address_qs[0]
+                    billing_address = get_default_addresses(
+                        self.request)['B']
+                    if billing_address is not None:
                         order.billing_address = billing_address
-                        order.save()
+                        order.save(update_fields=['billing_address'])
                     else:
                         messages.info(
                             self.request,
@@ -204,24 +293,22 @@ class CheckoutView(View):
                     if is_valid_form([billing_address1,
                                       billing_country,
                                       billing_zip]):
-                        billing_address = Address(
-                            user=self.request.user,
+                        billing_address = get_or_create_address(
+                            self.request.user, 'B',
                             street_address=billing_address1,
                             apartment_address=billing_address2,
                             country=billing_country,
                             zip=billing_zip,
-                            address_type='B'
                         )
-                        billing_address.save()
 
                         order.billing_address = billing_address
-                        order.save()
+                        order.save(update_fields=['billing_address'])
 
                         set_default_billing = form.cleaned_data.get(
                             'set_default_billing')
                         if set_default_billing:
-                            billing_address.default = True
-                            billing_address.save()
+                            billing_address.make_default()
+                            forget_default_addresses(self.request)
 
                     else:
                         messages.info(
@@ -258,7 +345,9 @@ class PaymentLanding(TemplateView):
     template_name = "payment.html"
 
     def get_context_data(self, **kwargs):
-        order = Order.objects.get(user=self.request.user, ordered=False)
+        order = get_active_order(self.request)
+        if order is not None:
+            prefetch_order_lines(order)
 
         context = super(PaymentLanding,
                         self).get_context_data(**kwargs)
@@ -272,8 +361,11 @@ class PaymentLanding(TemplateView):
 class CheckoutSession(View):
     def post(self, *args, **kwargs):
         YOUR_DOMAIN = "http://127.0.0.1:8000/"
-        order = Order.objects.get(user=self.request.user, ordered=False)
-        amount = int(order.get_total() * 100)  # Rupees
+        order = get_active_order(self.request)
+        if order is None:
+            return JsonResponse(
+                {'error': "You do not have an active order"}, status=400)
+        amount = order.get_total()  # Paise
 
         checkout_session = stripe.checkout.Session.create(
             payment_method_types=['card'],
@@ -297,7 +389,7 @@ class CheckoutSession(View):
                 'user_id': self.request.user.id,
                 'order_id': order.id,
                 'coupon': order.coupon,
-                'coupon_amount': order.coupon.amount,
+                'coupon_amount': order.coupon_discount,
             },
             mode='payment',
             success_url=YOUR_DOMAIN + 'success',
@@ -324,156 +416,131 @@ def stripe_webhook(request):
     except stripe.error.SignatureVerificationError as e:
         # Invalid signature
         return HttpResponse(status=400)
-    if event['type'] == 'checkout.session.completed':
-        session = event['data']['object']
-        fulfill_order(request, session)
-    # Passed signature verification
+    # Passed signature verification: store the event for the
+    # process_stripe_events worker and acknowledge it straight away.
+    # Stripe retries deliveries, so an event may arrive more than once.
+    StripeEvent.objects.get_or_create(
+        event_id=event['id'],
+        defaults={
+            'type': event['type'],
+            'payload': payload.decode('utf-8'),
+        })
     return HttpResponse(status=200)
 
 
-def fulfill_order(request, session):
-    # Fulfill the purchase...
-    payment_id = session["id"]
-    payment_intent_id = session["payment_intent"]
-    user_id = session["metadata"]["user_id"]
-    order_id = session["metadata"]["order_id"]
-    total_amount_temp = session["amount_total"]
-    coupon = session["metadata"]["coupon"]
-    coupon_amount = session["metadata"]["coupon_amount"]
-    # Paise to Rupees Conversion
-    total_amount_final = int(total_amount_temp) // 100
-    user_main = User.objects.get(id=user_id)
-    order = Order.objects.get(id=order_id)
-    # Create Payment
-    payment = Payment()
-    payment.stripe_payment_id = payment_id
-    payment.stripe_payment_intent_id = payment_intent_id
-    payment.user = user_main
-    payment.amount = total_amount_final
-    payment.coupon = coupon
-    payment.coupon_amount = coupon_amount
-    payment.save()
-
-    # Setting ordered is True for all ordered Items
-    order_items = order.items.all()
-    order_items.update(ordered=True)
-    for item in order_items:
-        item.save()
-
-    # Assign payment to order
-    order.ordered = True
-    order.payment = payment
-    order.ref_code = create_ref_code()
-    order.save()
-
 # Latest Stripe API -end
 
 
+@method_decorator(conditional_catalog_page(item_etag, item_last_modified),
+                  name='dispatch')
 class ItemDetailView(DetailView):
     model = Item
     template_name = "product.html"
 
+    def get_context_data(self, **kwargs):
+        # Keys the cached product_detail.html fragment
+        attach_item_versions([self.object])
+        return super().get_context_data(**kwargs)
+
 
-@ login_required
 def add_to_cart(request, slug):
-    item = get_object_or_404(Item, slug=slug)
-    order_item, created = OrderItem.objects.get_or_create(
-        item=item,
-        user=request.user,
-        ordered=False
-    )
-    order_qs = Order.objects.filter(user=request.user, ordered=False)
-    if order_qs.exists():
-        order = order_qs[0]
-        # check if order item is in order
-        if order.items.filter(item__slug=item.slug).exists():
-            order_item.quantity += 1
-            order_item.save()
-            messages.info(request, "Item quantity was updated.")
-            return redirect("core:order-summary")
+    try:
+        if request.user.is_authenticated:
+            added = cart.add_item(request.user, slug)
         else:
-            messages.info(request, "This item was added to your cart")
-            order.items.add(order_item)
-            return redirect("core:order-summary")
-    else:
-        ordered_date = timezone.now()
-        order = Order.objects.create(
-            user=request.user, ordered_date=ordered_date)
-        order.items.add(order_item)
-        messages.info(request, "This item was added to your cart")
+            added = cart.get_guest_cart(request).add_item(slug)
+    except cart.InvalidCartOperation:
+        messages.warning(
+            request, "Your cart is full, please log in to add more items.")
         return redirect("core:order-summary")
+    if added:
+        messages.info(request, "This item was added to your cart")
+    else:
+        messages.info(request, "Item quantity was updated.")
+    return redirect("core:order-summary")
 
 
-@ login_required
 def remove_from_cart(request, slug):
-    item = get_object_or_404(Item, slug=slug)
-    order_qs = Order.objects.filter(
-        user=request.user,
-        ordered=False
-    )
-    if order_qs.exists():
-        order = order_qs[0]
-        # check if order item is in order
-        if order.items.filter(item__slug=item.slug).exists():
-            order_item = OrderItem.objects.filter(
-                item=item,
-                user=request.user,
-                ordered=False
-            )[0]
-            order.items.remove(order_item)
-            messages.info(request, "This item was removed from your cart")
-            return redirect("core:order-summary")
-        else:
-            # Add a message saying the user dosent have an order
-            messages.info(request, "This item was not in your cart.")
-            return redirect("core:product",
-                            slug=slug)
+    if request.user.is_authenticated:
+        removed = cart.remove_item(request.user, slug)
+    else:
+        removed = cart.get_guest_cart(request).remove_item(slug)
+    if removed:
+        messages.info(request, "This item was removed from your cart")
+        return redirect("core:order-summary")
     else:
-        messages.info(request, "You do not have an active user.")
+        messages.info(request, "This item was not in your cart.")
         return redirect("core:product",
                         slug=slug)
 
 
 def remove_single_item_from_cart(request, slug):
-    item = get_object_or_404(Item, slug=slug)
-    order_qs = Order.objects.filter(
-        user=request.user,
-        ordered=False
-    )
-    if order_qs.exists():
-        order = order_qs[0]
-        # check if order item is in order
-        if order.items.filter(item__slug=item.slug).exists():
-            order_item = OrderItem.objects.filter(
-                item=item,
-                user=request.user,
-                ordered=False
-            )[0]
-            if order_item.quantity > 1:
-                order_item.quantity -= 1
-                order_item.save()
-            else:
-                order.items.remove(order_item)
-            messages.info(request, "Item quantity was updated.")
-            return redirect("core:order-summary")
-        else:
-            # Add a message saying the user dosent have an order
-            messages.info(request, "This item was not in your cart.")
-            return redirect("core:product",
-                            slug=slug)
+    if request.user.is_authenticated:
+        removed = cart.remove_single_item(request.user, slug)
     else:
-        messages.info(request, "You do not have an active user.")
+        removed = cart.get_guest_cart(request).remove_single_item(slug)
+    if removed:
+        messages.info(request, "Item quantity was updated.")
+        return redirect("core:order-summary")
+    else:
+        messages.info(request, "This item was not in your cart.")
         return redirect("core:product",
                         slug=slug)
 
 
-def get_coupon(request, code):
+def serialize_cart(order):
+    # Amounts are integers, in paise
+    lines = []
+    if order is not None:
+        for order_item in order.items.all():
+            lines.append({
+                'slug': order_item.item.slug,
+                'title': order_item.item.title,
+                'quantity': order_item.quantity,
+                'price': order_item.item.price,
+                'discount_price': order_item.item.discount_price,
+                'total': order_item.get_final_price(),
+            })
+    return {
+        'lines': lines,
+        'item_count': len(lines),
+        'subtotal': order.subtotal if order else 0,
+        'savings': order.savings if order else 0,
+        'coupon_discount': order.coupon_discount if order else 0,
+        'grand_total': order.grand_total if order else 0,
+    }
+
+
+@require_http_methods(['GET', 'POST'])
+def cart_api(request):
+    # GET returns the cart, POST applies {"operations": [...]} to it
+    # (see cart.apply_operations) and returns the result
+    if not request.user.is_authenticated:
+        return JsonResponse({'error': "Authentication required"}, status=401)
+    if request.method == 'GET':
+        order = get_active_order(request)
+        if order is not None:
+            prefetch_order_lines(order)
+        return JsonResponse(serialize_cart(order))
+
+    try:
+        data = json.loads(request.body)
+    except ValueError:
+        return JsonResponse({'error': "Invalid JSON"}, status=400)
+    if not isinstance(data, dict):
+        return JsonResponse({'error': "Expected a JSON object"}, status=400)
     try:
-        coupon = Coupon.objects.get(code=code)
-        return coupon
-    except ObjectDoesNotExist:
+        order = cart.apply_operations(request.user, data.get('operations'))
+    except cart.InvalidCartOperation as e:
+        return JsonResponse({'error': str(e)}, status=400)
+    return JsonResponse(serialize_cart(order))
+
+
+def get_coupon(request, code):
+    coupon = coupon_registry.get(code)
+    if coupon is None:
         messages.info(request, "This coupon does not exist.")
-        return("core:checkout")
+    return coupon
 
 
 class AddCouponView(View):
@@ -482,15 +549,19 @@ class AddCouponView(View):
         if form.is_valid():
             try:
                 code = form.cleaned_data.get('code')
-                order = Order.objects.get(
-                    user=self.request.user, ordered=False)
-                order.coupon = get_coupon(self.request, code)
-                order.save()
+                order = get_active_order(self.request)
+                if order is None:
+                    raise ObjectDoesNotExist
+                coupon = get_coupon(self.request, code)
+                if coupon is None:
+                    return redirect("core:checkout")
+                order.apply_coupon(coupon)
                 messages.success(self.request, "Successfully added coupon")
                 return redirect("core:checkout")
             except ObjectDoesNotExist:
                 messages.info(self.request, "You do not have an active order")
                 return redirect("core:checkout")
+        return redirect("core:checkout")
 
 
 class RequestRefundView(View):
@@ -511,6 +582,7 @@ class RequestRefundView(View):
             try:
                 order = Order.objects.get(ref_code=ref_code)
                 order.refund_requested = True
+                order.refund_updated_at = timezone.now()
                 order.save()
 
                 # store the refund
@@ -526,3 +598,64 @@ class RequestRefundView(View):
             except ObjectDoesNotExist:
                 messages.info(self.request, "This order does not exist.")
                 return redirect("core:request-refund")
+
+
+@staff_member_required
+def export_orders(request):
+    # ?format=csv|jsonl&since=YYYY-MM-DD&until=YYYY-MM-DD&status=...
+    form = OrderExportForm(request.GET)
+    if not form.is_valid():
+        return JsonResponse({'errors': form.errors}, status=400)
+    data = form.cleaned_data
+    orders = exports.filter_orders(
+        Order.objects.all(), data['since'], data['until'], data['status'])
+    return exports.export_response(orders, data['format'] or 'csv')
+
+
+SALES_METRICS = ['orders', 'units', 'revenue', 'discount', 'refund_requests',
+                 'refunds_granted']
+SALES_DASHBOARD_DAYS = 30
+
+
+@method_decorator(staff_member_required, name='dispatch')
+class SalesDashboardView(TemplateView):
+    # Reads the rollups only (see core.rollups), never the orders
+    template_name = "sales_dashboard.html"
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        try:
+            days = min(max(int(self.request.GET['days']), 1), 366)
+        except (KeyError, ValueError):
+            days = SALES_DASHBOARD_DAYS
+        last = timezone.localdate()
+        first = last - timedelta(days=days - 1)
+        in_range = {'date__gte': first, 'date__lte': last}
+
+        stored = {row.date: row
+                  for row in DailySales.objects.filter(**in_range)}
+        # Days without sales get a row of zeros
+        daily = [stored.get(day) or DailySales(date=day)
+                 for day in (last - timedelta(days=offset)
+                             for offset in range(days))]
+        sums = {metric: Sum(metric) for metric in SALES_METRICS}
+        categories = dict(CATEGORY_CHOICES)
+        context.update({
+            'days': days,
+            'daily': daily,
+            'totals': {metric: sum(getattr(row, metric) for row in daily)
+                       for metric in SALES_METRICS},
+            'top_items': DailyItemSales.objects.filter(**in_range).values(
+                'item__title', 'item__slug').annotate(**sums).order_by(
+                '-revenue')[:10],
+            'categories': [
+                dict(row, name=categories.get(row['category'],
+                                              row['category']))
+                for row in DailyCategorySales.objects.filter(
+                    **in_range).values('category').annotate(
+                    **sums).order_by('-revenue')],
+            'updated_at': RollupWatermark.objects.filter(
+                name=SALES_WATERMARK).values_list(
+                'timestamp', flat=True).first(),
+        })
+        return context
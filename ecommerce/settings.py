@@ -46,12 +46,14 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'core.middleware.RequestTimingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
+    'core.middleware.GuestCartMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware'
 ]
 
@@ -108,6 +110,20 @@ DATABASES = {
     }
 }
 
+# CACHE
+
+# Local to each process unless CACHE_BACKEND/CACHE_LOCATION point at a
+# shared one (e.g. memcached). The catalog versions keying the cached
+# fragments and the ETags are read from the database (core.caching),
+# so a per-process cache is never stale, only cold in each worker
+CACHES = {
+    'default': {
+        'BACKEND': os.environ.get(
+            'CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.environ.get('CACHE_LOCATION', ''),
+    }
+}
+
 if ENVIRONMENT == 'production':
     DEBUG = False
     SECRET_KEY = os.environ.get('SECRET_KEY')
@@ -127,3 +143,11 @@ CRISPY_TEMPLATE_PACK = 'bootstrap4'
 STRIPE_SECRET_KEY = os.environ.get('STRIPE_SECRET_KEY')
 STRIPE_PUBLIC_KEY = os.environ.get('STRIPE_PUBLIC_KEY')
 STRIPE_WEBHOOK_KEY = os.environ.get('STRIPE_WEBHOOK_KEY')
+
+# REQUEST TIMING
+
+# Fraction of requests whose queries and templates are timed for the
+# Server-Timing header, and the duration above which a request is logged
+REQUEST_TIMING_SAMPLE_RATE = float(os.environ.get(
+    'REQUEST_TIMING_SAMPLE_RATE', 1 if DEBUG else 0.1))
+REQUEST_TIMING_SLOW_MS = int(os.environ.get('REQUEST_TIMING_SLOW_MS', 500))